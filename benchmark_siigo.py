@@ -0,0 +1,440 @@
+"""Benchmark de la Herramienta SIIGO v2
+
+Genera reportes sintéticos parecidos a los exportados por Sofia (Reporte 1 de
+productos y Reporte 2 de facturas) en .xlsx, .xls binario, .xls HTML, CSV y
+Parquet, y mide por separado cada etapa del pipeline: tiempo de reloj, tiempo
+de CPU, pico de memoria (tracemalloc), memoria del DataFrame resultante y
+registros de entrada/salida. Con --compacto mide el modo de memoria compacta. Antes de
+las etapas mide, en procesos nuevos, el tiempo de arranque de la aplicación.
+
+Los resultados se agregan como líneas JSON a benchmarks/resultados.jsonl para
+poder comparar ejecuciones a lo largo del tiempo.
+
+Uso:
+    python benchmark_siigo.py --tamanos 10000 100000 --formatos xlsx html
+"""
+import argparse
+import csv
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import openpyxl
+import pandas as pd
+
+import importador_siigo
+from importador_siigo import (CacheReportes, DataProcessor, ExcelExporter, FileManager, MemoriaCompacta,
+                              COLUMNAS_REPORTE1, COLUMNAS_REPORTE2)
+
+try:
+    import xlwt
+except ImportError:  # Solo se necesita para generar .xls binarios
+    xlwt = None
+
+
+CARPETA_BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+TAMANOS = [10_000, 100_000, 1_000_000]
+FORMATOS = ["xlsx", "xls", "html", "csv", "parquet"]
+MAX_FILAS_XLS = 65_535  # Límite de filas de una hoja BIFF8
+
+USUARIOS = ["ana.perez", "Pedro Gomez", "MARIA.LOPEZ", "luis gomez", "caja1", "caja2",
+            "recepcion.norte", "recepcion.sur", "Facturacion", "jdiaz", "mrojas", "srodriguez"]
+EXAMENES = ["Audiometría", "Visiometría", "Optometría", "Examen médico ocupacional",
+            "Espirometría", "Cuadro hemático", "Glicemia", "Perfil lipídico",
+            "Electrocardiograma", "Prueba psicosensométrica", "Rayos X de tórax", "Vacuna tétanos"]
+
+
+class GeneradorReportes:
+    """Genera pares de reportes sintéticos reproducibles"""
+
+    COLUMNAS_R1 = ["factura", "fecha", "sede", "codigo", "referencia", "paciente",
+                   "cantidad", "valor_total", "descuento"]
+    COLUMNAS_R2 = ["numero", "f_fact", "NitEmpresa", "Empresa", "total", "estado",
+                   "sede", "usuario"]
+
+    @staticmethod
+    def datos(filas: int, semilla: int = 2025):
+        """Devuelve las filas de ambos reportes (≈3 líneas de producto por factura)"""
+        rnd = random.Random(semilla)
+        num_facturas = max(1, filas // 3)
+        inicio = datetime(2025, 1, 1)
+
+        facturas = []
+        for i in range(num_facturas):
+            # ~10% de consecutivos que no son de SIIGO (no empiezan con 'E')
+            prefijo = "E" if rnd.random() > 0.1 else rnd.choice(["P", "NC"])
+            numero = f"{prefijo}{100000 + i}"
+            nit = None if rnd.random() < 0.02 else f"{rnd.randint(800000000, 999999999)}-{rnd.randint(0, 9)}"
+            fecha = inicio + timedelta(days=rnd.randint(0, 89), minutes=rnd.randint(0, 600))
+            facturas.append([numero, fecha, nit, f"Empresa {i % 500}", 0.0,
+                             rnd.choice(["Activa", "Activa", "Anulada"]), rnd.choice(["Norte", "Sur"]),
+                             rnd.choice(USUARIOS)])
+
+        productos = []
+        totales = [0.0] * num_facturas
+        for _ in range(filas):
+            idx = rnd.randrange(num_facturas)
+            cantidad = rnd.randint(1, 4)
+            valor = 0 if rnd.random() < 0.05 else cantidad * rnd.choice([12000, 18500, 25000, 43750.5])
+            totales[idx] += valor
+            factura = facturas[idx][0] if rnd.random() > 0.01 else f"E{900000000 + idx}"
+            examen = rnd.randrange(len(EXAMENES))
+            productos.append([factura, facturas[idx][1], facturas[idx][6], f"EX{examen:03d}",
+                              EXAMENES[examen], f"Paciente {rnd.randint(1, 50000)}", cantidad, valor, 0])
+
+        for idx, total in enumerate(totales):
+            facturas[idx][4] = round(total, 2)
+        return productos, facturas
+
+    @staticmethod
+    def escribir_xlsx(ruta: str, columnas: list, filas: list):
+        """Escribe un .xlsx en modo write-only con una hoja de resumen antes de los datos"""
+        wb = openpyxl.Workbook(write_only=True)
+        resumen = wb.create_sheet("Resumen")
+        resumen.append(["Concepto", "Valor"])
+        resumen.append(["Registros", len(filas)])
+        ws = wb.create_sheet("Datos")
+        ws.append(columnas)
+        for fila in filas:
+            ws.append(fila)
+        wb.save(ruta)
+
+    @staticmethod
+    def escribir_xls(ruta: str, columnas: list, filas: list):
+        """Escribe un .xls binario (requiere xlwt)"""
+        wb = xlwt.Workbook()
+        resumen = wb.add_sheet("Resumen")
+        resumen.write(0, 0, "Registros")
+        resumen.write(0, 1, len(filas))
+        ws = wb.add_sheet("Datos")
+        formato_fecha = xlwt.easyxf(num_format_str="YYYY-MM-DD HH:MM")
+        for c, nombre in enumerate(columnas):
+            ws.write(0, c, nombre)
+        for r, fila in enumerate(filas, start=1):
+            for c, valor in enumerate(fila):
+                if isinstance(valor, datetime):
+                    ws.write(r, c, valor, formato_fecha)
+                elif valor is not None:
+                    ws.write(r, c, valor)
+        wb.save(ruta)
+
+    @staticmethod
+    def escribir_html(ruta: str, columnas: list, filas: list):
+        """Escribe un .xls que en realidad es HTML, como los que exporta Sofia"""
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write("<table><tr><th>Reporte</th><th>Generado</th></tr>"
+                    f"<tr><td>Sofia</td><td>{datetime.now():%Y-%m-%d}</td></tr></table>\n")
+            f.write("<table>\n<tr>" + "".join(f"<th>{c}</th>" for c in columnas) + "</tr>\n")
+            for fila in filas:
+                celdas = ("" if v is None else (v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime) else v)
+                          for v in fila)
+                f.write("<tr>" + "".join(f"<td>{v}</td>" for v in celdas) + "</tr>\n")
+            f.write("</table>\n")
+
+    @staticmethod
+    def escribir_csv(ruta: str, columnas: list, filas: list):
+        """Escribe un CSV con punto y coma en Windows-1252, como el que exporta Sofia"""
+        with open(ruta, "w", encoding="cp1252", errors="replace", newline="") as f:
+            escritor = csv.writer(f, delimiter=";")
+            escritor.writerow(columnas)
+            escritor.writerows(filas)
+
+    @staticmethod
+    def escribir_parquet(ruta: str, columnas: list, filas: list):
+        """Escribe un Parquet como los extractos del equipo de datos (requiere pyarrow)"""
+        pd.DataFrame(filas, columns=columnas).to_parquet(ruta, index=False)
+
+    @staticmethod
+    def generar(filas: int, formato: str, carpeta: str) -> tuple:
+        """Genera (o reutiliza) el par de reportes y devuelve sus rutas"""
+        os.makedirs(carpeta, exist_ok=True)
+        extension = formato if formato in ("xlsx", "csv", "parquet") else "xls"
+        sufijo = "" if formato != "html" else "_html"
+        r1 = os.path.join(carpeta, f"reporte1_{filas}{sufijo}.{extension}")
+        r2 = os.path.join(carpeta, f"reporte2_{filas}{sufijo}.{extension}")
+        if os.path.exists(r1) and os.path.exists(r2):
+            return r1, r2
+
+        productos, facturas = GeneradorReportes.datos(filas)
+        escribir = {"xlsx": GeneradorReportes.escribir_xlsx,
+                    "xls": GeneradorReportes.escribir_xls,
+                    "html": GeneradorReportes.escribir_html,
+                    "csv": GeneradorReportes.escribir_csv,
+                    "parquet": GeneradorReportes.escribir_parquet}[formato]
+        escribir(r1, GeneradorReportes.COLUMNAS_R1, productos)
+        escribir(r2, GeneradorReportes.COLUMNAS_R2, facturas)
+        return r1, r2
+
+
+def medir(etapa: str, funcion, filas_entrada: int, memoria: bool = True) -> tuple:
+    """Ejecuta una etapa midiendo tiempo y CPU; con memoria=True repite bajo tracemalloc
+
+    La medición de memoria se hace en una segunda ejecución para que el costo
+    de tracemalloc no contamine los tiempos.
+    """
+    gc.collect()
+    inicio, inicio_cpu = time.perf_counter(), time.process_time()
+    resultado = funcion()
+    segundos, cpu = time.perf_counter() - inicio, time.process_time() - inicio_cpu
+
+    pico_mb = None
+    if memoria:
+        del resultado
+        gc.collect()
+        tracemalloc.start()
+        resultado = funcion()
+        pico_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    filas_salida = len(resultado[0] if isinstance(resultado, tuple) else resultado) \
+        if not isinstance(resultado, str) else filas_entrada
+    principal = resultado[0] if isinstance(resultado, tuple) else resultado
+    registro = {
+        "etapa": etapa,
+        "segundos": round(segundos, 4),
+        "cpu_segundos": round(cpu, 4),
+        "pico_memoria_mb": None if pico_mb is None else round(pico_mb, 2),
+        "memoria_df_mb": round(MemoriaCompacta.memoria_mb(principal), 2)
+        if isinstance(principal, pd.DataFrame) else None,
+        "filas_entrada": filas_entrada,
+        "filas_salida": filas_salida,
+    }
+    return resultado, registro
+
+
+def ejecutar_pipeline(r1_ruta: str, r2_ruta: str, memoria: bool, carpeta_salida: str,
+                      compacto: bool = False) -> list:
+    """Mide cada etapa del pipeline sobre un par de reportes"""
+    # Las cargas se miden en frío: sin caché en disco ni hojas recordadas
+    CacheReportes.habilitada = False
+    FileManager._hojas_detectadas.clear()
+    registros = []
+
+    def cargar(ruta, columnas, columnas_opcionales=None):
+        # Las mismas columnas que ProcesoSiigo.leer_reporte: sin "usuario" el filtro no haría nada
+        FileManager._hojas_detectadas.clear()
+        df = FileManager.cargar_hoja_con_columnas(ruta, columnas, columnas_opcionales)
+        return MemoriaCompacta.compactar(df) if compacto else df
+
+    r1, reg = medir("cargar_hoja_con_columnas[r1]", lambda: cargar(r1_ruta, COLUMNAS_REPORTE1), 0, memoria)
+    registros.append(reg)
+    r2, reg = medir("cargar_hoja_con_columnas[r2]", lambda: cargar(r2_ruta, COLUMNAS_REPORTE2, ["usuario"]), 0,
+                    memoria)
+    registros.append(reg)
+
+    r1_p, reg = medir("procesar_reporte1", lambda: DataProcessor.procesar_reporte1(r1), len(r1), memoria)
+    registros.append(reg)
+
+    (r2_f, _, _), reg = medir("aplicar_filtro_usuario",
+                              lambda: DataProcessor.aplicar_filtro_usuario(r2, "gomez"), len(r2), memoria)
+    registros.append(reg)
+
+    r2_p, reg = medir("procesar_reporte2", lambda: DataProcessor.procesar_reporte2(r2), len(r2), memoria)
+    registros.append(reg)
+
+    (r1_p, r2_p, _), reg = medir("filtrar_para_combinar",
+                                 lambda: DataProcessor.filtrar_para_combinar(r1_p, r2_p), len(r1_p), memoria)
+    registros.append(reg)
+
+    df, reg = medir("combinar_reportes", lambda: DataProcessor.combinar_reportes(r1_p, r2_p),
+                    len(r1_p), memoria)
+    registros.append(reg)
+
+    df, reg = medir("limpiar_datos", lambda: DataProcessor.limpiar_datos(df.copy()), len(df), memoria)
+    registros.append(reg)
+
+    df_final, reg = medir("preparar_estructura_final",
+                          lambda: DataProcessor.preparar_estructura_final(df.copy(), True), len(df), memoria)
+    registros.append(reg)
+
+    archivo, reg = medir("generar_archivo",
+                         lambda: ExcelExporter.generar_archivo(df_final, FileManager.obtener_ruta_recurso(
+                             "plantilla_siigo.xlsx"), carpeta_exportados=carpeta_salida),
+                         len(df_final), memoria)
+    registros.append(reg)
+
+    # Mismo archivo con el motor xlsxwriter (constant_memory), comparado celda por celda con el de openpyxl
+    if importador_siigo.xlsxwriter is not None:
+        archivo_xw, reg = medir("generar_archivo[xlsxwriter]",
+                                lambda: ExcelExporter.generar_archivo(df_final, FileManager.obtener_ruta_recurso(
+                                    "plantilla_siigo.xlsx"), carpeta_exportados=carpeta_salida,
+                                    sufijo="xlsxwriter", motor="xlsxwriter"),
+                                len(df_final), memoria)
+        reg["diferencias_openpyxl"] = comparar_archivos(archivo, archivo_xw)
+        registros.append(reg)
+    return registros
+
+
+def comparar_archivos(ruta_a: str, ruta_b: str) -> list:
+    """Diferencias celda por celda entre dos archivos SIIGO (lista vacía si son equivalentes)
+
+    Compara valor y tipo de cada celda, el estilo y los comentarios del
+    encabezado, el formato de las fechas, los anchos y estilos de columna, el
+    alto del encabezado y el zoom de la hoja. Un texto vacío y una celda en
+    blanco se consideran iguales.
+    """
+    def estilo(celda):
+        return (celda.number_format, celda.font.name, celda.font.sz, celda.font.b,
+                celda.font.color.value if celda.font.color is not None else None,
+                celda.fill.patternType, celda.fill.fgColor.value,
+                tuple(getattr(celda.border, lado).style for lado in ("left", "right", "top", "bottom")),
+                celda.alignment.horizontal, celda.alignment.vertical, celda.alignment.wrap_text)
+
+    diferencias = []
+    libro_a = openpyxl.load_workbook(ruta_a, read_only=False)
+    libro_b = openpyxl.load_workbook(ruta_b, read_only=False)
+    a, b = libro_a.active, libro_b.active
+    if a.title != b.title or a.row_dimensions[1].height != b.row_dimensions[1].height:
+        diferencias.append("hoja: título o alto del encabezado")
+    if a.sheet_view.zoomScale != b.sheet_view.zoomScale:
+        diferencias.append(f"zoom: {a.sheet_view.zoomScale} != {b.sheet_view.zoomScale}")
+    for letra in set(a.column_dimensions) | set(b.column_dimensions):
+        columna_a, columna_b = a.column_dimensions[letra], b.column_dimensions[letra]
+        if abs((columna_a.width or 0) - (columna_b.width or 0)) > 1e-6:
+            diferencias.append(f"ancho de la columna {letra}")
+        if (columna_a.number_format, columna_a.font.name, columna_a.protection.locked) != \
+                (columna_b.number_format, columna_b.font.name, columna_b.protection.locked):
+            diferencias.append(f"estilo de la columna {letra}")
+    for celda_a, celda_b in zip(a[1], b[1]):
+        comentario_a = (celda_a.comment.text, celda_a.comment.author) if celda_a.comment else None
+        comentario_b = (celda_b.comment.text, celda_b.comment.author) if celda_b.comment else None
+        if comentario_a != comentario_b:
+            diferencias.append(f"{celda_a.coordinate}: comentario distinto")
+    if a.max_row != b.max_row:
+        diferencias.append(f"filas: {a.max_row} != {b.max_row}")
+    for fila_a, fila_b in zip(a.iter_rows(), b.iter_rows()):
+        for celda_a, celda_b in zip(fila_a, fila_b):
+            valor_a = None if celda_a.value == "" else celda_a.value
+            valor_b = None if celda_b.value == "" else celda_b.value
+            if valor_a != valor_b or type(valor_a) is not type(valor_b):
+                diferencias.append(f"{celda_a.coordinate}: {valor_a!r} != {valor_b!r}")
+            elif (celda_a.row == 1 or celda_a.is_date) and estilo(celda_a) != estilo(celda_b):
+                diferencias.append(f"{celda_a.coordinate}: estilo distinto")
+            if len(diferencias) >= 20:
+                return diferencias
+    return diferencias
+
+
+# Fragmentos que se ejecutan en un intérprete nuevo para medir el arranque en frío
+ARRANQUE = {
+    "importar_modulo": "import importador_siigo",
+    "precargar_librerias": "import importador_siigo; importador_siigo.precargar_modulos()",
+    "primera_ventana": "import importador_siigo; app = importador_siigo.ModernSiigoApp(); app.root.update(); "
+                       "app.root.destroy()",
+}
+
+
+def medir_arranque(repeticiones: int = 3) -> list:
+    """Mide en procesos nuevos cuánto tarda en importarse el módulo y en pintarse la ventana
+
+    Se toma el mejor de varios intentos para que el ruido del disco no tape
+    una regresión. Sin pantalla disponible la ventana se omite.
+    """
+    carpeta = os.path.dirname(os.path.abspath(__file__))
+    registros = []
+    for etapa, codigo in ARRANQUE.items():
+        programa = (f"import time; inicio = time.perf_counter(); {codigo}; "
+                    f"print(time.perf_counter() - inicio)")
+        tiempos = []
+        for _ in range(repeticiones):
+            proceso = subprocess.run([sys.executable, "-c", programa], capture_output=True, text=True,
+                                     cwd=carpeta)
+            if proceso.returncode != 0:
+                break
+            tiempos.append(float(proceso.stdout.strip().splitlines()[-1]))
+        registros.append({
+            "etapa": f"arranque[{etapa}]",
+            "segundos": round(min(tiempos), 4) if tiempos else None,
+            "repeticiones": len(tiempos),
+        })
+    return registros
+
+
+def contexto() -> dict:
+    """Datos del entorno que permiten comparar resultados entre ejecuciones"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "openpyxl": openpyxl.__version__,
+        "xlsxwriter": importador_siigo.xlsxwriter.__version__ if importador_siigo.xlsxwriter is not None else None,
+        "plataforma": platform.platform(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark por etapas de la Herramienta SIIGO v2")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS,
+                        help="Filas del Reporte 1 a generar (por defecto 10000 100000 1000000)")
+    parser.add_argument("--formatos", nargs="+", choices=FORMATOS, default=FORMATOS)
+    parser.add_argument("--salida", default=os.path.join(CARPETA_BENCHMARKS, "resultados.jsonl"),
+                        help="Archivo JSON Lines donde se agregan los resultados")
+    parser.add_argument("--datos", default=os.path.join(CARPETA_BENCHMARKS, "datos"),
+                        help="Carpeta donde se generan (y reutilizan) los reportes sintéticos")
+    parser.add_argument("--sin-memoria", action="store_true",
+                        help="No repetir cada etapa bajo tracemalloc")
+    parser.add_argument("--compacto", action="store_true",
+                        help="Usar el modo de memoria compacta (MemoriaCompacta)")
+    parser.add_argument("--sin-arranque", action="store_true",
+                        help="No medir el tiempo de arranque de la aplicación")
+    args = parser.parse_args()
+
+    entorno = {**contexto(), "compacto": args.compacto}
+    os.makedirs(os.path.dirname(os.path.abspath(args.salida)), exist_ok=True)
+    carpeta_salida = tempfile.mkdtemp(prefix="siigo_bench_")
+    try:
+        with open(args.salida, "a", encoding="utf-8") as salida:
+            if not args.sin_arranque:
+                print("-- arranque", flush=True)
+                for registro in medir_arranque():
+                    salida.write(json.dumps({**entorno, **registro}, ensure_ascii=False) + "\n")
+                    tiempo = "sin pantalla" if registro["segundos"] is None else f"{registro['segundos']:>9.3f} s"
+                    print(f"   {registro['etapa']:<32} {tiempo}")
+                salida.flush()
+
+            for tamano in args.tamanos:
+                for formato in args.formatos:
+                    if formato == "xls" and (xlwt is None or tamano > MAX_FILAS_XLS):
+                        motivo = "xlwt no instalado" if xlwt is None else f"más de {MAX_FILAS_XLS} filas"
+                        print(f"-- {formato} {tamano:,}: omitido ({motivo})")
+                        continue
+                    if formato == "parquet" and importador_siigo.pq is None:
+                        print(f"-- {formato} {tamano:,}: omitido (pyarrow no instalado)")
+                        continue
+
+                    print(f"-- {formato} {tamano:,}: generando datos...", flush=True)
+                    r1, r2 = GeneradorReportes.generar(tamano, formato, args.datos)
+                    for registro in ejecutar_pipeline(r1, r2, not args.sin_memoria, carpeta_salida, args.compacto):
+                        registro = {**entorno, "tamano": tamano, "formato": formato, **registro}
+                        salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                        memoria = "" if registro["pico_memoria_mb"] is None \
+                            else f"{registro['pico_memoria_mb']:>10.1f} MB"
+                        print(f"   {registro['etapa']:<32} {registro['segundos']:>9.3f} s "
+                              f"{registro['cpu_segundos']:>9.3f} s CPU {memoria} "
+                              f"{registro['filas_entrada']:>10,} -> {registro['filas_salida']:,}")
+                        if registro.get("diferencias_openpyxl"):
+                            print("      ¡Difiere del archivo de openpyxl!", *registro["diferencias_openpyxl"][:5],
+                                  sep="\n      ")
+                    salida.flush()
+    finally:
+        shutil.rmtree(carpeta_salida, ignore_errors=True)
+    print(f"\nResultados agregados a {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,1053 @@
-import pandas as pd
-import customtkinter as ctk
+from __future__ import annotations
+
+import time
+
+# Referencia para medir cuánto tarda en aparecer la ventana
+INICIO_APLICACION = time.perf_counter()
+
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import os
 import sys
-import openpyxl
-from openpyxl.styles import numbers
-from openpyxl.utils.dataframe import dataframe_to_rows
-from datetime import datetime
+import importlib
+import importlib.util
+from datetime import datetime, date
 import logging
-from typing import Tuple, Optional
+import re
+import queue
+import threading
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Tuple, Optional, Iterable, Iterator, Union, Callable
+import hashlib
+import sqlite3
+import bisect
+import csv
+import codecs
+import tempfile
+import weakref
+import cProfile
+import pstats
+import ctypes
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: el pico de memoria se consulta con la API de psapi
+    resource = None
+
+
+class ModuloDiferido:
+    """Módulo (o atributo de un módulo) que se importa la primera vez que se usa
+
+    pandas, numpy, openpyxl y compañía tardan en importarse más que la
+    ventana en aparecer; así la interfaz se muestra primero y las librerías
+    se cargan al elegir un archivo o en segundo plano (ver precargar_modulos).
+    """
+    
+    def __init__(self, nombre: str, atributo: Optional[str] = None):
+        self._nombre = nombre
+        self._atributo = atributo
+        self._objeto = None
+
+    def _cargar(self):
+        """Importa el módulo si todavía no se importó y devuelve el objeto real"""
+        if self._objeto is None:
+            objeto = importlib.import_module(self._nombre)
+            self._objeto = getattr(objeto, self._atributo) if self._atributo else objeto
+        return self._objeto
+
+    def __getattr__(self, nombre: str):
+        return getattr(self._cargar(), nombre)
+
+    def __call__(self, *args, **kwargs):
+        return self._cargar()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        estado = "cargado" if self._objeto is not None else "sin cargar"
+        return f"<ModuloDiferido {self._nombre}{'.' + self._atributo if self._atributo else ''} ({estado})>"
+
+
+pd = ModuloDiferido("pandas")
+np = ModuloDiferido("numpy")
+ctk = ModuloDiferido("customtkinter")
+openpyxl = ModuloDiferido("openpyxl")
+dataframe_to_rows = ModuloDiferido("openpyxl.utils.dataframe", "dataframe_to_rows")
+WriteOnlyCell = ModuloDiferido("openpyxl.cell", "WriteOnlyCell")
+Comentario = ModuloDiferido("openpyxl.comments", "Comment")
+tostring = ModuloDiferido("openpyxl.xml.functions", "tostring")
+fromstring = ModuloDiferido("openpyxl.xml.functions", "fromstring")
+TextParser = ModuloDiferido("pandas.io.parsers", "TextParser")
+xlrd = ModuloDiferido("xlrd")
+etree = ModuloDiferido("lxml.etree")
+
+# La caché de reportes y los kernels de texto de Arrow son opcionales
+if importlib.util.find_spec("pyarrow") is not None:
+    pa = ModuloDiferido("pyarrow")
+    pc = ModuloDiferido("pyarrow.compute")
+    pq = ModuloDiferido("pyarrow.parquet")
+else:
+    pa = None
+    pc = None
+    pq = None
+
+# Motor de exportación alternativo (opcional; ver ExcelExporter.MOTORES)
+if importlib.util.find_spec("xlsxwriter") is not None:
+    xlsxwriter = ModuloDiferido("xlsxwriter")
+    ColorXlsx = ModuloDiferido("xlsxwriter.color", "Color")
+else:
+    xlsxwriter = None
+    ColorXlsx = None
+
+# Lo que precargar_modulos importa en segundo plano, en orden de uso
+MODULOS_DATOS = [modulo for modulo in (np, pd, TextParser, openpyxl, WriteOnlyCell, dataframe_to_rows,
+                                       xlrd, etree, pa, pc, pq) if modulo is not None]
+
+
+def precargar_modulos():
+    """Importa las librerías de datos (pensada para un hilo de fondo con la ventana ya visible)"""
+    inicio = time.perf_counter()
+    for modulo in MODULOS_DATOS:
+        try:
+            modulo._cargar()
+        except ImportError:
+            logging.exception("No se pudo precargar %s", modulo)
+    logging.info("Librerías de datos precargadas en %.2f s", time.perf_counter() - inicio)
+
+
+# Filas por lote en la lectura por streaming de reportes grandes
+TAMANO_LOTE = 50_000
+
+# Columnas requeridas de cada reporte
+COLUMNAS_REPORTE1 = ["factura", "codigo", "referencia", "cantidad", "valor_total"]
+COLUMNAS_REPORTE2 = ["NitEmpresa", "f_fact", "numero", "total"]
+
+# Columnas de la plantilla SIIGO, en orden
+COLUMNAS_SIIGO = [
+    "Tipo de comprobante", "Consecutivo", "Identificación tercero", "Sucursal", 
+    "Código centro/subcentro de costos", "Fecha de elaboración", "Sigla Moneda", 
+    "Tasa de cambio", "Nombre contacto", "Email Contacto", "Orden de compra", 
+    "Orden de entrega", "Fecha orden de entrega", "Código producto", 
+    "Descripción producto", "Identificación vendedor", "Código de Bodega", 
+    "Cantidad producto", "Valor unitario", "Valor Descuento", "Base AIU",
+    "Identificación ingreso para terceros", "Código impuesto cargo", 
+    "Código impuesto cargo dos", "Código impuesto retención", "Código ReteICA", 
+    "Código ReteIVA", "Código forma de pago", "Valor Forma de Pago", 
+    "Fecha Vencimiento", "Observaciones"
+]
+
+# Columnas de valor fijo. Estas y las que no trae el DataFrame (vacías) son
+# virtuales: no ocupan memoria y el exportador las completa al escribir
+VALORES_FIJOS_SIIGO = {"Tipo de comprobante": 1, "Identificación vendedor": 807001777}
+
+# Columnas numéricas cuyos nulos se exportan como texto vacío
+COLUMNAS_EN_BLANCO_SIIGO = ["Valor Forma de Pago"]
+
+# Posición de "Fecha de elaboración", la columna que se exporta con ExcelExporter.FORMATO_FECHA
+_INDICE_FECHA = COLUMNAS_SIIGO.index("Fecha de elaboración")
+
+# Normalización de espacios que aplica pd.read_html al texto de las celdas
+_RE_ESPACIOS_HTML = re.compile(r"[\r\n]+|\s{2,}")
+
+# Número con coma decimal y, opcionalmente, punto de miles (como 43750,5 o 1.234,5)
+_PATRON_COMA_DECIMAL = re.compile(r"-?(?:\d{1,3}(?:\.\d{3})+|\d+),\d+")
+
+# Consecutivo de SIIGO sin sus 'E' iniciales (no coincide si no empieza con 'E') y NIT sin dígito de verificación
+_PATRON_CONSECUTIVO_SIIGO = r"(?s)^[Ee]+(?P<consecutivo>.*)"
+_PATRON_NIT = r"^(?P<nit>[^-]*)"
+
+
+def directorio_aplicacion() -> str:
+    """Carpeta del ejecutable (PyInstaller) o del script, donde viven el log y la caché"""
+    return os.path.dirname(os.path.abspath(sys.executable if getattr(sys, 'frozen', False) else __file__))
+
+
+def configurar_logging():
+    """Configura el log siigo_log.txt junto a la aplicación"""
+    logging.basicConfig(
+        filename=os.path.join(directorio_aplicacion(), "siigo_log.txt"),
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+
+class CacheReportes:
+    """Caché en disco (Parquet) de reportes ya parseados, con expulsión LRU por tamaño
+
+    La clave combina el hash SHA-256 del contenido del archivo con el
+    conjunto de columnas pedido, de modo que renombrar o mover el archivo no
+    invalida la entrada y cualquier cambio en su contenido sí lo hace.
+    """
+    
+    habilitada = True
+    carpeta: Optional[str] = None  # Por defecto, "cache_reportes" junto al log
+    tamano_maximo = 1024 * 1024 * 1024  # 1 GB
+    
+    # Hash ya calculado por (ruta, tamaño, fecha de modificación)
+    _hashes: dict = {}
+    
+    @staticmethod
+    def disponible() -> bool:
+        """Indica si la caché puede usarse (requiere pyarrow)"""
+        return CacheReportes.habilitada and pq is not None
+
+    @staticmethod
+    def obtener_carpeta() -> str:
+        """Carpeta donde se guardan las entradas de la caché"""
+        return CacheReportes.carpeta or os.path.join(directorio_aplicacion(), "cache_reportes")
+
+    @staticmethod
+    def hash_archivo(archivo: str) -> str:
+        """Calcula el SHA-256 del contenido del archivo, leyendo por bloques"""
+        info = os.stat(archivo)
+        clave = (os.path.abspath(archivo), info.st_size, info.st_mtime_ns)
+        if clave not in CacheReportes._hashes:
+            digest = hashlib.sha256()
+            with open(archivo, "rb") as f:
+                for bloque in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(bloque)
+            CacheReportes._hashes[clave] = digest.hexdigest()
+        return CacheReportes._hashes[clave]
+
+    @staticmethod
+    def ruta_entrada(archivo: str, columnas: list, modo: str) -> str:
+        """Ruta del archivo Parquet que corresponde al contenido y columnas pedidas"""
+        firma = "|".join([CacheReportes.hash_archivo(archivo), modo, *map(str, columnas)])
+        nombre = hashlib.sha256(firma.encode("utf-8")).hexdigest()[:40]
+        return os.path.join(CacheReportes.obtener_carpeta(), f"{nombre}.parquet")
+
+    @staticmethod
+    def obtener(archivo: str, columnas: list, modo: str) -> Optional[pd.DataFrame]:
+        """Devuelve el DataFrame cacheado o None si no hay entrada"""
+        if not CacheReportes.disponible():
+            return None
+        try:
+            ruta = CacheReportes.ruta_entrada(archivo, columnas, modo)
+            if not os.path.exists(ruta):
+                return None
+            df = pd.read_parquet(ruta)
+            os.utime(ruta)  # Marca la entrada como usada recientemente
+        except Exception as e:
+            logging.warning("No se pudo leer la caché de %s: %s", archivo, e)
+            return None
+        
+        # read_excel deja NaN (no None) en las columnas de texto
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].notna(), float("nan"))
+        logging.info("Reporte servido desde caché: %s", archivo)
+        return df
+
+    @staticmethod
+    def guardar(archivo: str, columnas: list, modo: str, df: pd.DataFrame):
+        """Guarda un DataFrame parseado; los fallos solo se registran"""
+        escritor = CacheReportes.escritor(archivo, columnas, modo)
+        escritor.agregar(df)
+        escritor.confirmar()
+
+    @staticmethod
+    def escritor(archivo: str, columnas: list, modo: str) -> "EscritorCache":
+        """Crea un escritor para guardar un reporte lote a lote"""
+        if not CacheReportes.disponible():
+            return EscritorCache(None)
+        try:
+            return EscritorCache(CacheReportes.ruta_entrada(archivo, columnas, modo))
+        except OSError as e:
+            logging.warning("No se pudo preparar la caché de %s: %s", archivo, e)
+            return EscritorCache(None)
+
+    @staticmethod
+    def depurar():
+        """Elimina las entradas usadas hace más tiempo hasta respetar el tamaño máximo"""
+        try:
+            entradas = [e for e in os.scandir(CacheReportes.obtener_carpeta())
+                        if e.is_file() and e.name.endswith(".parquet")]
+        except FileNotFoundError:
+            return
+        entradas.sort(key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entradas)
+        for entrada in entradas:
+            if total <= CacheReportes.tamano_maximo:
+                break
+            tamano = entrada.stat().st_size
+            try:
+                os.remove(entrada.path)
+            except OSError:
+                continue
+            total -= tamano
+
+
+class EscritorCache:
+    """Escribe una entrada de CacheReportes de forma incremental y atómica"""
+    
+    def __init__(self, ruta: Optional[str]):
+        self.ruta = ruta
+        self.ruta_temporal = None
+        self.writer = None
+        self.schema = None
+
+    def agregar(self, df: pd.DataFrame):
+        """Agrega un lote; ante un error la entrada se descarta sin interrumpir la carga"""
+        if self.ruta is None:
+            return
+        try:
+            if self.writer is None:
+                os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+                fd, self.ruta_temporal = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(self.ruta))
+                os.close(fd)
+                tabla = pa.Table.from_pandas(df, preserve_index=False)
+                self.schema = tabla.schema
+                self.writer = pq.ParquetWriter(self.ruta_temporal, self.schema)
+            else:
+                tabla = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            self.writer.write_table(tabla)
+        except Exception as e:
+            logging.info("Reporte no cacheado (%s): %s", os.path.basename(self.ruta), e)
+            self.descartar()
+
+    def confirmar(self):
+        """Publica la entrada escrita y aplica el límite de tamaño de la caché"""
+        if self.ruta is None or self.writer is None:
+            return
+        try:
+            self.writer.close()
+            os.replace(self.ruta_temporal, self.ruta)
+        except Exception as e:
+            logging.warning("No se pudo guardar la caché %s: %s", self.ruta, e)
+            self.descartar()
+            return
+        self.writer = None
+        CacheReportes.depurar()
+
+    def descartar(self):
+        """Abandona la entrada y borra el archivo temporal"""
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+        if self.ruta_temporal and os.path.exists(self.ruta_temporal):
+            os.remove(self.ruta_temporal)
+        self.ruta = None
+        self.writer = None
 
 
 class FileManager:
     """Maneja la carga y validación de archivos"""
     
+    # Hoja detectada por (ruta, tamaño, fecha de modificación, columnas)
+    _hojas_detectadas: dict = {}
+    
     @staticmethod
     def obtener_ruta_recurso(nombre_archivo: str) -> str:
         """Obtiene la ruta del recurso considerando PyInstaller"""
         if hasattr(sys, '_MEIPASS'):
             return os.path.join(sys._MEIPASS, nombre_archivo)
-        return os.path.join(os.path.abspath("."), nombre_archivo)
+        return os.path.join(directorio_aplicacion(), nombre_archivo)
+    
+    # Extensiones de los formatos planos, que se leen sin pasar por Excel
+    EXTENSIONES_PLANAS = {".csv": "csv", ".txt": "csv", ".parquet": "parquet", ".pq": "parquet"}
     
     @staticmethod
-    def cargar_hoja_con_columnas(archivo: str, columnas_esperadas: list) -> pd.DataFrame:
-        """Carga un archivo Excel buscando las columnas esperadas"""
+    def cargar_hoja_con_columnas(archivo: str, columnas_esperadas: list,
+                                 columnas_opcionales: Optional[list] = None) -> pd.DataFrame:
+        """Carga un archivo Excel buscando las columnas esperadas
+
+        Los CSV y Parquet se leen directamente y solo con las columnas
+        esperadas más las opcionales que existan (ver leer_plano); los Excel
+        se cargan completos.
+        """
         try:
-            if archivo.lower().endswith(".xls"):
-                with open(archivo, "rb") as f:
-                    inicio = f.read(1024)
-                if b"<table" in inicio.lower():
-                    df_list = pd.read_html(archivo)
-                    for df in df_list:
-                        if all(col in df.columns for col in columnas_esperadas):
-                            return df
-                    raise ValueError(f"No se encontró una tabla con las columnas requeridas en {archivo}.")
-                else:
-                    xls = pd.ExcelFile(archivo, engine="xlrd")
+            if FileManager.formato_plano(archivo):
+                return FileManager.leer_plano(archivo, columnas_esperadas, columnas_opcionales)
+            
+            df = CacheReportes.obtener(archivo, columnas_esperadas, "hoja")
+            if df is not None:
+                return df
+            
+            hoja = FileManager.detectar_hoja(archivo, columnas_esperadas)
+            if FileManager.es_html_disfrazado(archivo):
+                df = FileManager._leer_tabla_html(archivo, hoja)
             else:
-                xls = pd.ExcelFile(archivo, engine="openpyxl")
+                engine = "xlrd" if archivo.lower().endswith(".xls") else "openpyxl"
+                df = pd.read_excel(archivo, sheet_name=hoja, engine=engine)
+            
+            CacheReportes.guardar(archivo, columnas_esperadas, "hoja", df)
+            return df
+        except Exception as e:
+            logging.error("Error cargando hoja desde %s: %s", archivo, e)
+            raise
+
+    @staticmethod
+    def formato_plano(archivo: str) -> Optional[str]:
+        """'csv' o 'parquet' según la extensión; None para los Excel"""
+        return FileManager.EXTENSIONES_PLANAS.get(os.path.splitext(archivo)[1].lower())
+
+    @staticmethod
+    def detectar_formato_csv(archivo: str) -> Tuple[str, str, str]:
+        """Adivina el separador, la codificación y el separador decimal de un CSV
+
+        Sofia exporta en UTF-8 o en Windows-1252 según la versión, con coma o
+        punto y coma como separador; con punto y coma (la exportación de Excel
+        en es-CO) los números llevan coma decimal y punto de miles. El
+        separador y el decimal salen de los primeros 64 KB; la codificación se
+        comprueba sobre todo el archivo, porque un archivo en Windows-1252
+        puede tener su primer acento mucho después del inicio.
+        """
+        with open(archivo, "rb") as f:
+            muestra = f.read(64 * 1024)
+        codificacion = "utf-8-sig" if muestra.startswith(b"\xef\xbb\xbf") else "utf-8"
+        try:
+            decodificador = codecs.getincrementaldecoder(codificacion)()
+            with open(archivo, "rb") as f:
+                for bloque in iter(lambda: f.read(1024 * 1024), b""):
+                    decodificador.decode(bloque)
+            decodificador.decode(b"", final=True)
+        except UnicodeDecodeError:
+            codificacion = "cp1252"
+        # La muestra puede cortar un carácter de varios bytes al final
+        texto = muestra.decode(codificacion, errors="ignore")
+        
+        # La última línea de la muestra puede estar cortada
+        lineas = texto.splitlines()
+        if len(lineas) > 1 and len(muestra) == 64 * 1024:
+            lineas = lineas[:-1]
+        try:
+            separador = csv.Sniffer().sniff("\n".join(lineas[:50]), delimiters=",;\t|").delimiter
+        except csv.Error:
+            separador = ","
+        
+        decimal = "."
+        if separador != ",":
+            campos = [campo.strip().strip('"') for fila in csv.reader(lineas[1:], delimiter=separador)
+                      for campo in fila]
+            if any(_PATRON_COMA_DECIMAL.fullmatch(campo) for campo in campos):
+                decimal = ","
+        return separador, codificacion, decimal
 
-            for nombre_hoja in xls.sheet_names:
-                df = pd.read_excel(xls, sheet_name=nombre_hoja, 
-                                 engine='openpyxl' if archivo.endswith('.xlsx') else 'xlrd')
-                if all(col in df.columns for col in columnas_esperadas):
-                    return df
+    @staticmethod
+    def leer_plano(archivo: str, columnas_esperadas: list,
+                   columnas_opcionales: Optional[list] = None) -> pd.DataFrame:
+        """Lee un CSV o Parquet con solo las columnas pedidas, en varios hilos
+
+        El CSV se parsea con el lector de Arrow (multihilo) cuando pyarrow
+        está instalado y con el de C de pandas si no; el Parquet lee solo las
+        columnas pedidas del archivo. La inferencia de tipos y los vacíos
+        (NaN) quedan como en read_excel.
+        """
+        formato = FileManager.formato_plano(archivo)
+        if formato == "parquet":
+            if pq is None:
+                raise ValueError(f"Para leer {os.path.basename(archivo)} se necesita pyarrow")
+            disponibles = pq.read_schema(archivo).names
+        else:
+            separador, codificacion, decimal = FileManager.detectar_formato_csv(archivo)
+            with open(archivo, encoding=codificacion, errors="replace", newline="") as f:
+                disponibles = next(csv.reader(f, delimiter=separador), [])
+        
+        faltantes = [col for col in columnas_esperadas if col not in disponibles]
+        if faltantes:
+            raise ValueError(f"No se encontraron las columnas requeridas ({', '.join(faltantes)}) en {archivo}.")
+        columnas = columnas_esperadas + [col for col in columnas_opcionales or []
+                                         if col in disponibles and col not in columnas_esperadas]
+        
+        if formato == "parquet":
+            df = pd.read_parquet(archivo, columns=columnas)
+            # Las cadenas de Arrow pasan a object como las de read_excel
+            for col in df.columns[df.dtypes.map(pd.api.types.is_string_dtype)]:
+                df[col] = df[col].astype(object).where(df[col].notna(), float("nan"))
+        else:
+            if decimal == ",":
+                # El lector de Arrow no admite separador de miles: estos van con el de C
+                df = pd.read_csv(archivo, sep=separador, encoding=codificacion, usecols=columnas,
+                                 decimal=",", thousands=".")
+            else:
+                df = pd.read_csv(archivo, sep=separador, encoding=codificacion, usecols=columnas,
+                                 engine="pyarrow" if pa is not None else "c")
+            df = df[columnas]
+        logging.info("Reporte %s leído: %s (%s filas)", formato.upper(), archivo, f"{len(df):,}")
+        return df
+
+    @staticmethod
+    def es_html_disfrazado(archivo: str) -> bool:
+        """Indica si un .xls es en realidad una tabla HTML exportada por Sofia"""
+        if not archivo.lower().endswith(".xls"):
+            return False
+        with open(archivo, "rb") as f:
+            inicio = f.read(1024)
+        return b"<table" in inicio.lower()
+
+    @staticmethod
+    def detectar_hoja(archivo: str, columnas_esperadas: list) -> Union[str, int]:
+        """Ubica la hoja (o tabla HTML) con las columnas esperadas leyendo solo encabezados
+
+        Devuelve el nombre de la hoja, o el índice de la tabla en los .xls
+        HTML. El resultado se recuerda por archivo (ruta, tamaño y fecha de
+        modificación), así que las cargas siguientes no repiten la búsqueda.
+        """
+        info = os.stat(archivo)
+        clave = (os.path.abspath(archivo), info.st_size, info.st_mtime_ns, tuple(columnas_esperadas))
+        if clave in FileManager._hojas_detectadas:
+            return FileManager._hojas_detectadas[clave]
+        
+        if FileManager.es_html_disfrazado(archivo):
+            encabezados = FileManager._encabezados_html(archivo)
+            tipo = "una tabla"
+        elif archivo.lower().endswith(".xls"):
+            encabezados = FileManager._encabezados_xls(archivo)
+            tipo = "una hoja"
+        else:
+            encabezados = FileManager._encabezados_xlsx(archivo)
+            tipo = "una hoja"
+        
+        for hoja, encabezado in encabezados:
+            if all(col in encabezado for col in columnas_esperadas):
+                FileManager._hojas_detectadas[clave] = hoja
+                return hoja
+        
+        raise ValueError(f"No se encontró {tipo} con las columnas requeridas en {archivo}.")
+
+    @staticmethod
+    def _encabezados_xlsx(archivo: str) -> Iterator[Tuple[str, list]]:
+        """Primera fila de cada hoja de un .xlsx, en modo solo lectura"""
+        wb = openpyxl.load_workbook(archivo, read_only=True, data_only=True, keep_links=False)
+        try:
+            for ws in wb.worksheets:
+                ws.reset_dimensions()
+                encabezado = next(ws.iter_rows(max_row=1, values_only=True), ())
+                yield ws.title, list(encabezado)
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _encabezados_xls(archivo: str) -> Iterator[Tuple[str, list]]:
+        """Primera fila de cada hoja de un .xls binario, cargando una hoja a la vez"""
+        libro = xlrd.open_workbook(archivo, on_demand=True)
+        try:
+            for nombre in libro.sheet_names():
+                hoja = libro.sheet_by_name(nombre)
+                encabezado = hoja.row_values(0) if hoja.nrows else []
+                libro.unload_sheet(nombre)
+                yield nombre, encabezado
+        finally:
+            libro.release_resources()
+
+    @staticmethod
+    def _texto_celda_html(celda) -> str:
+        """Texto de una celda HTML normalizado como lo hace pd.read_html"""
+        return _RE_ESPACIOS_HTML.sub(" ", "".join(celda.itertext()).strip())
+
+    @staticmethod
+    def _encabezados_html(archivo: str) -> Iterator[Tuple[int, list]]:
+        """Fila de encabezado de cada tabla de un .xls HTML, sin construir el documento completo"""
+        indice = -1
+        abiertas = []  # [índice, encabezado_visto] de las tablas en curso
+        for evento, elem in etree.iterparse(archivo, events=("start", "end"), tag=("table", "tr"),
+                                            html=True, recover=True):
+            if elem.tag == "table":
+                if evento == "start":
+                    indice += 1
+                    abiertas.append([indice, False])
+                else:
+                    abiertas.pop()
+                    elem.clear()
+                continue
             
-            raise ValueError(f"No se encontró una hoja con las columnas requeridas en {archivo}.")
+            if evento == "end" and abiertas:
+                tabla = abiertas[-1]
+                if not tabla[1]:
+                    tabla[1] = True
+                    # Como pd.read_html, solo una fila de <th> o dentro de <thead> es encabezado
+                    celdas = [c for c in elem if c.tag in ("td", "th")]
+                    padre = elem.getparent()
+                    en_thead = padre is not None and padre.tag == "thead"
+                    if celdas and (en_thead or all(c.tag == "th" for c in celdas)):
+                        yield tabla[0], [FileManager._texto_celda_html(c) for c in celdas]
+                elem.clear()
+
+    @staticmethod
+    def _leer_tabla_html(archivo: str, indice: int) -> pd.DataFrame:
+        """Parsea únicamente la tabla indicada de un .xls HTML"""
+        lotes = list(FileManager._lotes_html(archivo, indice))
+        return pd.concat(lotes, ignore_index=True) if len(lotes) > 1 else lotes[0]
+
+    @staticmethod
+    def _iterar_filas_html(archivo: str, indice: int) -> Iterator[list]:
+        """Filas de la tabla indicada (encabezado incluido) leídas con iterparse
+
+        Cada fila se libera apenas se lee y las demás tablas se descartan al
+        terminar, así que la memoria no depende del tamaño del documento. Como
+        pd.read_html, las celdas con colspan se repiten en cada columna.
+        """
+        actual = -1
+        abiertas = []  # Índices de las tablas en curso
+        for evento, elem in etree.iterparse(archivo, events=("start", "end"), tag=("table", "tr"),
+                                            html=True, recover=True):
+            if elem.tag == "table":
+                if evento == "start":
+                    actual += 1
+                    abiertas.append(actual)
+                    continue
+                if abiertas.pop() == indice:
+                    return
+                if indice not in abiertas:
+                    elem.clear()
+                continue
+            
+            if evento != "end" or not abiertas:
+                continue
+            if abiertas[-1] == indice:
+                fila = []
+                for celda in elem:
+                    if celda.tag in ("td", "th"):
+                        texto = FileManager._texto_celda_html(celda)
+                        fila.extend([texto] * max(int(celda.get("colspan", 1) or 1), 1))
+                yield fila
+            elif indice in abiertas:
+                # Tabla anidada dentro de la buscada: su texto forma parte de la celda
+                continue
+            
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    @staticmethod
+    def _lotes_html(archivo: str, indice: int, columnas: Optional[list] = None,
+                    tamano_lote: int = TAMANO_LOTE) -> Iterator[pd.DataFrame]:
+        """Convierte la tabla HTML indicada en lotes tipados como lo haría pd.read_html"""
+        filas = FileManager._iterar_filas_html(archivo, indice)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            raise ValueError(f"No se encontró una tabla con las columnas requeridas en {archivo}.")
+        
+        if columnas is None:
+            # Nombres únicos con la misma convención de pandas ("col", "col.1", ...)
+            columnas = TextParser([encabezado], header=0).read().columns.tolist()
+            indices = list(range(len(encabezado)))
+        else:
+            indices = [encabezado.index(col) for col in columnas]
+        
+        lote = []
+        entregados = 0
+        for fila in filas:
+            lote.append([fila[i] if i < len(fila) else "" for i in indices])
+            if len(lote) >= tamano_lote:
+                yield FileManager._crear_lote(lote, columnas, thousands=",")
+                entregados += 1
+                lote = []
+        
+        if lote or entregados == 0:
+            yield FileManager._crear_lote(lote, columnas, thousands=",")
+
+    @staticmethod
+    def _lotes_xlsx(archivo: str, hoja: str, columnas: list,
+                    tamano_lote: int = TAMANO_LOTE) -> Iterator[pd.DataFrame]:
+        """Recorre una hoja .xlsx en modo solo lectura conservando solo las columnas pedidas"""
+        wb = openpyxl.load_workbook(archivo, read_only=True, data_only=True, keep_links=False)
+        try:
+            ws = wb[hoja]
+            ws.reset_dimensions()
+            filas = ws.iter_rows(values_only=True)
+            encabezado = next(filas)
+
+            # Como pandas, ante encabezados repetidos se usa la primera aparición
+            indices = [encabezado.index(col) for col in columnas]
+            lote = []
+            entregados = 0
+            for fila in filas:
+                lote.append(tuple(
+                    FileManager._convertir_celda(fila[i] if i < len(fila) else None)
+                    for i in indices
+                ))
+                if len(lote) >= tamano_lote:
+                    yield FileManager._crear_lote(lote, columnas)
+                    entregados += 1
+                    lote = []
+
+            if lote or entregados == 0:
+                yield FileManager._crear_lote(lote, columnas)
+        finally:
+            wb.close()
+
+    @staticmethod
+    def iterar_lotes_columnas(archivo: str, columnas: list,
+                              tamano_lote: int = TAMANO_LOTE) -> Iterator[pd.DataFrame]:
+        """Lee solo las columnas indicadas por lotes, sin materializar el libro completo
+
+        Los .xlsx se recorren en modo solo lectura con ``iter_rows`` y los .xls
+        HTML con ``iterparse``; en ambos casos solo se conservan las columnas
+        pedidas, de modo que la memoria crece con el número de columnas y no
+        con el tamaño del libro. Los .xls binarios se cargan completos y se
+        entregan como un único lote. Los CSV y Parquet se leen directamente,
+        sin pasar por la caché. Si el archivo ya está en CacheReportes, los
+        lotes salen de la caché.
+        """
+        if FileManager.formato_plano(archivo):
+            # Los lectores de CSV y Parquet ya proyectan las columnas y son multihilo:
+            # leerlos cuesta menos que calcular el hash del archivo para la caché
+            try:
+                df = FileManager.leer_plano(archivo, columnas)
+            except Exception as e:
+                logging.error("Error cargando hoja desde %s: %s", archivo, e)
+                raise
+            for inicio in range(0, max(len(df), 1), tamano_lote):
+                yield df.iloc[inicio:inicio + tamano_lote]
+            return
+        
+        cacheado = CacheReportes.obtener(archivo, columnas, "columnas")
+        if cacheado is not None:
+            for inicio in range(0, max(len(cacheado), 1), tamano_lote):
+                yield cacheado.iloc[inicio:inicio + tamano_lote]
+            return
+        
+        try:
+            if FileManager.es_html_disfrazado(archivo):
+                lotes = FileManager._lotes_html(
+                    archivo, FileManager.detectar_hoja(archivo, columnas), columnas, tamano_lote)
+            elif archivo.lower().endswith(".xls"):
+                df = FileManager.cargar_hoja_con_columnas(archivo, columnas)
+                yield df[columnas]
+                return
+            else:
+                lotes = FileManager._lotes_xlsx(
+                    archivo, FileManager.detectar_hoja(archivo, columnas), columnas, tamano_lote)
         except Exception as e:
             logging.error("Error cargando hoja desde %s: %s", archivo, e)
             raise
 
+        escritor = CacheReportes.escritor(archivo, columnas, "columnas")
+        try:
+            for lote in lotes:
+                escritor.agregar(lote)
+                yield lote
+            escritor.confirmar()
+        finally:
+            # Si la lectura no terminó, la entrada parcial no se publica
+            escritor.descartar()
+            lotes.close()
+
+    @staticmethod
+    def _convertir_celda(valor):
+        """Normaliza una celda igual que el lector openpyxl de pandas"""
+        if valor is None:
+            return ""
+        if isinstance(valor, float) and valor.is_integer():
+            return int(valor)
+        return valor
+
+    @staticmethod
+    def _crear_lote(filas: list, columnas: list, **opciones) -> pd.DataFrame:
+        """Convierte filas crudas en un DataFrame tipado con la inferencia de read_excel"""
+        if not filas:
+            return pd.DataFrame({col: pd.Series(dtype=object) for col in columnas})
+        return TextParser(filas, names=columnas, header=None, **opciones).read()
+
+
+class CodificadorConsecutivos:
+    """Codifica los consecutivos como int64 para unir, filtrar y agrupar sin comparar textos
+
+    Un consecutivo "prefijo + dígitos" (como E12345) se empaqueta como
+    ``(id del prefijo << 55) | (cantidad de dígitos << 50) | número``, así que
+    los ceros a la izquierda se conservan; el número son los últimos 1 a 15
+    dígitos. Los textos sin dígitos al final reciben códigos negativos de una
+    tabla aparte.
+    Las tablas las comparten ambos reportes y duran una ejecución: el mismo
+    texto siempre recibe el mismo código hasta que ProcesoSiigo las vacía al
+    empezar la siguiente (ver reiniciar). El texto solo se reconstruye al
+    exportar.
+    """
+    
+    # Prefijo más corto seguido de 1 a 15 dígitos hasta el final (en RE2, "$" es solo el final del texto)
+    PATRON = r"(?s)^(?P<prefijo>.*?)(?P<numero>[0-9]{1,15})$"
+    _RE = re.compile(r"(?s)(.*?)([0-9]{1,15})")
+    MAX_PREFIJOS = 256
+    MASCARA_NUMERO = (1 << 55) - 1  # Cantidad de dígitos y número, sin el prefijo
+    
+    # El prefijo vacío tiene el id 0: un entero sin codificar se decodifica como sí mismo
+    _prefijos = {"": 0}
+    _lista_prefijos = [""]
+    _otros = {}
+    _lista_otros = []
+    _lock = threading.RLock()
+
+    @staticmethod
+    def es_codificado(serie: pd.Series) -> bool:
+        """Indica si la columna Consecutivo ya está codificada"""
+        return pd.api.types.is_integer_dtype(serie)
+
+    @staticmethod
+    def _codigo_prefijo(prefijo: str) -> Optional[int]:
+        """Id del prefijo, registrándolo si es nuevo (None si la tabla está llena)"""
+        tabla = CodificadorConsecutivos._prefijos
+        if prefijo not in tabla:
+            # Se registra también sin sus 'E' iniciales para que quitar_prefijo_e siempre lo encuentre
+            nuevos = [p for p in dict.fromkeys((prefijo.lstrip("Ee"), prefijo)) if p not in tabla]
+            if len(tabla) + len(nuevos) > CodificadorConsecutivos.MAX_PREFIJOS:
+                return None
+            for nuevo in nuevos:
+                tabla[nuevo] = len(CodificadorConsecutivos._lista_prefijos)
+                CodificadorConsecutivos._lista_prefijos.append(nuevo)
+        return tabla[prefijo]
+
+    @staticmethod
+    def _codificar_textos(textos: Iterable[str]) -> np.ndarray:
+        """Códigos de textos distintos entre sí (se llama con el lock tomado)"""
+        textos = np.asarray(textos, dtype=object)
+        codigos = np.zeros(len(textos), dtype=np.int64)
+        empaquetado = np.zeros(len(textos), dtype=bool)
+        
+        separado = False
+        if pc is not None and len(textos):
+            try:
+                # Separación vectorizada con Arrow; los prefijos distintos son pocos
+                partes = pc.extract_regex(pa.array(textos, type=pa.string()), pattern=CodificadorConsecutivos.PATRON)
+                prefijos = pc.fill_null(pc.struct_field(partes, [0]), "").dictionary_encode()
+                digitos = pc.fill_null(pc.struct_field(partes, [1]), "0")
+                ids = np.array([-1 if i is None else i for i in map(CodificadorConsecutivos._codigo_prefijo,
+                                                                  prefijos.dictionary.to_pylist())],
+                               dtype=np.int64)[prefijos.indices.to_numpy(zero_copy_only=False)]
+                ancho = pc.utf8_length(digitos).to_numpy(zero_copy_only=False).astype(np.int64)
+                numero = pc.cast(digitos, pa.int64()).to_numpy(zero_copy_only=False)
+                empaquetado = partes.is_valid().to_numpy(zero_copy_only=False) & (ids >= 0)
+                codigos = np.where(empaquetado, (ids << 55) | (ancho << 50) | numero, 0)
+                separado = True
+            except (pa.ArrowException, UnicodeEncodeError):
+                logging.debug("Codificación con Arrow no disponible; se usa Python", exc_info=True)
+        if not separado:
+            for i, texto in enumerate(textos):
+                partes = CodificadorConsecutivos._RE.fullmatch(texto)
+                id_prefijo = partes and CodificadorConsecutivos._codigo_prefijo(partes[1])
+                if id_prefijo is not None:
+                    codigos[i] = (id_prefijo << 55) | (len(partes[2]) << 50) | int(partes[2])
+                    empaquetado[i] = True
+        
+        # Textos sin dígitos al final (o sin lugar en la tabla de prefijos)
+        otros = CodificadorConsecutivos._otros
+        for i in np.flatnonzero(~empaquetado):
+            texto = textos[i]
+            if texto not in otros:
+                CodificadorConsecutivos._lista_otros.append(texto)
+                otros[texto] = -len(CodificadorConsecutivos._lista_otros)
+            codigos[i] = otros[texto]
+        return codigos
+
+    @staticmethod
+    def _texto(codigo: int) -> str:
+        """Texto original de un código (se llama con el lock tomado)"""
+        if codigo < 0:
+            return CodificadorConsecutivos._lista_otros[-codigo - 1]
+        prefijo = CodificadorConsecutivos._lista_prefijos[codigo >> 55]
+        ancho = (codigo >> 50) & 0x1F
+        return f"{prefijo}{codigo & ((1 << 50) - 1):0{ancho}d}"
+
+    @staticmethod
+    def codificar(serie: pd.Series) -> pd.Series:
+        """Codifica una columna de consecutivos (se convierte a texto como antes con astype(str))"""
+        inversa, unicos = pd.factorize(serie.astype(str))
+        with CodificadorConsecutivos._lock:
+            codigos = CodificadorConsecutivos._codificar_textos(unicos)
+        return pd.Series(codigos[inversa], index=serie.index, dtype=np.int64)
+
+    @staticmethod
+    def decodificar(codigos: pd.Series) -> pd.Series:
+        """Reconstruye el texto de cada consecutivo (una vez por código distinto)"""
+        inversa, unicos = pd.factorize(codigos.to_numpy(dtype=np.int64))
+        with CodificadorConsecutivos._lock:
+            textos = np.array([CodificadorConsecutivos._texto(int(codigo)) for codigo in unicos], dtype=object)
+        return pd.Series(textos[inversa], index=codigos.index, dtype=object)
+
+    @staticmethod
+    def reiniciar(conservar: Optional[pd.Series] = None) -> Optional[pd.Series]:
+        """Vacía las tablas de prefijos y textos para que no crezcan de una ejecución a otra
+
+        Los códigos anteriores dejan de valer; si se pasa una columna
+        codificada que sigue en uso, se devuelve recodificada con las tablas
+        nuevas.
+        """
+        with CodificadorConsecutivos._lock:
+            textos = CodificadorConsecutivos.decodificar(conservar) if conservar is not None else None
+            CodificadorConsecutivos._prefijos = {"": 0}
+            CodificadorConsecutivos._lista_prefijos = [""]
+            CodificadorConsecutivos._otros = {}
+            CodificadorConsecutivos._lista_otros = []
+            return CodificadorConsecutivos.codificar(textos) if textos is not None else None
+
+    @staticmethod
+    def quitar_prefijo_e(codigos: pd.Series) -> pd.Series:
+        """Equivalente codificado de _PATRON_CONSECUTIVO_SIIGO: quita las 'E' iniciales (NA si no empieza con 'E')"""
+        valores = codigos.to_numpy(dtype=np.int64)
+        resultado = np.zeros(len(valores), dtype=np.int64)
+        valido = np.zeros(len(valores), dtype=bool)
+        
+        with CodificadorConsecutivos._lock:
+            # Consecutivos empaquetados: basta con cambiar el id del prefijo
+            tabla = CodificadorConsecutivos._prefijos
+            nuevos_ids = np.array([tabla[p.lstrip("Ee")] if p[:1] in ("E", "e") else -1
+                                   for p in CodificadorConsecutivos._lista_prefijos], dtype=np.int64)
+            empaquetados = valores >= 0
+            ids = nuevos_ids[valores[empaquetados] >> 55]
+            resultado[empaquetados] = (np.maximum(ids, 0) << 55) | (valores[empaquetados] & CodificadorConsecutivos.MASCARA_NUMERO)
+            valido[empaquetados] = ids >= 0
+            
+            # Los demás textos se limpian como texto y se vuelven a codificar
+            otros = ~empaquetados
+            if otros.any():
+                inversa, unicos = pd.factorize(valores[otros])
+                textos = [CodificadorConsecutivos._texto(int(codigo)) for codigo in unicos]
+                conserva = np.array([texto[:1] in ("E", "e") for texto in textos], dtype=bool)
+                nuevos = CodificadorConsecutivos._codificar_textos(
+                    [texto.lstrip("Ee") if texto[:1] in ("E", "e") else texto for texto in textos])
+                resultado[otros] = nuevos[inversa]
+                valido[otros] = conserva[inversa]
+        
+        return pd.Series(pd.arrays.IntegerArray(resultado, ~valido), index=codigos.index)
+
+
+class IndiceUsuarios:
+    """Índice invertido de la columna 'usuario' de un Reporte 2
+
+    Se construye una vez por reporte: usuarios distintos (como texto, los
+    vacíos como ""), el código de usuario de cada fila y cuántas filas tiene
+    cada uno. Los filtros se evalúan sobre los usuarios distintos y solo al
+    final se traducen a filas.
+    """
+    
+    # id del DataFrame -> (referencia débil al DataFrame, índice)
+    _indices = {}
+
+    def __init__(self, df: pd.DataFrame):
+        usuario = df["usuario"]
+        if isinstance(usuario.dtype, pd.CategoricalDtype):
+            usuario = usuario.astype(object)
+        codigos, usuarios = pd.factorize(usuario.fillna("").astype(str))
+        self.codigos = codigos
+        self.usuarios = pd.Index(usuarios, dtype=object)
+        self.conteos = np.bincount(codigos, minlength=len(usuarios))
+        # Las mismas normalizaciones que usa pandas en == .str.lower() y en contains(case=False)
+        self.minusculas = self.usuarios.str.lower()
+        self.mayusculas = self.usuarios.str.upper()
+
+    @staticmethod
+    def de_reporte(df: pd.DataFrame) -> "IndiceUsuarios":
+        """Índice del reporte, construido solo la primera vez que se pide"""
+        clave = id(df)
+        guardado = IndiceUsuarios._indices.get(clave)
+        if guardado is not None and guardado[0]() is df:
+            return guardado[1]
+        indice = IndiceUsuarios(df)
+        referencia = weakref.ref(df, lambda _, clave=clave: IndiceUsuarios._indices.pop(clave, None))
+        IndiceUsuarios._indices[clave] = (referencia, indice)
+        return indice
+
+    @staticmethod
+    def terminos(usuario_filtro: Union[str, Iterable[str]]) -> list:
+        """Usuarios a buscar: una lista o un texto con varios separados por comas"""
+        if isinstance(usuario_filtro, str):
+            usuario_filtro = usuario_filtro.split(",")
+        return [t.strip() for t in usuario_filtro if t and t.strip()]
+
+    def seleccionar(self, terminos: list, filtro_exacto: bool = False,
+                    case_sensitive: bool = False) -> np.ndarray:
+        """Máscara sobre los usuarios distintos que coinciden con alguno de los términos"""
+        seleccion = np.zeros(len(self.usuarios), dtype=bool)
+        for termino in terminos:
+            if filtro_exacto:
+                if case_sensitive:
+                    seleccion |= self.usuarios == termino
+                else:
+                    seleccion |= self.minusculas == termino.lower()
+            elif case_sensitive:
+                seleccion |= np.fromiter((termino in u for u in self.usuarios), dtype=bool,
+                                         count=len(self.usuarios))
+            else:
+                termino = termino.upper()
+                seleccion |= np.fromiter((termino in u for u in self.mayusculas), dtype=bool,
+                                         count=len(self.usuarios))
+        return seleccion
+
+    def contar(self, seleccion: np.ndarray) -> Tuple[int, int]:
+        """Cantidad de usuarios seleccionados y de filas que les corresponden"""
+        return int(seleccion.sum()), int(self.conteos[seleccion].sum())
+
+    def posiciones(self, seleccion: np.ndarray) -> np.ndarray:
+        """Posiciones (en orden) de las filas de los usuarios seleccionados"""
+        return np.flatnonzero(seleccion[self.codigos])
+
+
+class MemoriaCompacta:
+    """Modo opcional de memoria reducida para los reportes (ver ProcesoSiigo ``compacto``)
+
+    Las columnas de texto que se repiten mucho pasan a categóricas, el resto
+    del texto a cadenas de Arrow y los números enteros (también los float
+    sin decimales ni vacíos) al entero más chico que los contiene. Los
+    valores no cambian, así que el archivo exportado es el mismo. De los
+    consecutivos solo se compacta el texto sin vacíos: su conversión a texto
+    es la clave de unión y un vacío de Arrow no se escribe como el de NumPy.
+    """
+    
+    # Columnas con pocos valores distintos, con el nombre del reporte y el de la plantilla
+    CATEGORICAS = {"usuario", "codigo", "referencia", "NitEmpresa",
+                   "Código producto", "Descripción producto", "Identificación tercero"}
+    CLAVES = {"factura", "numero", "Consecutivo"}
+
+    @staticmethod
+    def compactar(df: pd.DataFrame) -> pd.DataFrame:
+        """Versión compacta del DataFrame (el mismo objeto si ya lo era)"""
+        cambios = {}
+        for col in df.columns:
+            serie = df[col]
+            clave = col in MemoriaCompacta.CLAVES
+            if not isinstance(serie.dtype, np.dtype):
+                continue
+            if serie.dtype == object:
+                if col in MemoriaCompacta.CATEGORICAS:
+                    cambios[col] = serie.astype("category")
+                elif (pa is not None and pd.api.types.infer_dtype(serie, skipna=True) == "string"
+                      and not (clave and serie.isna().any())):
+                    cambios[col] = serie.astype("string[pyarrow]")
+            elif clave:
+                continue
+            elif pd.api.types.is_integer_dtype(serie) or pd.api.types.is_float_dtype(serie):
+                # downcast="integer" solo convierte los float que no pierden nada
+                compacta = pd.to_numeric(serie, downcast="integer")
+                if compacta.dtype != serie.dtype:
+                    cambios[col] = compacta
+        return df.assign(**cambios) if cambios else df
+
+    @staticmethod
+    def concatenar(lotes: Iterable[pd.DataFrame]) -> pd.DataFrame:
+        """Concatena lotes compactos unificando las categorías para que sigan siendo categóricas"""
+        lotes = list(lotes)
+        if len(lotes) == 1:
+            return lotes[0]
+        for col in lotes[0].columns:
+            if all(isinstance(lote[col].dtype, pd.CategoricalDtype) for lote in lotes):
+                categorias = pd.api.types.union_categoricals([lote[col] for lote in lotes]).categories
+                lotes = [lote.assign(**{col: lote[col].cat.set_categories(categorias)}) for lote in lotes]
+        return pd.concat(lotes, ignore_index=True)
+
+    @staticmethod
+    def memoria_mb(df: pd.DataFrame) -> float:
+        """Memoria que ocupa el DataFrame, incluido el texto de las columnas object"""
+        return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
 
 class DataProcessor:
     """Procesa y transforma los datos de los reportes"""
     
     @staticmethod
-    def procesar_reporte1(df: pd.DataFrame) -> pd.DataFrame:
-        """Procesa el reporte 1 (Productos)"""
+    def procesar_reporte1(df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+                          compacto: bool = False) -> pd.DataFrame:
+        """Procesa el reporte 1 (Productos), completo o como lotes de columnas (ver MemoriaCompacta)"""
+        if not isinstance(df, pd.DataFrame):
+            if compacto:
+                # Cada lote se compacta apenas se procesa
+                return MemoriaCompacta.concatenar(
+                    MemoriaCompacta.compactar(DataProcessor.procesar_reporte1(lote)) for lote in df)
+            return pd.concat([DataProcessor.procesar_reporte1(lote) for lote in df],
+                             ignore_index=True)
+        
         # Filtrar registros con valor_total != 0
         df = df[df["valor_total"] != 0].copy()
         
@@ -74,7 +1064,7 @@ class DataProcessor:
         
         # Seleccionar columnas necesarias
         df = df[["Consecutivo", "Código producto", "Descripción producto", "Cantidad producto", "Valor unitario"]]
-        df["Consecutivo"] = df["Consecutivo"].astype(str)
+        df["Consecutivo"] = CodificadorConsecutivos.codificar(df["Consecutivo"])
         
         return df
     
@@ -91,38 +1081,30 @@ class DataProcessor:
         
         # Seleccionar columnas necesarias
         df = df[["Consecutivo", "Identificación tercero", "Fecha de elaboración", "Valor Forma de Pago"]]
-        df["Consecutivo"] = df["Consecutivo"].astype(str)
+        df["Consecutivo"] = CodificadorConsecutivos.codificar(df["Consecutivo"])
         
         return df
     
     @staticmethod
-    def aplicar_filtro_usuario(df: pd.DataFrame, usuario_filtro: str, 
+    def aplicar_filtro_usuario(df: pd.DataFrame, usuario_filtro: Union[str, Iterable[str]], 
                               filtro_exacto: bool = False, 
                               case_sensitive: bool = False) -> Tuple[pd.DataFrame, str, str]:
-        """Aplica filtro de usuario con opciones configurables"""
-        if not usuario_filtro or "usuario" not in df.columns:
+        """Aplica filtro de usuario con opciones configurables
+
+        Acepta varios usuarios (una lista o separados por comas) y se resuelve
+        con el IndiceUsuarios del reporte.
+        """
+        terminos = IndiceUsuarios.terminos(usuario_filtro or "")
+        if not terminos or "usuario" not in df.columns:
             return df, "Sin filtro aplicado", "info"
         
         df_original_count = len(df)
-        usuario_filtro = usuario_filtro.strip()
+        usuario_filtro = ", ".join(terminos)
         
         try:
-            # Limpiar datos de usuario
-            df_filtrado = df.copy()
-            df_filtrado["usuario"] = df_filtrado["usuario"].fillna("").astype(str)
-            
-            if filtro_exacto:
-                if case_sensitive:
-                    mask = df_filtrado["usuario"] == usuario_filtro
-                else:
-                    mask = df_filtrado["usuario"].str.lower() == usuario_filtro.lower()
-            else:
-                if case_sensitive:
-                    mask = df_filtrado["usuario"].str.contains(usuario_filtro, na=False, regex=False)
-                else:
-                    mask = df_filtrado["usuario"].str.contains(usuario_filtro, case=False, na=False, regex=False)
-            
-            df_resultado = df_filtrado[mask]
+            indice = IndiceUsuarios.de_reporte(df)
+            seleccion = indice.seleccionar(terminos, filtro_exacto, case_sensitive)
+            df_resultado = df.iloc[indice.posiciones(seleccion)]
             df_final_count = len(df_resultado)
             
             # Crear mensaje informativo
@@ -141,9 +1123,104 @@ class DataProcessor:
             return df, f"❌ Error en filtro: {str(e)}", "error"
     
     @staticmethod
-    def combinar_reportes(r1: pd.DataFrame, r2: pd.DataFrame) -> pd.DataFrame:
-        """Combina los dos reportes"""
-        return pd.merge(r1, r2, on="Consecutivo", how="left")
+    def filtrar_para_combinar(r1: pd.DataFrame, r2: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, int]:
+        """Aplica antes del merge los filtros de limpiar_datos sobre cada reporte
+
+        Descarta facturas sin tercero, fecha o total y consecutivos que no
+        empiezan con 'E', y deja en el Reporte 1 solo las líneas con factura.
+        Devuelve además cuántas líneas del Reporte 1 no tienen tercero en el
+        Reporte 2, calculado con los conjuntos de consecutivos.
+        """
+        con_tercero = r2.loc[r2["Identificación tercero"].notna(), "Consecutivo"]
+        sin_coincidencia = int((~r1["Consecutivo"].isin(con_tercero)).sum())
+        
+        r2 = r2.dropna(subset=["Identificación tercero", "Fecha de elaboración", "Valor Forma de Pago"])
+        r2 = r2[DataProcessor.es_consecutivo_siigo(r2["Consecutivo"])]
+        r1 = r1[r1["Consecutivo"].isin(r2["Consecutivo"])]
+        return r1, r2, sin_coincidencia
+    
+    @staticmethod
+    def es_consecutivo_siigo(consecutivos: pd.Series) -> pd.Series:
+        """Indica qué consecutivos empiezan con 'E' (codificados o como texto)"""
+        if CodificadorConsecutivos.es_codificado(consecutivos):
+            return CodificadorConsecutivos.quitar_prefijo_e(consecutivos).notna()
+        return DataProcessor._extraer_grupo(consecutivos, _PATRON_CONSECUTIVO_SIIGO).notna()
+    
+    MAX_CONSECUTIVOS_AVISO = 20
+    
+    @staticmethod
+    def describir_repetidos(facturas: int, consecutivos: int, ejemplos: list) -> str:
+        """Texto del aviso de consecutivos repetidos en el Reporte 2"""
+        listado = ", ".join(ejemplos)
+        if consecutivos > len(ejemplos):
+            listado += f" y {consecutivos - len(ejemplos):,} más"
+        return (f"El Reporte 2 tiene {facturas:,} facturas con consecutivo repetido "
+                f"({consecutivos:,} consecutivos: {listado})")
+    
+    @staticmethod
+    def avisar_repetidos(mensaje: str, avisar: Optional[Callable[[str], None]] = None):
+        """Deja el aviso en el log y lo pasa a ``avisar`` (la interfaz o el lote) si se indicó"""
+        logging.warning(mensaje)
+        if avisar is not None:
+            avisar(mensaje)
+    
+    @staticmethod
+    def combinar_reportes(r1: pd.DataFrame, r2: pd.DataFrame, duplicados: str = "primero",
+                          avisar: Optional[Callable[[str], None]] = None) -> pd.DataFrame:
+        """Combina los dos reportes (left join de las líneas de producto con su factura)
+
+        Cada consecutivo debe aparecer una sola vez en el Reporte 2. Si se
+        repite, con ``duplicados="primero"`` se usa la primera factura y se
+        descartan las demás, con "error" se rechaza y con "expandir" se
+        repiten las líneas de producto (lo que hace pd.merge). En los dos
+        casos que siguen, el aviso con los consecutivos repetidos queda en el
+        log y se pasa a ``avisar`` si se indicó. Si ambos reportes
+        vienen ordenados por consecutivo se unen por búsqueda binaria; si no,
+        con un índice hash del Reporte 2.
+        """
+        claves_r2 = r2["Consecutivo"]
+        repetidos = claves_r2.duplicated()
+        if repetidos.any():
+            consecutivos = claves_r2[repetidos].drop_duplicates()
+            ejemplos = consecutivos.head(DataProcessor.MAX_CONSECUTIVOS_AVISO)
+            if CodificadorConsecutivos.es_codificado(ejemplos):
+                ejemplos = CodificadorConsecutivos.decodificar(ejemplos)
+            descripcion = DataProcessor.describir_repetidos(int(repetidos.sum()), len(consecutivos),
+                                                           list(map(str, ejemplos)))
+            if duplicados == "error":
+                raise ValueError(descripcion)
+            if duplicados == "expandir":
+                DataProcessor.avisar_repetidos(f"{descripcion}; se repiten sus líneas de producto", avisar)
+                return pd.merge(r1, r2, on="Consecutivo", how="left")
+            DataProcessor.avisar_repetidos(
+                f"{descripcion}; se usa la primera factura de cada uno y se descartan las demás", avisar)
+            r2 = r2[~repetidos]
+            claves_r2 = r2["Consecutivo"]
+        
+        columnas_r2 = [col for col in r2.columns if col != "Consecutivo"]
+        if set(columnas_r2) & set(r1.columns):
+            # Columnas en común: pd.merge se encarga de los sufijos
+            return pd.merge(r1, r2, on="Consecutivo", how="left", validate="many_to_one")
+        
+        # Posición de la factura de cada línea (-1 si no tiene)
+        claves_r1 = r1["Consecutivo"]
+        if len(claves_r2) and claves_r1.is_monotonic_increasing and claves_r2.is_monotonic_increasing:
+            ordenadas = claves_r2.to_numpy()
+            buscadas = claves_r1.to_numpy()
+            posiciones = np.searchsorted(ordenadas, buscadas)
+            encontradas = ordenadas[np.minimum(posiciones, len(ordenadas) - 1)] == buscadas
+            indexador = np.where((posiciones < len(ordenadas)) & encontradas, posiciones, -1)
+        else:
+            indexador = pd.Index(claves_r2).get_indexer(claves_r1)
+        
+        # Con líneas sin factura se reindexa: el -1 no existe y queda NaN, como en pd.merge
+        facturas = r2[columnas_r2].reset_index(drop=True)
+        facturas = facturas.take(indexador) if (indexador >= 0).all() else facturas.reindex(indexador)
+        combinado = r1.reset_index(drop=True)
+        facturas.index = combinado.index
+        for col in columnas_r2:
+            combinado[col] = facturas[col]
+        return combinado
     
     @staticmethod
     def limpiar_datos(df: pd.DataFrame) -> pd.DataFrame:
@@ -151,71 +1228,500 @@ class DataProcessor:
         # Eliminar registros sin información esencial
         df = df.dropna(subset=["Identificación tercero", "Fecha de elaboración", "Valor Forma de Pago"])
         
-        # Filtrar por consecutivos que empiecen con 'E'
-        df = df[df["Consecutivo"].astype(str).str.startswith(("E", "e"))]
-        
-        # Limpiar consecutivos
-        df["Consecutivo"] = df["Consecutivo"].astype(str).str.lstrip("Ee")
+        # Filtrar por consecutivos que empiecen con 'E' y quitarles el prefijo en una sola pasada
+        if CodificadorConsecutivos.es_codificado(df["Consecutivo"]):
+            consecutivos = CodificadorConsecutivos.quitar_prefijo_e(df["Consecutivo"])
+        else:
+            consecutivos = DataProcessor._extraer_grupo(df["Consecutivo"], _PATRON_CONSECUTIVO_SIIGO)
+        mascara = consecutivos.notna()
+        df = df[mascara]
+        df["Consecutivo"] = consecutivos[mascara].astype(df["Consecutivo"].dtype)
         
         # Limpiar identificación tercero
-        df["Identificación tercero"] = df["Identificación tercero"].astype(str).str.split("-").str[0]
+        df["Identificación tercero"] = DataProcessor._extraer_grupo(df["Identificación tercero"], _PATRON_NIT)
         
         # Convertir fechas
         df["Fecha de elaboración"] = pd.to_datetime(df["Fecha de elaboración"]).dt.date
         
         return df
     
+    @staticmethod
+    def _extraer_grupo(serie: pd.Series, patron: str) -> pd.Series:
+        """Grupo del patrón en cada valor convertido a texto (NaN si no coincide)
+
+        Usa el kernel de expresiones regulares de Arrow cuando pyarrow está
+        disponible; si no, una única extracción de pandas. En una columna
+        categórica se extrae una vez por categoría y el resultado sigue
+        siendo categórico.
+        """
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            grupos = DataProcessor._extraer_grupo(pd.Series(serie.cat.categories, dtype=object), patron)
+            codigos_grupo, unicos = pd.factorize(grupos)
+            codigos = serie.cat.codes.to_numpy()
+            codigos = np.where(codigos >= 0, codigos_grupo[codigos], -1)
+            return pd.Series(pd.Categorical.from_codes(codigos, unicos), index=serie.index)
+        textos = serie.astype(str)
+        if pc is not None:
+            try:
+                arreglo = pa.array(textos.to_numpy(dtype=object), type=pa.string())
+                grupo = pc.struct_field(pc.extract_regex(arreglo, pattern=patron), [0])
+                return pd.Series(grupo.to_numpy(zero_copy_only=False), index=serie.index, dtype=object)
+            except (pa.ArrowException, UnicodeEncodeError):
+                logging.debug("Extracción con Arrow no disponible; se usa pandas", exc_info=True)
+        return textos.str.extract(patron, expand=False)
+    
     @staticmethod
     def preparar_estructura_final(df: pd.DataFrame, copiar_fecha_vencimiento: bool = False) -> pd.DataFrame:
-        """Prepara la estructura final para SIIGO"""
-        columnas_objetivo = [
-            "Tipo de comprobante", "Consecutivo", "Identificación tercero", "Sucursal", 
-            "Código centro/subcentro de costos", "Fecha de elaboración", "Sigla Moneda", 
-            "Tasa de cambio", "Nombre contacto", "Email Contacto", "Orden de compra", 
-            "Orden de entrega", "Fecha orden de entrega", "Código producto", 
-            "Descripción producto", "Identificación vendedor", "Código de Bodega", 
-            "Cantidad producto", "Valor unitario", "Valor Descuento", "Base AIU",
-            "Identificación ingreso para terceros", "Código impuesto cargo", 
-            "Código impuesto cargo dos", "Código impuesto retención", "Código ReteICA", 
-            "Código ReteIVA", "Código forma de pago", "Valor Forma de Pago", 
-            "Fecha Vencimiento", "Observaciones"
-        ]
-        
-        # Agregar columnas faltantes
-        for col in columnas_objetivo:
-            if col not in df.columns:
-                df[col] = ""
-        
-        # Configurar valores por defecto
-        df["Tipo de comprobante"] = 1
-        df["Identificación vendedor"] = 807001777
-        
+        """Prepara la estructura final para SIIGO
+
+        Solo conserva las columnas con datos, en el orden de la plantilla: las
+        de valor fijo y las vacías las completa el exportador (ver
+        ``materializar``).
+        """
         if copiar_fecha_vencimiento:
             df["Fecha Vencimiento"] = df["Fecha de elaboración"]
         
-        # Seleccionar solo las columnas objetivo
-        df = df[columnas_objetivo]
+        # Seleccionar solo las columnas reales de la plantilla
+        df = df[DataProcessor.columnas_reales(df)]
         
         # Consolidar valor forma de pago por consecutivo
-        df['Valor Forma de Pago'] = df.groupby('Consecutivo')['Valor Forma de Pago'].transform('first')
-        df.loc[df.duplicated('Consecutivo'), 'Valor Forma de Pago'] = ''
+        df['Valor Forma de Pago'] = DataProcessor.consolidar_por_consecutivo(
+            df['Consecutivo'], df['Valor Forma de Pago'])
         
         return df
+    
+    @staticmethod
+    def consolidar_por_consecutivo(consecutivos: pd.Series, valores: pd.Series) -> pd.Series:
+        """Deja en la primera línea de cada consecutivo el primer valor no nulo del grupo y nulo en las demás
+
+        Agrupa una sola vez: por rachas si los consecutivos ya vienen
+        ordenados y con ``pd.factorize`` si no. Los valores siguen siendo
+        numéricos (con máscara de nulos); el exportador escribe los nulos en
+        blanco.
+        """
+        if consecutivos.is_monotonic_increasing:
+            claves = consecutivos.to_numpy()
+            es_primera = np.ones(len(claves), dtype=bool)
+            es_primera[1:] = claves[1:] != claves[:-1]
+            codigos = np.cumsum(es_primera) - 1
+        else:
+            # Los códigos se asignan en orden de aparición: una fila abre grupo cuando el máximo crece
+            codigos, _ = pd.factorize(consecutivos, use_na_sentinel=False)
+            es_primera = np.diff(np.maximum.accumulate(codigos), prepend=-1) > 0
+        
+        if pd.api.types.is_integer_dtype(valores):
+            valores = valores.astype("Int64")
+        elif pd.api.types.is_float_dtype(valores):
+            valores = valores.astype("Float64")
+        if valores.isna().any():
+            valores = valores.groupby(codigos, sort=False).transform("first")
+        return valores.where(es_primera)
+    
+    @staticmethod
+    def columnas_reales(df: pd.DataFrame) -> list:
+        """Columnas de la plantilla SIIGO que el DataFrame trae con datos, en orden"""
+        return [col for col in COLUMNAS_SIIGO if col in df.columns and col not in VALORES_FIJOS_SIIGO]
+    
+    @staticmethod
+    def materializar(df: pd.DataFrame) -> pd.DataFrame:
+        """Devuelve el DataFrame con todas las columnas de la plantilla, incluidas las virtuales"""
+        reales = set(DataProcessor.columnas_reales(df))
+        completo = pd.DataFrame({col: df[col] if col in reales else VALORES_FIJOS_SIIGO.get(col, "")
+                                 for col in COLUMNAS_SIIGO}, index=df.index)
+        for col in COLUMNAS_EN_BLANCO_SIIGO:
+            completo[col] = completo[col].astype(object).where(completo[col].notna(), "")
+        if CodificadorConsecutivos.es_codificado(completo["Consecutivo"]):
+            completo["Consecutivo"] = CodificadorConsecutivos.decodificar(completo["Consecutivo"])
+        return completo
+
+
+class PlantillaSiigo:
+    """Encabezado de la plantilla SIIGO ya parseado: títulos, estilos, comentarios y columnas
+
+    La plantilla no cambia entre ejecuciones, así que se lee con openpyxl una
+    sola vez por proceso y el descriptor se guarda además en la carpeta de la
+    caché, con su hash como clave, para que los trabajos de un lote (cada uno
+    en su proceso) no la vuelvan a abrir. El descriptor es solo datos (textos,
+    números y el XML de cada estilo) y se guarda como JSON; los objetos de
+    openpyxl se rearman al cargarlo.
+    """
+    
+    en_disco = True
+    VERSION = 3  # Cambiar si cambia el contenido del descriptor
+    
+    # Descriptores ya leídos en este proceso, por hash de la plantilla
+    _descriptores: dict = {}
+    
+    def __init__(self, titulo: str, anchos: dict, alto_encabezado: Optional[float], estilos: list,
+                 comentarios: list, estilos_columnas: dict, zoom: Optional[int] = None):
+        self.titulo = titulo
+        self.anchos = anchos
+        self.alto_encabezado = alto_encabezado
+        # Por columna de COLUMNAS_SIIGO: estilo del encabezado (ver _estilo_a_datos) o None
+        self.estilos_datos = estilos
+        # Instrucciones de SIIGO en el encabezado, por columna: [texto, autor, ancho, alto] o None
+        self.comentarios = comentarios
+        # Estilo de la columna completa, por letra (ver _estilo_a_datos)
+        self.estilos_columnas_datos = estilos_columnas
+        self.zoom = zoom
+        
+        # Objetos de openpyxl listos para asignar: (font, fill, border, alignment, number_format[, protection])
+        self.estilos = [PlantillaSiigo._estilo_de_datos(e) if e is not None else None for e in estilos]
+        self.estilos_columnas = {letra: PlantillaSiigo._estilo_de_datos(e) for letra, e in estilos_columnas.items()}
+
+    @staticmethod
+    def _estilo_a_datos(fuente, relleno, borde, alineacion, formato_numero: str, proteccion=None) -> dict:
+        """Estilo de openpyxl como diccionario de textos (el XML de cada parte)"""
+        partes = {"font": fuente, "fill": relleno, "border": borde, "alignment": alineacion, "protection": proteccion}
+        datos = {nombre: tostring(objeto.to_tree()).decode("utf-8")
+                 for nombre, objeto in partes.items() if objeto is not None}
+        datos["number_format"] = formato_numero
+        return datos
+
+    @staticmethod
+    def _estilo_de_datos(datos: dict) -> tuple:
+        """Inverso de _estilo_a_datos: (font, fill, border, alignment, number_format[, protection])"""
+        estilos = importlib.import_module("openpyxl.styles")
+        clases = {"font": estilos.Font, "fill": estilos.fills.Fill, "border": estilos.Border,
+                  "alignment": estilos.Alignment, "protection": estilos.Protection}
+        objetos = {nombre: clases[nombre].from_tree(fromstring(xml))
+                   for nombre, xml in datos.items() if nombre in clases}
+        estilo = (objetos["font"], objetos["fill"], objetos["border"], objetos["alignment"], datos["number_format"])
+        return estilo + (objetos["protection"],) if "protection" in objetos else estilo
+
+    def a_datos(self) -> dict:
+        """Descriptor como diccionario serializable en JSON"""
+        return {"titulo": self.titulo, "anchos": self.anchos, "alto_encabezado": self.alto_encabezado,
+                "estilos": self.estilos_datos, "comentarios": self.comentarios,
+                "estilos_columnas": self.estilos_columnas_datos, "zoom": self.zoom}
+
+    @staticmethod
+    def leer(plantilla_path: str) -> "PlantillaSiigo":
+        """Parsea el encabezado de la plantilla con openpyxl"""
+        wb = openpyxl.load_workbook(plantilla_path)
+        try:
+            ws = wb.active
+            estilos = []
+            comentarios = []
+            for c_idx in range(1, len(COLUMNAS_SIIGO) + 1):
+                modelo = ws.cell(row=1, column=c_idx)
+                estilos.append(PlantillaSiigo._estilo_a_datos(
+                    modelo.font, modelo.fill, modelo.border, modelo.alignment, modelo.number_format)
+                    if modelo.has_style else None)
+                comentario = modelo.comment
+                comentarios.append([comentario.text, comentario.author, comentario.width, comentario.height]
+                                   if comentario is not None else None)
+            estilos_columnas = {
+                letra: PlantillaSiigo._estilo_a_datos(dimension.font, dimension.fill, dimension.border,
+                                                      dimension.alignment, dimension.number_format,
+                                                      dimension.protection)
+                for letra, dimension in ws.column_dimensions.items() if dimension.has_style}
+            return PlantillaSiigo(ws.title, {letra: dimension.width for letra, dimension in ws.column_dimensions.items()},
+                                  ws.row_dimensions[1].height, estilos, comentarios, estilos_columnas,
+                                  ws.sheet_view.zoomScale)
+        finally:
+            wb.close()
+
+    @staticmethod
+    def ruta_disco(clave: str) -> str:
+        """Archivo donde se guarda el descriptor de la plantilla con esa clave"""
+        return os.path.join(CacheReportes.obtener_carpeta(), f"plantilla_{clave}.json")
+
+    @staticmethod
+    def obtener(plantilla_path: str) -> "PlantillaSiigo":
+        """Devuelve el descriptor de la plantilla, leyéndola solo si no está en memoria ni en disco
+
+        La caché en disco es solo una optimización: cualquier fallo al leerla o
+        guardarla se registra y la plantilla se lee de nuevo.
+        """
+        firma = f"{CacheReportes.hash_archivo(plantilla_path)}|{PlantillaSiigo.VERSION}|{openpyxl.__version__}"
+        clave = hashlib.sha256(firma.encode("utf-8")).hexdigest()[:40]
+        descriptor = PlantillaSiigo._descriptores.get(clave)
+        if descriptor is not None:
+            return descriptor
+        
+        ruta = PlantillaSiigo.ruta_disco(clave)
+        if PlantillaSiigo.en_disco and os.path.exists(ruta):
+            try:
+                with open(ruta, encoding="utf-8") as f:
+                    descriptor = PlantillaSiigo(**json.load(f))
+                logging.debug("Plantilla servida desde caché: %s", plantilla_path)
+            except Exception as e:
+                logging.warning("No se pudo leer la caché de la plantilla: %s", e)
+        
+        if descriptor is None:
+            descriptor = PlantillaSiigo.leer(plantilla_path)
+            if PlantillaSiigo.en_disco:
+                temporal = f"{ruta}.{os.getpid()}.tmp"
+                try:
+                    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                    with open(temporal, "w", encoding="utf-8") as f:
+                        json.dump(descriptor.a_datos(), f, ensure_ascii=False)
+                    os.replace(temporal, ruta)
+                except Exception as e:
+                    logging.warning("No se pudo guardar la caché de la plantilla: %s", e)
+                    if os.path.exists(temporal):
+                        os.remove(temporal)
+        
+        PlantillaSiigo._descriptores[clave] = descriptor
+        return descriptor
+
+    BORDES_XLSXWRITER = {"thin": 1, "medium": 2, "dashed": 3, "dotted": 4, "thick": 5, "double": 6,
+                         "hair": 7, "mediumDashed": 8, "dashDot": 9, "mediumDashDot": 10,
+                         "dashDotDot": 11, "mediumDashDotDot": 12, "slantDashDot": 13}
+    
+    # Matices (tint) de los seis tonos que xlsxwriter admite para cada color del tema
+    TINTES_TEMA = {0: (0, -0.05, -0.15, -0.25, -0.35, -0.5),
+                   1: (0, 0.5, 0.35, 0.25, 0.15, 0.05),
+                   2: (0, -0.1, -0.25, -0.5, -0.75, -0.9)}
+    TINTES_TEMA_ACENTOS = (0, 0.8, 0.6, 0.4, -0.25, -0.5)
+    
+    @staticmethod
+    def _color(color):
+        """Color de openpyxl para xlsxwriter: '#RRGGBB' o color del tema (None si es automático).
+        
+        xlsxwriter solo admite los tonos de la paleta de Excel; un matiz (tint) fuera de
+        la paleta se aproxima al tono más cercano del mismo color del tema."""
+        if color is None:
+            return None
+        if color.type == "rgb" and isinstance(color.rgb, str):
+            return "#" + color.rgb[-6:]
+        if color.type == "indexed" and color.indexed is not None and color.indexed < 64:
+            return "#" + importlib.import_module("openpyxl.styles.colors").COLOR_INDEX[color.indexed][-6:]
+        if color.type == "theme" and 0 <= color.theme <= 9:
+            tintes = PlantillaSiigo.TINTES_TEMA.get(color.theme, PlantillaSiigo.TINTES_TEMA_ACENTOS)
+            tono = min(range(len(tintes)), key=lambda i: abs(tintes[i] - (color.tint or 0)))
+            return ColorXlsx.theme(color.theme, tono)
+        return None
+
+    @staticmethod
+    def _formato_xlsxwriter(estilo) -> Optional[dict]:
+        """Tupla de estilo (fuente, relleno, borde, alineación, formato[, protección]) como propiedades de xlsxwriter"""
+        if estilo is None:
+            return None
+        fuente, relleno, borde, alineacion, formato_numero = estilo[:5]
+        propiedades = {"font_name": fuente.name, "font_size": fuente.sz, "bold": bool(fuente.b),
+                       "italic": bool(fuente.i), "num_format": formato_numero,
+                       "text_wrap": bool(alineacion.wrap_text)}
+        if fuente.u:
+            propiedades["underline"] = 2 if fuente.u == "double" else 1
+        if PlantillaSiigo._color(fuente.color):
+            propiedades["font_color"] = PlantillaSiigo._color(fuente.color)
+        if relleno.patternType == "solid" and PlantillaSiigo._color(relleno.fgColor):
+            propiedades["pattern"] = 1
+            propiedades["bg_color"] = PlantillaSiigo._color(relleno.fgColor)
+        for lado in ("left", "right", "top", "bottom"):
+            linea = getattr(borde, lado)
+            if linea is not None and linea.style in PlantillaSiigo.BORDES_XLSXWRITER:
+                propiedades[lado] = PlantillaSiigo.BORDES_XLSXWRITER[linea.style]
+                if PlantillaSiigo._color(linea.color):
+                    propiedades[f"{lado}_color"] = PlantillaSiigo._color(linea.color)
+        if alineacion.horizontal:
+            propiedades["align"] = alineacion.horizontal
+        if alineacion.vertical:
+            propiedades["valign"] = "vcenter" if alineacion.vertical == "center" else alineacion.vertical
+        if len(estilo) > 5 and estilo[5] is not None:
+            propiedades["locked"] = estilo[5].locked is not False
+            propiedades["hidden"] = bool(estilo[5].hidden)
+        return propiedades
+
+    def formatos_xlsxwriter(self) -> list:
+        """Estilo del encabezado de cada columna como propiedades de formato de xlsxwriter"""
+        return [PlantillaSiigo._formato_xlsxwriter(estilo) for estilo in self.estilos]
+
+    def crear_hoja(self, wb) -> tuple:
+        """Crea en un libro write-only la hoja con los anchos y el encabezado; devuelve (hoja, encabezado)"""
+        ws = wb.create_sheet(title=self.titulo)
+        ws.sheet_view.zoomScale = self.zoom
+        for letra, ancho in self.anchos.items():
+            ws.column_dimensions[letra].width = ancho
+        for letra, estilo in self.estilos_columnas.items():
+            dimension = ws.column_dimensions[letra]
+            (dimension.font, dimension.fill, dimension.border, dimension.alignment,
+             dimension.number_format, dimension.protection) = estilo
+        if self.alto_encabezado:
+            ws.row_dimensions[1].height = self.alto_encabezado
+        
+        encabezado = []
+        for nombre, estilo, comentario in zip(COLUMNAS_SIIGO, self.estilos, self.comentarios):
+            celda = WriteOnlyCell(ws, value=nombre)
+            if estilo is not None:
+                celda.font, celda.fill, celda.border, celda.alignment, celda.number_format = estilo
+            if comentario is not None:
+                # Un Comment de openpyxl solo puede pertenecer a una celda: se crea uno por archivo
+                celda.comment = Comentario(*comentario)
+            encabezado.append(celda)
+        return ws, encabezado
 
 
 class ExcelExporter:
     """Maneja la exportación a Excel"""
     
+    # Formato aplicado a "Fecha de elaboración" al escribir
+    FORMATO_FECHA = 'YYYY-MM-DD'
+    # Formato que openpyxl da a las demás fechas (xlsxwriter necesita uno explícito)
+    FORMATO_FECHA_PREDETERMINADO = 'yyyy-mm-dd'
+    
+    # Motores de escritura disponibles; xlsxwriter es opcional
+    MOTORES = ("openpyxl", "xlsxwriter")
+    
     @staticmethod
-    def generar_archivo(df: pd.DataFrame, plantilla_path: str) -> str:
-        """Genera el archivo Excel final"""
+    def generar_archivo(df: Union[pd.DataFrame, Iterable[pd.DataFrame]], plantilla_path: str,
+                        streaming: bool = True, carpeta_exportados: Optional[str] = None,
+                        sufijo: str = "", motor: str = "openpyxl") -> str:
+        """Genera el archivo Excel final
+
+        Las columnas se escriben en el orden de la plantilla SIIGO; las que
+        faltan en ``df`` se completan con su valor fijo o vacías. ``df`` puede
+        ser también una secuencia de lotes con las mismas columnas (ver
+        MotorSQLite.lotes). Por defecto escribe en modo streaming (hoja write-only, una sola
+        pasada y memoria plana). Con ``streaming=False`` rellena la plantilla
+        original celda por celda. Con ``motor="xlsxwriter"`` escribe con
+        xlsxwriter en modo ``constant_memory`` (mucho más rápido), rearmando
+        el encabezado de la plantilla. ``sufijo`` distingue archivos
+        generados en el mismo segundo (por ejemplo, trabajos de un lote).
+        """
+        if motor not in ExcelExporter.MOTORES:
+            raise ValueError(f"Motor de exportación no válido: {motor}")
+        if motor == "xlsxwriter" and xlsxwriter is None:
+            logging.warning("xlsxwriter no está instalado; se exporta con openpyxl")
+            motor = "openpyxl"
+        
         # Crear carpeta de exportados
-        carpeta_exportados = os.path.join(os.getcwd(), "Exportados SIIGO")
+        carpeta_exportados = carpeta_exportados or os.path.join(os.getcwd(), "Exportados SIIGO")
         os.makedirs(carpeta_exportados, exist_ok=True)
         
         # Generar nombre de archivo
         fecha_hora = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        archivo_salida = os.path.join(carpeta_exportados, f"SIIGO_Ingresos_{fecha_hora}.xlsx")
+        sufijo = f"_{sufijo}" if sufijo else ""
+        archivo_salida = os.path.join(carpeta_exportados, f"SIIGO_Ingresos{sufijo}_{fecha_hora}.xlsx")
+        
+        # Se escribe a un archivo parcial y se publica solo si termina bien
+        archivo_parcial = archivo_salida + ".parcial"
+        try:
+            if motor == "xlsxwriter":
+                ExcelExporter._escribir_xlsxwriter(df, plantilla_path, archivo_parcial)
+            elif streaming:
+                ExcelExporter._escribir_streaming(df, plantilla_path, archivo_parcial)
+            else:
+                if not isinstance(df, pd.DataFrame):
+                    df = pd.concat(list(df), ignore_index=True)
+                ExcelExporter._escribir_sobre_plantilla(df, plantilla_path, archivo_parcial)
+            os.replace(archivo_parcial, archivo_salida)
+        finally:
+            if os.path.exists(archivo_parcial):
+                os.remove(archivo_parcial)
+        return archivo_salida
+
+    @staticmethod
+    def _escribir_streaming(df: Union[pd.DataFrame, Iterable[pd.DataFrame]], plantilla_path: str,
+                            archivo_salida: str, tamano_lote: int = TAMANO_LOTE):
+        """Escribe el archivo con una hoja write-only conservando el encabezado de la plantilla"""
+        # Encabezado y anchos de la plantilla, sin volver a abrirla (ver PlantillaSiigo)
+        wb = openpyxl.Workbook(write_only=True)
+        ws, encabezado = PlantillaSiigo.obtener(plantilla_path).crear_hoja(wb)
+        ws.append(encabezado)
+        
+        # El formato de fecha se aplica en la misma pasada
+        for fila in ExcelExporter._filas(df, tamano_lote):
+            if isinstance(fila[_INDICE_FECHA], date):
+                celda = WriteOnlyCell(ws, value=fila[_INDICE_FECHA])
+                celda.number_format = ExcelExporter.FORMATO_FECHA
+                fila[_INDICE_FECHA] = celda
+            ws.append(fila)
+        
+        wb.save(archivo_salida)
+
+    @staticmethod
+    def _filas(df: Union[pd.DataFrame, Iterable[pd.DataFrame]], tamano_lote: int = TAMANO_LOTE) -> Iterator[list]:
+        """Filas completas en el orden de la plantilla, lote a lote
+
+        Las columnas reales se copian sobre una fila con los valores
+        virtuales; los nulos quedan en None (o "" en las columnas que SIIGO
+        espera en blanco) y los consecutivos salen decodificados.
+        """
+        if isinstance(df, pd.DataFrame):
+            lotes = (df.iloc[inicio:inicio + tamano_lote] for inicio in range(0, len(df), tamano_lote))
+        else:
+            lotes = df
+        reales = None
+        for lote in lotes:
+            if reales is None:
+                reales = DataProcessor.columnas_reales(lote)
+                posiciones = [COLUMNAS_SIIGO.index(col) for col in reales]
+                fila_base = [None if col in reales else VALORES_FIJOS_SIIGO.get(col, "") for col in COLUMNAS_SIIGO]
+            lote = lote[reales]
+            if "Consecutivo" in reales and CodificadorConsecutivos.es_codificado(lote["Consecutivo"]):
+                lote = lote.assign(Consecutivo=CodificadorConsecutivos.decodificar(lote["Consecutivo"]))
+            lote = lote.astype(object).where(lote.notna(), None)
+            for col in COLUMNAS_EN_BLANCO_SIIGO:
+                if col in reales:
+                    lote[col] = lote[col].where(lote[col].notna(), "")
+            for valores in lote.itertuples(index=False, name=None):
+                fila = fila_base.copy()
+                for posicion, valor in zip(posiciones, valores):
+                    fila[posicion] = valor
+                yield fila
+
+    @staticmethod
+    def _escribir_xlsxwriter(df: Union[pd.DataFrame, Iterable[pd.DataFrame]], plantilla_path: str,
+                             archivo_salida: str, tamano_lote: int = TAMANO_LOTE):
+        """Escribe el archivo con xlsxwriter en modo constant_memory, fila por fila
+
+        El encabezado (estilos, anchos y alto) sale del descriptor de la
+        plantilla y las fechas se escriben como fechas nativas de Excel. Las
+        celdas vacías o con "" quedan en blanco y los textos se guardan como
+        cadenas en línea, no en la tabla compartida.
+        """
+        plantilla = PlantillaSiigo.obtener(plantilla_path)
+        wb = xlsxwriter.Workbook(archivo_salida, {"constant_memory": True, "strings_to_urls": False,
+                                                  "strings_to_formulas": False})
+        try:
+            ws = wb.add_worksheet(plantilla.titulo)
+            if plantilla.zoom:
+                ws.set_zoom(plantilla.zoom)
+            for letra in sorted(set(plantilla.anchos) | set(plantilla.estilos_columnas),
+                                key=openpyxl.utils.column_index_from_string):
+                ancho = plantilla.anchos.get(letra)
+                propiedades = PlantillaSiigo._formato_xlsxwriter(plantilla.estilos_columnas.get(letra))
+                # Mismo ancho guardado que en la plantilla (Calibri 11: 7 píxeles por carácter)
+                ws.set_column_pixels(f"{letra}:{letra}", round(ancho * 7) if ancho else None,
+                                     wb.add_format(propiedades) if propiedades else None)
+            if plantilla.alto_encabezado:
+                ws.set_row(0, plantilla.alto_encabezado)
+            
+            for c_idx, (nombre, propiedades) in enumerate(zip(COLUMNAS_SIIGO, plantilla.formatos_xlsxwriter())):
+                ws.write_string(0, c_idx, nombre, wb.add_format(propiedades) if propiedades else None)
+                comentario = plantilla.comentarios[c_idx]
+                if comentario:
+                    texto, autor, ancho_comentario, alto_comentario = comentario
+                    ws.write_comment(0, c_idx, texto, {"author": autor, "width": ancho_comentario,
+                                                       "height": alto_comentario})
+            
+            formato_fecha = wb.add_format({"num_format": ExcelExporter.FORMATO_FECHA})
+            formato_otras_fechas = wb.add_format({"num_format": ExcelExporter.FORMATO_FECHA_PREDETERMINADO})
+            # Sin formato propio xlsxwriter aplica el de la columna; openpyxl deja la celda en General
+            formato_general = wb.add_format()
+            for r_idx, fila in enumerate(ExcelExporter._filas(df, tamano_lote), start=1):
+                for c_idx, valor in enumerate(fila):
+                    if valor is None or valor == "":
+                        continue
+                    if isinstance(valor, str):
+                        ws.write_string(r_idx, c_idx, valor, formato_general)
+                    elif isinstance(valor, bool):
+                        ws.write_boolean(r_idx, c_idx, valor, formato_general)
+                    elif isinstance(valor, date):
+                        ws.write_datetime(r_idx, c_idx, valor,
+                                          formato_fecha if c_idx == _INDICE_FECHA else formato_otras_fechas)
+                    else:
+                        ws.write_number(r_idx, c_idx, valor, formato_general)
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _escribir_sobre_plantilla(df: pd.DataFrame, plantilla_path: str, archivo_salida: str):
+        """Rellena la plantilla celda por celda (modo sin streaming)"""
+        df = DataProcessor.materializar(df)
         
         # Cargar plantilla
         wb = openpyxl.load_workbook(plantilla_path)
@@ -241,42 +1747,1163 @@ class ExcelExporter:
                                   min_col=fecha_col, max_col=fecha_col):
                 for cell in row:
                     if isinstance(cell.value, datetime):
-                        cell.number_format = 'YYYY-MM-DD'
+                        cell.number_format = ExcelExporter.FORMATO_FECHA
         
         wb.save(archivo_salida)
+
+
+class MetricasEjecucion:
+    """Mide cada etapa de una ejecución y la guarda como una línea JSON en siigo_metricas.jsonl
+
+    Por etapa registra tiempo de reloj, tiempo de CPU, registros de entrada y
+    de salida, la memoria residente al terminarla y cuánto cambió durante la
+    etapa. El pico de memoria es de todo el proceso y no se puede atribuir a
+    una etapa: se registra una vez por ejecución.
+    """
+    
+    ARCHIVO = "siigo_metricas.jsonl"
+    
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.inicio_cpu = time.process_time()
+        self.etapas = []
+        self._etapa = None
+
+    @staticmethod
+    def _contadores_windows() -> Optional[tuple]:
+        """(memoria residente, pico de memoria residente) del proceso en bytes, con la API de psapi"""
+        from ctypes import wintypes
+        
+        class ContadoresMemoria(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (nombre, ctypes.c_size_t) for nombre in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                    "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+        
+        contadores = ContadoresMemoria()
+        contadores.cb = ctypes.sizeof(contadores)
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi = ctypes.windll.psapi
+        psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ContadoresMemoria),
+                                               wintypes.DWORD]
+        if psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(contadores), contadores.cb):
+            return contadores.WorkingSetSize, contadores.PeakWorkingSetSize
+        return None
+
+    @staticmethod
+    def memoria_actual_mb() -> Optional[float]:
+        """Memoria residente del proceso en este momento, en MB (None si no se puede medir)"""
+        try:
+            if sys.platform.startswith("linux"):
+                with open("/proc/self/statm") as f:
+                    paginas = int(f.read().split()[1])
+                return round(paginas * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+            if sys.platform == "win32":
+                contadores = MetricasEjecucion._contadores_windows()
+                if contadores is not None:
+                    return round(contadores[0] / (1024 * 1024), 1)
+        except (OSError, AttributeError, ValueError):
+            logging.debug("No se pudo medir la memoria", exc_info=True)
+        return None
+
+    @staticmethod
+    def memoria_pico_mb() -> Optional[float]:
+        """Pico de memoria residente desde que empezó el proceso, en MB (None si no se puede medir)"""
+        try:
+            if resource is not None:
+                pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                # Linux informa KB; macOS, bytes
+                return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+            if sys.platform == "win32":
+                contadores = MetricasEjecucion._contadores_windows()
+                if contadores is not None:
+                    return round(contadores[1] / (1024 * 1024), 1)
+        except (OSError, AttributeError, ValueError):
+            logging.debug("No se pudo medir el pico de memoria", exc_info=True)
+        return None
+
+    def iniciar(self, nombre: str, filas_entrada: int = 0):
+        """Empieza a medir una etapa (cierra sin filas de salida la que siguiera abierta)"""
+        if self._etapa is not None:
+            self.terminar(None)
+        self._etapa = (nombre, filas_entrada, time.perf_counter(), time.process_time(),
+                       MetricasEjecucion.memoria_actual_mb())
+
+    def terminar(self, filas_salida: Optional[int]) -> Optional[dict]:
+        """Cierra la etapa en curso, la registra en el log y devuelve su medición"""
+        if self._etapa is None:
+            return None
+        nombre, filas_entrada, inicio, inicio_cpu, rss_inicio = self._etapa
+        self._etapa = None
+        rss = MetricasEjecucion.memoria_actual_mb()
+        medicion = {
+            "etapa": nombre,
+            "segundos": round(time.perf_counter() - inicio, 3),
+            "cpu_segundos": round(time.process_time() - inicio_cpu, 3),
+            "filas_entrada": filas_entrada,
+            "filas_salida": filas_salida,
+            "rss_mb": rss,
+            "rss_cambio_mb": None if rss is None or rss_inicio is None else round(rss - rss_inicio, 1),
+        }
+        self.etapas.append(medicion)
+        logging.info("Etapa %s: %.3f s (CPU %.3f s), %s -> %s registros, RSS %s MB (cambio %s MB)",
+                     nombre, medicion["segundos"], medicion["cpu_segundos"], filas_entrada,
+                     filas_salida, rss, medicion["rss_cambio_mb"])
+        return medicion
+
+    @contextmanager
+    def medir(self, nombre: str, filas_entrada: int = 0):
+        """Mide el bloque como una etapa; el bloque asigna medicion["filas_salida"]"""
+        medicion = {"filas_salida": None}
+        self.iniciar(nombre, filas_entrada)
+        try:
+            yield medicion
+        finally:
+            self.terminar(medicion["filas_salida"])
+
+    def guardar(self, **datos):
+        """Agrega el registro de la ejecución a siigo_metricas.jsonl, junto al log"""
+        self.terminar(None)
+        registro = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            **datos,
+            "segundos": round(time.perf_counter() - self.inicio, 3),
+            "cpu_segundos": round(time.process_time() - self.inicio_cpu, 3),
+            "rss_pico_proceso_mb": MetricasEjecucion.memoria_pico_mb(),
+            "etapas": self.etapas,
+        }
+        try:
+            with open(os.path.join(directorio_aplicacion(), MetricasEjecucion.ARCHIVO), "a",
+                      encoding="utf-8") as f:
+                f.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+        except OSError:
+            logging.exception("No se pudieron guardar las métricas de la ejecución")
+
+    @staticmethod
+    def guardar_perfil(perfil: cProfile.Profile, sufijo: str = "") -> str:
+        """Guarda el perfil de cProfile (.prof) y un resumen legible (.txt) junto al log"""
+        fecha_hora = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        sufijo = f"_{sufijo}" if sufijo else ""
+        ruta = os.path.join(directorio_aplicacion(), f"siigo_perfil{sufijo}_{fecha_hora}")
+        perfil.dump_stats(ruta + ".prof")
+        with open(ruta + ".txt", "w", encoding="utf-8") as f:
+            pstats.Stats(perfil, stream=f).sort_stats("cumulative").print_stats(40)
+        logging.info("Perfil de la ejecución guardado en %s.prof", ruta)
+        return ruta + ".prof"
+
+
+class RegistroExportados:
+    """Registro local (SQLite) de los consecutivos ya exportados a SIIGO
+
+    Cada consecutivo se guarda con la empresa y el tipo de comprobante de la
+    plantilla, tal como queda en el archivo (sin las 'E' iniciales). Así una
+    ejecución diaria sobre reportes que se solapan puede omitir las facturas
+    que SIIGO ya importó. La clave primaria de la tabla es el índice que usa
+    la consulta de exclusión.
+    """
+    
+    ARCHIVO = "siigo_exportados.db"
+    EMPRESA = VALORES_FIJOS_SIIGO["Identificación vendedor"]
+    TIPO_COMPROBANTE = VALORES_FIJOS_SIIGO["Tipo de comprobante"]
+    
+    def __init__(self, ruta: Optional[str] = None):
+        self.ruta = ruta or os.path.join(directorio_aplicacion(), RegistroExportados.ARCHIVO)
+
+    def conectar(self) -> sqlite3.Connection:
+        """Abre la base (creando la tabla si hace falta); el timeout cubre lotes en paralelo"""
+        conexion = sqlite3.connect(self.ruta, timeout=30)
+        conexion.execute(
+            "CREATE TABLE IF NOT EXISTS exportados ("
+            " empresa INTEGER NOT NULL,"
+            " tipo_comprobante INTEGER NOT NULL,"
+            " consecutivo TEXT NOT NULL,"
+            " archivo TEXT,"
+            " fecha TEXT,"
+            " PRIMARY KEY (empresa, tipo_comprobante, consecutivo)"
+            ") WITHOUT ROWID")
+        return conexion
+
+    @staticmethod
+    def consecutivos_unicos(serie: pd.Series) -> Tuple[np.ndarray, list]:
+        """Valores distintos de la columna Consecutivo y su texto en el archivo exportado"""
+        unicos = pd.unique(serie.dropna())
+        if CodificadorConsecutivos.es_codificado(serie):
+            textos = CodificadorConsecutivos.decodificar(pd.Series(unicos, dtype=np.int64))
+        else:
+            textos = pd.Series(unicos, dtype=object).astype(str)
+        return unicos, textos.tolist()
+
+    def excluir_exportados(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+        """Quita las filas cuyo consecutivo ya está en el registro; devuelve (df, facturas omitidas)"""
+        if len(df) == 0:
+            return df, 0
+        unicos, textos = RegistroExportados.consecutivos_unicos(df["Consecutivo"])
+        
+        conexion = self.conectar()
+        try:
+            # Los candidatos van a una tabla temporal y se cruzan contra la clave primaria
+            conexion.execute("CREATE TEMP TABLE candidatos (posicion INTEGER, consecutivo TEXT)")
+            conexion.executemany("INSERT INTO temp.candidatos VALUES (?, ?)", enumerate(textos))
+            posiciones = [fila[0] for fila in conexion.execute(
+                "SELECT c.posicion FROM temp.candidatos c"
+                " WHERE EXISTS (SELECT 1 FROM exportados e"
+                "  WHERE e.empresa = ? AND e.tipo_comprobante = ? AND e.consecutivo = c.consecutivo)",
+                (RegistroExportados.EMPRESA, RegistroExportados.TIPO_COMPROBANTE))]
+        finally:
+            conexion.close()
+        
+        if not posiciones:
+            return df, 0
+        exportados = df["Consecutivo"].isin(unicos[np.array(posiciones)])
+        return df[~exportados].reset_index(drop=True), len(posiciones)
+
+    def registrar(self, consecutivos: Union[pd.Series, Iterable[str]], archivo: str) -> int:
+        """Guarda los consecutivos de un archivo ya exportado (columna o textos); devuelve cuántos eran nuevos"""
+        if isinstance(consecutivos, pd.Series):
+            _, textos = RegistroExportados.consecutivos_unicos(consecutivos)
+        else:
+            textos = consecutivos
+        fecha = datetime.now().isoformat(timespec="seconds")
+        conexion = self.conectar()
+        try:
+            with conexion:
+                antes = conexion.total_changes
+                conexion.executemany(
+                    "INSERT OR IGNORE INTO exportados VALUES (?, ?, ?, ?, ?)",
+                    ((RegistroExportados.EMPRESA, RegistroExportados.TIPO_COMPROBANTE, texto,
+                      os.path.basename(archivo), fecha) for texto in textos))
+                nuevos = conexion.total_changes - antes
+        finally:
+            conexion.close()
+        logging.info("Registro de exportados: %d consecutivos nuevos de %s", nuevos, archivo)
+        return nuevos
+
+
+class MotorSQLite:
+    """Prepara el archivo con SQL sobre una base SQLite temporal en disco
+
+    Alternativa a DataProcessor para reportes de meses o años que no caben
+    en memoria: los reportes se cargan por lotes y el renombrado, los
+    filtros, la unión y la consolidación corren como SQL, de modo que los
+    ordenamientos y las tablas intermedias se vuelcan a disco. El resultado
+    se entrega al exportador por lotes (ver ``lotes``) con las mismas
+    columnas que ``preparar_estructura_final``.
+    """
+    
+    # Columnas de la tabla resultado y su nombre en la plantilla
+    COLUMNAS_RESULTADO = {
+        "consecutivo": "Consecutivo",
+        "codigo": "Código producto",
+        "descripcion": "Descripción producto",
+        "cantidad": "Cantidad producto",
+        "valor_unitario": "Valor unitario",
+        "tercero": "Identificación tercero",
+        "fecha": "Fecha de elaboración",
+        "valor_pago": "Valor Forma de Pago",
+    }
+    
+    # Facturas con tercero, fecha y total cuyo consecutivo empieza con 'E' (ver filtrar_para_combinar)
+    _FACTURAS_VALIDAS = ("SELECT * FROM facturas WHERE tercero IS NOT NULL AND fecha IS NOT NULL"
+                         " AND valor_pago IS NOT NULL AND substr(consecutivo, 1, 1) IN ('E', 'e')")
+    
+    def __init__(self, carpeta: Optional[str] = None):
+        if sqlite3.sqlite_version_info < (3, 25, 0):
+            raise RuntimeError(f"El motor SQLite requiere SQLite 3.25 o superior (hay {sqlite3.sqlite_version})")
+        descriptor, self.ruta = tempfile.mkstemp(prefix="siigo_", suffix=".db", dir=carpeta)
+        os.close(descriptor)
+        self.copiar_fecha_vencimiento = False
+        
+        self.conexion = sqlite3.connect(self.ruta)
+        for pragma in ("journal_mode = OFF", "synchronous = OFF", "temp_store = FILE", "cache_size = -65536"):
+            self.conexion.execute(f"PRAGMA {pragma}")
+        
+        # Tablas con los valores tal como vienen y vistas con el renombrado de procesar_reporte1/2
+        self.conexion.executescript("""
+            CREATE TABLE reporte1 (fila INTEGER PRIMARY KEY, factura TEXT, codigo, referencia,
+                                   cantidad, valor_total);
+            CREATE TABLE reporte2 (fila INTEGER PRIMARY KEY, numero TEXT, NitEmpresa TEXT, f_fact, total);
+            CREATE VIEW productos AS
+                SELECT fila, factura AS consecutivo, codigo, referencia AS descripcion, cantidad,
+                       CAST(valor_total AS REAL) / cantidad AS valor_unitario
+                FROM reporte1 WHERE valor_total IS NULL OR valor_total != 0;
+            CREATE VIEW facturas AS
+                SELECT fila, numero AS consecutivo, NitEmpresa AS tercero, f_fact AS fecha, total AS valor_pago
+                FROM reporte2;
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.cerrar()
+
+    def cerrar(self):
+        """Cierra la conexión y borra la base temporal"""
+        self.conexion.close()
+        try:
+            os.remove(self.ruta)
+        except OSError:
+            logging.warning("No se pudo borrar la base temporal %s", self.ruta)
+
+    @staticmethod
+    def _valores(serie: pd.Series, es_fecha: bool = False) -> list:
+        """Valores de una columna como tipos de Python que SQLite acepta (NaN como NULL)"""
+        if es_fecha and pd.api.types.is_datetime64_any_dtype(serie):
+            serie = serie.dt.strftime("%Y-%m-%d %H:%M:%S")
+        valores = serie.astype(object).where(serie.notna(), None).tolist()
+        if es_fecha:
+            valores = [str(valor) if isinstance(valor, date) else valor for valor in valores]
+        return valores
+
+    def cargar_reporte1(self, lotes: Union[pd.DataFrame, Iterable[pd.DataFrame]]) -> int:
+        """Carga el Reporte 1 sin procesar, lote por lote; devuelve las filas cargadas"""
+        if isinstance(lotes, pd.DataFrame):
+            lotes = [lotes]
+        filas = 0
+        with self.conexion:
+            for lote in lotes:
+                # El consecutivo se pasa a texto por lote, como en procesar_reporte1
+                columnas = [lote["factura"].astype(str).tolist()] + [
+                    MotorSQLite._valores(lote[col]) for col in COLUMNAS_REPORTE1[1:]]
+                self.conexion.executemany(
+                    "INSERT INTO reporte1 (factura, codigo, referencia, cantidad, valor_total)"
+                    " VALUES (?, ?, ?, ?, ?)", zip(*columnas))
+                filas += len(lote)
+        return filas
+
+    def cargar_reporte2(self, df: pd.DataFrame) -> int:
+        """Carga el Reporte 2 (ya filtrado por usuario) e indexa su consecutivo"""
+        nit = df["NitEmpresa"]
+        columnas = [df["numero"].astype(str).tolist(),
+                    nit.astype(str).where(nit.notna(), None).tolist(),
+                    MotorSQLite._valores(df["f_fact"], es_fecha=True),
+                    MotorSQLite._valores(df["total"])]
+        with self.conexion:
+            self.conexion.executemany(
+                "INSERT INTO reporte2 (numero, NitEmpresa, f_fact, total) VALUES (?, ?, ?, ?)", zip(*columnas))
+            self.conexion.execute("CREATE INDEX reporte2_numero ON reporte2 (numero)")
+        return len(df)
+
+    def contar(self, tabla: str) -> int:
+        """Cantidad de filas de una tabla de trabajo"""
+        return self.conexion.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+
+    def combinar(self, duplicados: str = "primero",
+                 avisar: Optional[Callable[[str], None]] = None) -> Tuple[int, int]:
+        """Une cada línea de producto con su factura (ver DataProcessor.combinar_reportes)
+
+        Devuelve las líneas combinadas y cuántas líneas del Reporte 1 no
+        tienen tercero en el Reporte 2.
+        """
+        sin_coincidencia = self.conexion.execute(
+            "SELECT COUNT(*) FROM productos p WHERE NOT EXISTS"
+            " (SELECT 1 FROM facturas f WHERE f.consecutivo = p.consecutivo AND f.tercero IS NOT NULL)"
+        ).fetchone()[0]
+        
+        validas = MotorSQLite._FACTURAS_VALIDAS
+        repetidas = self.conexion.execute(
+            f"SELECT COUNT(*) - COUNT(DISTINCT consecutivo) FROM ({validas})").fetchone()[0]
+        if repetidas:
+            consecutivos = self.conexion.execute(
+                f"SELECT COUNT(*) FROM (SELECT consecutivo FROM ({validas}) GROUP BY consecutivo"
+                " HAVING COUNT(*) > 1)").fetchone()[0]
+            ejemplos = [fila[0] for fila in self.conexion.execute(
+                f"SELECT consecutivo FROM ({validas}) GROUP BY consecutivo HAVING COUNT(*) > 1"
+                " ORDER BY MIN(fila) LIMIT ?", (DataProcessor.MAX_CONSECUTIVOS_AVISO,))]
+            descripcion = DataProcessor.describir_repetidos(repetidas, consecutivos, ejemplos)
+            if duplicados == "error":
+                raise ValueError(descripcion)
+            if duplicados == "expandir":
+                DataProcessor.avisar_repetidos(f"{descripcion}; se repiten sus líneas de producto", avisar)
+            else:
+                DataProcessor.avisar_repetidos(
+                    f"{descripcion}; se usa la primera factura de cada uno y se descartan las demás", avisar)
+                validas = (f"SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY consecutivo ORDER BY fila)"
+                           f" AS orden FROM ({validas})) WHERE orden = 1")
+        
+        with self.conexion:
+            self.conexion.execute(
+                "CREATE TABLE combinado AS"
+                " SELECT p.fila AS fila_p, f.fila AS fila_f, p.consecutivo, p.codigo, p.descripcion,"
+                "        p.cantidad, p.valor_unitario, f.tercero, f.fecha, f.valor_pago"
+                f" FROM productos p JOIN ({validas}) f ON f.consecutivo = p.consecutivo")
+        return self.contar("combinado"), sin_coincidencia
+
+    def limpiar(self) -> int:
+        """Quita las 'E' iniciales del consecutivo y el dígito de verificación del NIT (ver limpiar_datos)"""
+        with self.conexion:
+            self.conexion.execute(
+                "CREATE TABLE limpio AS"
+                " SELECT fila_p, fila_f, ltrim(consecutivo, 'Ee') AS consecutivo, codigo, descripcion,"
+                "        cantidad, valor_unitario,"
+                "        CASE WHEN instr(tercero, '-') > 0 THEN substr(tercero, 1, instr(tercero, '-') - 1)"
+                "             ELSE tercero END AS tercero,"
+                "        fecha, valor_pago"
+                " FROM combinado")
+            self.conexion.execute("DROP TABLE combinado")
+        return self.contar("limpio")
+
+    def excluir_exportados(self, registro: RegistroExportados) -> Tuple[int, int]:
+        """Borra las facturas que ya están en el registro; devuelve (filas restantes, facturas omitidas)"""
+        registro.conectar().close()
+        self.conexion.execute("ATTACH DATABASE ? AS registro", (registro.ruta,))
+        try:
+            condicion = ("EXISTS (SELECT 1 FROM registro.exportados e WHERE e.empresa = ?"
+                         " AND e.tipo_comprobante = ? AND e.consecutivo = limpio.consecutivo)")
+            parametros = (RegistroExportados.EMPRESA, RegistroExportados.TIPO_COMPROBANTE)
+            omitidas = self.conexion.execute(
+                f"SELECT COUNT(DISTINCT consecutivo) FROM limpio WHERE {condicion}", parametros).fetchone()[0]
+            if omitidas:
+                with self.conexion:
+                    self.conexion.execute(f"DELETE FROM limpio WHERE {condicion}", parametros)
+        finally:
+            self.conexion.execute("DETACH DATABASE registro")
+        return self.contar("limpio"), omitidas
+
+    def preparar(self, copiar_fecha_vencimiento: bool = False) -> int:
+        """Deja el valor de la forma de pago solo en la primera línea de cada consecutivo (ver preparar_estructura_final)"""
+        self.copiar_fecha_vencimiento = copiar_fecha_vencimiento
+        with self.conexion:
+            self.conexion.execute(
+                "CREATE TABLE resultado AS"
+                " SELECT consecutivo, codigo, descripcion, cantidad, valor_unitario, tercero, fecha,"
+                "        CASE WHEN ROW_NUMBER() OVER (PARTITION BY consecutivo ORDER BY fila_p, fila_f) = 1"
+                "             THEN valor_pago END AS valor_pago"
+                " FROM limpio ORDER BY fila_p, fila_f")
+            self.conexion.execute("DROP TABLE limpio")
+        return self.contar("resultado")
+
+    def lotes(self, tamano_lote: int = TAMANO_LOTE) -> Iterator[pd.DataFrame]:
+        """Filas del resultado por lotes, con los nombres de la plantilla y las fechas convertidas"""
+        columnas = list(MotorSQLite.COLUMNAS_RESULTADO)
+        cursor = self.conexion.execute(f"SELECT {', '.join(columnas)} FROM resultado ORDER BY rowid")
+        try:
+            while True:
+                filas = cursor.fetchmany(tamano_lote)
+                if not filas:
+                    break
+                lote = pd.DataFrame.from_records(
+                    filas, columns=[MotorSQLite.COLUMNAS_RESULTADO[col] for col in columnas])
+                lote["Fecha de elaboración"] = pd.to_datetime(lote["Fecha de elaboración"]).dt.date
+                if self.copiar_fecha_vencimiento:
+                    lote["Fecha Vencimiento"] = lote["Fecha de elaboración"]
+                yield lote
+        finally:
+            cursor.close()
+
+    def consecutivos(self) -> Iterator[str]:
+        """Consecutivos distintos del resultado (para RegistroExportados.registrar)"""
+        for fila in self.conexion.execute("SELECT DISTINCT consecutivo FROM resultado"):
+            yield fila[0]
+
+
+class ProcesoCancelado(Exception):
+    """El usuario canceló el proceso entre dos etapas"""
+
+
+class ProcesoSiigo:
+    """Ejecuta el pipeline completo y reporta su avance por una cola de eventos
+
+    Está pensado para correr en un hilo de trabajo: no toca la interfaz y
+    solo publica tuplas ``(tipo, datos)`` en ``eventos``. Los tipos son
+    "etapa", "filas", "filtro", "aviso", "pregunta", "fin", "detenido",
+    "cancelado" y "error".
+    Entre etapas revisa ``cancelar``; si se canceló después de exportar, el
+    archivo generado se elimina. Cada ejecución deja sus métricas por etapa
+    en siigo_metricas.jsonl y, con ``perfilar``, un perfil de cProfile.
+    Los consecutivos exportados quedan en el RegistroExportados; con
+    ``omitir_exportados`` los que ya estaban se quitan antes de exportar.
+    Con ``usar_sqlite`` las etapas corren en un MotorSQLite en disco en vez
+    de en memoria con DataProcessor. ``motor_excel`` elige con qué librería
+    se escribe el archivo (ver ExcelExporter.MOTORES) y ``compacto`` activa
+    MemoriaCompacta para esta ejecución. ``cargar_reporte`` recibe el tipo
+    ("r1" o "r2"), la ruta y el modo compacto, y con este último devuelve el
+    reporte ya compactado. Al empezar se llama ``reiniciar_codificador``
+    (por defecto CodificadorConsecutivos.reiniciar); quien guarde reportes
+    codificados entre ejecuciones debe recodificarlos ahí.
+    """
+    
+    TOTAL_ETAPAS = 7
+    MENSAJE_SIN_REGISTROS = ("No quedaron registros después de aplicar los filtros.\n\n"
+                             "Posibles causas:\n"
+                             "• El filtro de usuario es muy restrictivo\n"
+                             "• No hay consecutivos que empiecen con 'E'\n"
+                             "• No hay coincidencias entre ambos reportes")
+    MENSAJE_SIN_NUEVAS = ("No hay facturas nuevas: las {omitidas:,} facturas de los reportes ya fueron exportadas.\n\n"
+                          "Desmarca 'Omitir facturas ya exportadas' para generarlas de nuevo.")
+    
+    def __init__(self, archivo1: str, archivo2: str, plantilla: str,
+                 usuario_filtro: str = "", filtro_exacto: bool = False,
+                 case_sensitive: bool = False, copiar_fecha_vencimiento: bool = False,
+                 cargar_reporte: Optional[Callable[[str, str, bool], pd.DataFrame]] = None,
+                 reiniciar_codificador: Optional[Callable[[], None]] = None, interactivo: bool = False, carpeta_salida: Optional[str] = None,
+                 sufijo_salida: str = "", perfilar: bool = False, duplicados: str = "primero",
+                 omitir_exportados: bool = False, registro: Optional[RegistroExportados] = None,
+                 usar_sqlite: bool = False, motor_excel: str = "openpyxl", compacto: bool = False):
+        self.archivo1 = archivo1
+        self.archivo2 = archivo2
+        self.plantilla = plantilla
+        self.usuario_filtro = usuario_filtro.strip()
+        self.filtro_exacto = filtro_exacto
+        self.case_sensitive = case_sensitive
+        self.copiar_fecha_vencimiento = copiar_fecha_vencimiento
+        self.cargar_reporte = cargar_reporte or ProcesoSiigo.leer_reporte
+        self.reiniciar_codificador = reiniciar_codificador or CodificadorConsecutivos.reiniciar
+        self.interactivo = interactivo
+        self.carpeta_salida = carpeta_salida
+        self.sufijo_salida = sufijo_salida
+        self.perfilar = perfilar
+        self.duplicados = duplicados
+        self.omitir_exportados = omitir_exportados
+        self.registro = registro or RegistroExportados()
+        self.usar_sqlite = usar_sqlite
+        self.motor = None
+        self.motor_excel = motor_excel
+        self.compacto = compacto
+        
+        self.eventos = queue.Queue()
+        self.respuestas = queue.Queue()
+        self.cancelar = threading.Event()
+        self.etapa_actual = 0
+        self.nombre_etapa = ""
+        self.mensaje_etapa = ""
+        self.inicio_etapa = 0.0
+        self.resultado = {}
+        self.consecutivos_exportados = None
+        self.total_etapas = ProcesoSiigo.TOTAL_ETAPAS + (1 if omitir_exportados else 0)
+        self.metricas = MetricasEjecucion()
+
+    @staticmethod
+    def leer_reporte(tipo: str, archivo: str, compacto: bool = False) -> pd.DataFrame:
+        """Lee un reporte desde disco: el 1 ya procesado, el 2 con sus columnas útiles"""
+        if tipo == "r1":
+            return DataProcessor.procesar_reporte1(
+                FileManager.iterar_lotes_columnas(archivo, COLUMNAS_REPORTE1), compacto)
+        df = FileManager.cargar_hoja_con_columnas(archivo, COLUMNAS_REPORTE2, ["usuario"])
+        df = df[[col for col in COLUMNAS_REPORTE2 + ["usuario"] if col in df.columns]]
+        return MemoriaCompacta.compactar(df) if compacto else df
+
+    def emitir(self, evento: str, **datos):
+        """Publica un evento para la interfaz"""
+        self.eventos.put((evento, datos))
+
+    def avisar(self, mensaje: str):
+        """Publica un aviso que no detiene el proceso (por ejemplo, consecutivos repetidos)"""
+        self.emitir("aviso", mensaje=mensaje)
+
+    def etapa(self, nombre: str, mensaje: str, filas_entrada: int = 0, **dataframes: pd.DataFrame):
+        """Marca el inicio de una etapa, revisando antes si se pidió cancelar"""
+        if self.cancelar.is_set():
+            raise ProcesoCancelado()
+        self.etapa_actual += 1
+        self.nombre_etapa = nombre
+        self.mensaje_etapa = mensaje
+        self.informar_memoria("antes de", dataframes)
+        self.inicio_etapa = time.perf_counter()
+        self.metricas.iniciar(nombre, filas_entrada)
+        self.emitir("etapa", etapa=nombre, mensaje=mensaje,
+                    avance=min(self.etapa_actual / self.total_etapas, 1.0))
+
+    def filas(self, cantidad: int, **dataframes: pd.DataFrame):
+        """Informa cuántos registros produjo la etapa en curso y cuánto tardó"""
+        self.metricas.terminar(cantidad)
+        self.emitir("filas", etapa=self.nombre_etapa, mensaje=self.mensaje_etapa, filas=cantidad,
+                    segundos=round(time.perf_counter() - self.inicio_etapa, 3))
+        self.informar_memoria("después de", dataframes)
+
+    def informar_memoria(self, momento: str, dataframes: dict):
+        """En modo compacto, registra en el log cuánto ocupan los DataFrames de la etapa"""
+        if not self.compacto or not dataframes:
+            return
+        detalle = ", ".join(f"{nombre} {MemoriaCompacta.memoria_mb(df):.1f} MB" for nombre, df in dataframes.items())
+        logging.info("Memoria %s %s: %s (RSS %s MB)", momento, self.nombre_etapa, detalle,
+                     MetricasEjecucion.memoria_actual_mb())
+
+    def preguntar(self, titulo: str, mensaje: str) -> bool:
+        """Pide confirmación a la interfaz y espera la respuesta (False si no es interactivo)"""
+        if not self.interactivo:
+            return False
+        self.emitir("pregunta", titulo=titulo, mensaje=mensaje)
+        return self.respuestas.get()
+
+    def ejecutar(self):
+        """Corre el pipeline capturando errores y cancelaciones como eventos"""
+        perfil = cProfile.Profile() if self.perfilar else None
+        if perfil is not None:
+            perfil.enable()
+        
+        archivo_salida = None
+        estado = "error"
+        try:
+            self.reiniciar_codificador()
+            archivo_salida = self._ejecutar()
+            if archivo_salida is None:
+                estado = "detenido"
+                self.emitir("detenido")
+                return
+            if self.cancelar.is_set():
+                raise ProcesoCancelado()
+            self.registrar_exportados(archivo_salida)
+            estado = "fin"
+            self.emitir("fin", **self.resultado)
+        except ProcesoCancelado:
+            # Rollback: ningún archivo parcial o completo queda publicado
+            if archivo_salida and os.path.exists(archivo_salida):
+                os.remove(archivo_salida)
+            estado = "cancelado"
+            logging.info("Proceso cancelado por el usuario")
+            self.emitir("cancelado")
+        except Exception as e:
+            logging.exception("Error durante la ejecución")
+            self.emitir("error", mensaje=str(e))
+        finally:
+            if self.motor is not None:
+                self.motor.cerrar()
+                self.motor = None
+            if perfil is not None:
+                perfil.disable()
+                try:
+                    MetricasEjecucion.guardar_perfil(perfil, self.sufijo_salida)
+                except OSError:
+                    logging.exception("No se pudo guardar el perfil de la ejecución")
+            self.metricas.guardar(
+                estado=estado, archivo1=self.archivo1, archivo2=self.archivo2,
+                usuario_filtro=self.usuario_filtro, archivo_salida=self.resultado.get("archivo"),
+                registros=self.resultado.get("registros", 0), omitidas=self.resultado.get("omitidas", 0),
+                motor_excel=self.motor_excel)
+
+    def registrar_exportados(self, archivo_salida: str):
+        """Anota en el registro los consecutivos del archivo generado (un fallo no invalida el archivo)"""
+        consecutivos = self.motor.consecutivos() if self.motor is not None else self.consecutivos_exportados
+        try:
+            self.registro.registrar(consecutivos, archivo_salida)
+        except sqlite3.Error:
+            logging.exception("No se pudo actualizar el registro de exportados %s", self.registro.ruta)
+
+    def filtrar_usuario(self, r2: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """Aplica el filtro de usuario al Reporte 2 (None si dejó todo afuera y el usuario desiste)"""
+        if self.usuario_filtro:
+            with self.metricas.medir("aplicar_filtro_usuario", len(r2)) as medicion:
+                r2_filtrado, filtro_mensaje, filtro_tipo = DataProcessor.aplicar_filtro_usuario(
+                    r2, self.usuario_filtro, self.filtro_exacto, self.case_sensitive)
+                medicion["filas_salida"] = len(r2_filtrado)
+            self.emitir("filtro", mensaje=filtro_mensaje, tipo=filtro_tipo)
+            logging.info("Filtro de usuario aplicado: %s", filtro_mensaje)
+            
+            # Si no hay registros después del filtro, preguntar si se continúa sin él
+            if len(r2_filtrado) == 0:
+                continuar = self.preguntar(
+                    "Sin Resultados",
+                    f"El filtro de usuario '{self.usuario_filtro}' eliminó todos los registros.\n\n"
+                    "¿Deseas continuar sin filtro de usuario?")
+                if not continuar:
+                    return None
+                self.emitir("filtro", mensaje="ℹ️ Procesando sin filtro de usuario", tipo="info")
+            else:
+                r2 = r2_filtrado
+        return r2
+
+    def _ejecutar(self) -> Optional[str]:
+        """Etapas del proceso; devuelve la ruta generada o None si el usuario desiste"""
+        if self.usar_sqlite:
+            return self._ejecutar_sqlite()
+        
+        # Cargar Reporte 1
+        self.etapa("cargar_reporte1", "📊 Cargando Reporte 1...")
+        r1 = self.cargar_reporte("r1", self.archivo1, self.compacto)
+        logging.info("Reporte 1 procesado con %d registros.", len(r1))
+        self.filas(len(r1), r1=r1)
+
+        # Cargar Reporte 2
+        self.etapa("cargar_reporte2", "📋 Cargando Reporte 2...")
+        r2 = self.cargar_reporte("r2", self.archivo2, self.compacto)
+        self.filas(len(r2), r2=r2)
+
+        # Aplicar filtro de usuario
+        r2 = self.filtrar_usuario(r2)
+        if r2 is None:
+            return None
+
+        # Procesar Reporte 2
+        self.etapa("procesar_reporte2", "🔧 Procesando Reporte 2...", len(r2), r2=r2)
+        r2 = DataProcessor.procesar_reporte2(r2)
+        logging.info("Reporte 2 procesado con %d registros.", len(r2))
+        self.filas(len(r2), r2=r2)
+
+        # Combinar reportes, filtrando cada uno antes del merge
+        self.etapa("combinar_reportes", "🔗 Combinando reportes...", len(r1), r1=r1, r2=r2)
+        r1, r2, registros_sin_coincidencia = DataProcessor.filtrar_para_combinar(r1, r2)
+        df = DataProcessor.combinar_reportes(r1, r2, self.duplicados, self.avisar)
+        logging.info("Registros después del merge: %d", len(df))
+        self.filas(len(df), df=df)
+
+        # Verificar registros sin coincidencia
+        if registros_sin_coincidencia > 0:
+            logging.warning("Se encontraron %d registros sin coincidencia en R2", 
+                          registros_sin_coincidencia)
+
+        # Limpiar datos
+        self.etapa("limpiar_datos", "🧹 Limpiando datos...", len(df), df=df)
+        df = DataProcessor.limpiar_datos(df)
+        self.filas(len(df), df=df)
+
+        if len(df) == 0:
+            raise ValueError(ProcesoSiigo.MENSAJE_SIN_REGISTROS)
+
+        # Omitir las facturas que ya se exportaron en ejecuciones anteriores
+        omitidas = 0
+        if self.omitir_exportados:
+            self.etapa("excluir_exportados", "🗂️ Omitiendo facturas ya exportadas...", len(df))
+            df, omitidas = self.registro.excluir_exportados(df)
+            logging.info("Facturas ya exportadas omitidas: %d", omitidas)
+            self.filas(len(df))
+            
+            if len(df) == 0:
+                raise ValueError(ProcesoSiigo.MENSAJE_SIN_NUEVAS.format(omitidas=omitidas))
+
+        # Preparar estructura final
+        self.etapa("preparar_estructura_final", "📝 Preparando estructura final...", len(df), df=df)
+        df = DataProcessor.preparar_estructura_final(df, self.copiar_fecha_vencimiento)
+        self.filas(len(df), df=df)
+
+        # Generar archivo
+        self.etapa("generar_archivo", "💾 Generando archivo Excel...", len(df))
+        archivo_salida = ExcelExporter.generar_archivo(
+            df, self.plantilla, carpeta_exportados=self.carpeta_salida, sufijo=self.sufijo_salida,
+            motor=self.motor_excel)
+        logging.info("Archivo generado correctamente: %s", archivo_salida)
+        self.filas(len(df))
+        
+        self.consecutivos_exportados = df["Consecutivo"]
+        self.resultado = {"archivo": archivo_salida, "registros": len(df), "omitidas": omitidas}
         return archivo_salida
 
+    def _ejecutar_sqlite(self) -> Optional[str]:
+        """Las mismas etapas de _ejecutar sobre un MotorSQLite, con el resultado en disco"""
+        self.motor = MotorSQLite()
+        
+        # Cargar Reporte 1 por lotes, sin armarlo completo en memoria
+        self.etapa("cargar_reporte1", "📊 Cargando Reporte 1...")
+        filas_r1 = self.motor.cargar_reporte1(FileManager.iterar_lotes_columnas(self.archivo1, COLUMNAS_REPORTE1))
+        logging.info("Reporte 1 cargado en %s con %d registros.", self.motor.ruta, filas_r1)
+        self.filas(filas_r1)
+
+        # Cargar Reporte 2 y aplicar el filtro de usuario
+        self.etapa("cargar_reporte2", "📋 Cargando Reporte 2...")
+        r2 = self.cargar_reporte("r2", self.archivo2, self.compacto)
+        self.filas(len(r2))
+        r2 = self.filtrar_usuario(r2)
+        if r2 is None:
+            return None
+
+        self.etapa("procesar_reporte2", "🔧 Procesando Reporte 2...", len(r2))
+        filas_r2 = self.motor.cargar_reporte2(r2)
+        del r2
+        self.filas(filas_r2)
+
+        self.etapa("combinar_reportes", "🔗 Combinando reportes...", filas_r1)
+        filas, registros_sin_coincidencia = self.motor.combinar(self.duplicados, self.avisar)
+        logging.info("Registros después del merge: %d", filas)
+        self.filas(filas)
+        if registros_sin_coincidencia > 0:
+            logging.warning("Se encontraron %d registros sin coincidencia en R2",
+                          registros_sin_coincidencia)
+
+        self.etapa("limpiar_datos", "🧹 Limpiando datos...", filas)
+        filas = self.motor.limpiar()
+        self.filas(filas)
+        if filas == 0:
+            raise ValueError(ProcesoSiigo.MENSAJE_SIN_REGISTROS)
+
+        omitidas = 0
+        if self.omitir_exportados:
+            self.etapa("excluir_exportados", "🗂️ Omitiendo facturas ya exportadas...", filas)
+            filas, omitidas = self.motor.excluir_exportados(self.registro)
+            logging.info("Facturas ya exportadas omitidas: %d", omitidas)
+            self.filas(filas)
+            if filas == 0:
+                raise ValueError(ProcesoSiigo.MENSAJE_SIN_NUEVAS.format(omitidas=omitidas))
+
+        self.etapa("preparar_estructura_final", "📝 Preparando estructura final...", filas)
+        filas = self.motor.preparar(self.copiar_fecha_vencimiento)
+        self.filas(filas)
+
+        # El exportador recibe el resultado por lotes directamente de la base
+        self.etapa("generar_archivo", "💾 Generando archivo Excel...", filas)
+        archivo_salida = ExcelExporter.generar_archivo(
+            self.motor.lotes(), self.plantilla, carpeta_exportados=self.carpeta_salida, sufijo=self.sufijo_salida,
+            motor=self.motor_excel)
+        logging.info("Archivo generado correctamente: %s", archivo_salida)
+        self.filas(filas)
+        
+        self.resultado = {"archivo": archivo_salida, "registros": filas, "omitidas": omitidas}
+        return archivo_salida
+
+
+class ProcesadorLotes:
+    """Procesa sin interfaz muchos pares de reportes en paralelo a partir de un manifiesto
+
+    El manifiesto es un JSON con una lista de trabajos (o un objeto con la
+    clave "trabajos"). Cada trabajo admite: "nombre", "reporte1", "reporte2",
+    "usuario", "filtro_exacto", "case_sensitive", "fecha_vencimiento",
+    "duplicados" (ver DataProcessor.combinar_reportes), "omitir_exportados"
+    (ver RegistroExportados), "sqlite" (ver MotorSQLite), "compacto" (ver
+    MemoriaCompacta) y "motor_excel" (ver ExcelExporter.MOTORES). Las rutas
+    relativas se resuelven desde la carpeta del manifiesto.
+    """
+    
+    @staticmethod
+    def cargar_manifiesto(ruta: str) -> list:
+        """Lee y valida el manifiesto, devolviendo los trabajos normalizados
+
+        El nombre de cada trabajo va en el nombre de sus archivos de salida:
+        se limita a letras, dígitos, "_", "." y "-", no puede contener ".." y
+        no se puede repetir dentro del manifiesto. Un manifiesto sin trabajos
+        también es un error.
+        """
+        with open(ruta, encoding="utf-8") as f:
+            contenido = json.load(f)
+        trabajos = contenido.get("trabajos", []) if isinstance(contenido, dict) else contenido
+        if not trabajos:
+            raise ValueError(f"El manifiesto {ruta} no tiene trabajos")
+        base = os.path.dirname(os.path.abspath(ruta))
+        
+        normalizados = []
+        indices_nombres = {}
+        for indice, trabajo in enumerate(trabajos, start=1):
+            if not trabajo.get("reporte1") or not trabajo.get("reporte2"):
+                raise ValueError(f"El trabajo {indice} del manifiesto no indica reporte1 y reporte2")
+            if trabajo.get("duplicados", "primero") not in ("primero", "error", "expandir"):
+                raise ValueError(f"El trabajo {indice} del manifiesto tiene un valor de duplicados no válido")
+            if trabajo.get("motor_excel", "openpyxl") not in ExcelExporter.MOTORES:
+                raise ValueError(f"El trabajo {indice} del manifiesto tiene un motor_excel no válido")
+            nombre = re.sub(r"[^\w.-]+", "_", str(trabajo.get("nombre") or f"trabajo{indice}"))
+            if not nombre.strip(".") or ".." in nombre:
+                raise ValueError(f"El trabajo {indice} del manifiesto tiene un nombre no válido: {nombre!r}")
+            if nombre in indices_nombres:
+                raise ValueError(f"Los trabajos {indices_nombres[nombre]} y {indice} del manifiesto "
+                                 f"tienen el mismo nombre: {nombre!r}")
+            indices_nombres[nombre] = indice
+            normalizados.append({
+                "nombre": nombre,
+                "reporte1": os.path.join(base, trabajo["reporte1"]),
+                "reporte2": os.path.join(base, trabajo["reporte2"]),
+                "usuario": ", ".join(IndiceUsuarios.terminos(trabajo.get("usuario") or "")),
+                "filtro_exacto": bool(trabajo.get("filtro_exacto", False)),
+                "case_sensitive": bool(trabajo.get("case_sensitive", False)),
+                "fecha_vencimiento": bool(trabajo.get("fecha_vencimiento", False)),
+                "duplicados": trabajo.get("duplicados", "primero"),
+                "omitir_exportados": bool(trabajo.get("omitir_exportados", False)),
+                "sqlite": bool(trabajo.get("sqlite", False)),
+                "compacto": bool(trabajo.get("compacto", False)),
+                "motor_excel": trabajo.get("motor_excel", "openpyxl"),
+            })
+        return normalizados
+
+    @staticmethod
+    def ejecutar_trabajo(trabajo: dict, plantilla: str, carpeta_salida: str,
+                         perfilar: bool = False) -> dict:
+        """Corre un trabajo en el proceso actual y devuelve su resumen"""
+        inicio = time.perf_counter()
+        proceso = ProcesoSiigo(
+            trabajo["reporte1"], trabajo["reporte2"], plantilla,
+            usuario_filtro=trabajo["usuario"],
+            filtro_exacto=trabajo["filtro_exacto"],
+            case_sensitive=trabajo["case_sensitive"],
+            copiar_fecha_vencimiento=trabajo["fecha_vencimiento"],
+            carpeta_salida=carpeta_salida,
+            sufijo_salida=trabajo["nombre"],
+            perfilar=perfilar,
+            duplicados=trabajo["duplicados"],
+            omitir_exportados=trabajo["omitir_exportados"],
+            usar_sqlite=trabajo["sqlite"],
+            motor_excel=trabajo["motor_excel"],
+            compacto=trabajo["compacto"])
+        proceso.ejecutar()
+        
+        resumen = {"nombre": trabajo["nombre"], "estado": "error", "archivo": None,
+                   "registros": 0, "segundos": 0.0, "etapas": {}, "mensaje": "", "avisos": []}
+        while not proceso.eventos.empty():
+            evento, datos = proceso.eventos.get()
+            if evento == "filas":
+                resumen["etapas"][datos["etapa"]] = {"filas": datos["filas"], "segundos": datos["segundos"]}
+            elif evento == "filtro":
+                resumen["mensaje"] = datos["mensaje"]
+            elif evento == "aviso":
+                resumen["avisos"].append(datos["mensaje"])
+            elif evento == "fin":
+                resumen.update(estado="ok", archivo=datos["archivo"], registros=datos["registros"])
+            elif evento == "detenido":
+                resumen.update(estado="sin_registros",
+                               mensaje=f"El filtro de usuario '{trabajo['usuario']}' eliminó todos los registros")
+            elif evento == "error":
+                resumen["mensaje"] = datos["mensaje"]
+        resumen["segundos"] = round(time.perf_counter() - inicio, 3)
+        return resumen
+
+    @staticmethod
+    def ejecutar(manifiesto: str, plantilla: Optional[str] = None,
+                 carpeta_salida: Optional[str] = None, procesos: Optional[int] = None,
+                 perfilar: bool = False) -> list:
+        """Ejecuta todos los trabajos en un pool de procesos y guarda el resumen en JSON"""
+        trabajos = ProcesadorLotes.cargar_manifiesto(manifiesto)
+        plantilla = plantilla or FileManager.obtener_ruta_recurso("plantilla_siigo.xlsx")
+        carpeta_salida = os.path.abspath(carpeta_salida or os.path.join(os.getcwd(), "Exportados SIIGO"))
+        os.makedirs(carpeta_salida, exist_ok=True)
+        
+        procesos = max(1, min(procesos or os.cpu_count() or 1, len(trabajos)))
+        logging.info("Lote %s: %d trabajos en %d procesos", manifiesto, len(trabajos), procesos)
+        inicio = time.perf_counter()
+        
+        # Los resúmenes quedan en el orden del manifiesto, no en el que terminan
+        resumenes = [None] * len(trabajos)
+        with ProcessPoolExecutor(max_workers=procesos, initializer=configurar_logging) as pool:
+            futuros = {pool.submit(ProcesadorLotes.ejecutar_trabajo, trabajo, plantilla, carpeta_salida,
+                                   perfilar): posicion
+                       for posicion, trabajo in enumerate(trabajos)}
+            for futuro in as_completed(futuros):
+                posicion = futuros[futuro]
+                try:
+                    resumen = futuro.result()
+                except Exception as e:
+                    # Fallo del proceso hijo (no del pipeline, que ya reporta sus errores)
+                    resumen = {"nombre": trabajos[posicion]["nombre"], "estado": "error", "archivo": None,
+                               "registros": 0, "segundos": 0.0, "etapas": {}, "mensaje": str(e),
+                               "avisos": []}
+                resumenes[posicion] = resumen
+                print(ProcesadorLotes.formatear_resumen(resumen), flush=True)
+        
+        total = {
+            "manifiesto": os.path.abspath(manifiesto),
+            "procesos": procesos,
+            "segundos": round(time.perf_counter() - inicio, 3),
+            "trabajos": resumenes,
+        }
+        fecha_hora = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        ruta_resumen = os.path.join(carpeta_salida, f"resumen_lote_{fecha_hora}.json")
+        with open(ruta_resumen, "w", encoding="utf-8") as f:
+            json.dump(total, f, ensure_ascii=False, indent=2)
+        
+        exitosos = sum(1 for r in resumenes if r["estado"] == "ok")
+        print(f"\n{exitosos}/{len(resumenes)} trabajos exitosos en {total['segundos']:.1f} s. "
+              f"Resumen: {ruta_resumen}")
+        logging.info("Lote terminado: %d/%d exitosos. Resumen en %s", exitosos, len(resumenes), ruta_resumen)
+        return resumenes
+
+    @staticmethod
+    def formatear_resumen(resumen: dict) -> str:
+        """Línea legible con el resultado de un trabajo"""
+        if resumen["estado"] == "ok":
+            avisos = "".join(f"\n   ⚠️ {aviso}" for aviso in resumen["avisos"])
+            return (f"✅ {resumen['nombre']}: {resumen['registros']:,} registros en "
+                    f"{resumen['segundos']:.1f} s -> {os.path.basename(resumen['archivo'])}{avisos}")
+        return f"❌ {resumen['nombre']}: {resumen['mensaje']}"
+
+
+class SelectorUsuarios:
+    """Ventana para elegir un usuario del Reporte 2 con búsqueda mientras se escribe
+
+    La lista es virtual: solo existen los botones de las filas visibles y se
+    reutilizan al desplazarse, así que abrir la ventana o filtrar no depende de
+    cuántos usuarios haya. Los prefijos se buscan con bisect sobre la lista
+    ordenada en minúsculas y las subcadenas se filtran sobre el resultado de
+    la búsqueda anterior cuando el texto nuevo la contiene.
+    """
+    
+    FILAS_VISIBLES = 14
+    FILAS_POR_RUEDA = 3
+    COLOR_NORMAL = ("gray75", "gray25")
+    COLOR_SELECCION = "green"
+    
+    def __init__(self, padre, usuarios: list, al_confirmar: Callable[[str], None]):
+        self.usuarios = list(usuarios)
+        self.al_confirmar = al_confirmar
+        self.indice = sorted((usuario.lower(), usuario) for usuario in self.usuarios)
+        self.claves = [clave for clave, _ in self.indice]
+        self.coincidencias = self.usuarios
+        self.ultima_busqueda = ""
+        self.candidatos = self.indice
+        self.primera = 0
+        self.seleccionado = None
+        
+        self.ventana = ctk.CTkToplevel(padre)
+        self.ventana.title("Usuarios Disponibles")
+        self.ventana.geometry("400x600")
+        
+        self.titulo = ctk.CTkLabel(self.ventana,
+                                   text=f"Usuarios encontrados ({len(self.usuarios)}):",
+                                   font=ctk.CTkFont(size=14, weight="bold"))
+        self.titulo.pack(pady=(20, 10))
+        
+        self.entrada = ctk.CTkEntry(self.ventana, width=350,
+                                    placeholder_text="🔍 Buscar usuario...")
+        self.entrada.pack(pady=(0, 10))
+        self.entrada.bind("<KeyRelease>", self.buscar)
+        self.entrada.bind("<Return>", self.confirmar_desde_busqueda)
+        
+        lista = ctk.CTkFrame(self.ventana, fg_color="transparent")
+        lista.pack(pady=5)
+        self.botones = []
+        for fila in range(self.FILAS_VISIBLES):
+            boton = ctk.CTkButton(lista, text="", width=320, height=26,
+                                  fg_color=self.COLOR_NORMAL,
+                                  command=lambda f=fila: self.seleccionar(f))
+            boton.grid(row=fila, column=0, pady=1)
+            self.enlazar_rueda(boton)
+            self.botones.append(boton)
+        self.barra = ctk.CTkScrollbar(lista, command=self.desplazar)
+        self.barra.grid(row=0, column=1, rowspan=self.FILAS_VISIBLES, sticky="ns", padx=(5, 0))
+        self.enlazar_rueda(lista)
+        
+        ctk.CTkButton(self.ventana,
+                      text="Usar Usuario Seleccionado",
+                      command=self.confirmar,
+                      fg_color="green").pack(pady=10)
+        
+        self.mostrar(0)
+        self.entrada.focus_set()
+    
+    def enlazar_rueda(self, widget):
+        """Desplazar la lista con la rueda del mouse (Windows/Mac y Linux)"""
+        widget.bind("<MouseWheel>", self.rueda)
+        widget.bind("<Button-4>", self.rueda)
+        widget.bind("<Button-5>", self.rueda)
+    
+    def filtrar(self, consulta: str) -> list:
+        """Usuarios que contienen la consulta: primero los que empiezan por ella"""
+        consulta = consulta.strip().lower()
+        if not consulta:
+            self.ultima_busqueda, self.candidatos = "", self.indice
+            return self.usuarios
+        
+        inicio = bisect.bisect_left(self.claves, consulta)
+        fin = bisect.bisect_left(self.claves, consulta + "\U0010ffff", inicio)
+        prefijos = [usuario for _, usuario in self.indice[inicio:fin]]
+        
+        # Si la consulta contiene a la anterior, sus coincidencias son un subconjunto
+        if self.ultima_busqueda and self.ultima_busqueda in consulta:
+            base = self.candidatos
+        else:
+            base = self.indice
+        self.candidatos = [(clave, usuario) for clave, usuario in base if consulta in clave]
+        self.ultima_busqueda = consulta
+        
+        return prefijos + [usuario for clave, usuario in self.candidatos
+                           if not clave.startswith(consulta)]
+    
+    def buscar(self, event=None):
+        """Actualizar la lista con el texto de búsqueda"""
+        self.coincidencias = self.filtrar(self.entrada.get())
+        if len(self.coincidencias) == len(self.usuarios):
+            texto = f"Usuarios encontrados ({len(self.usuarios)}):"
+        else:
+            texto = f"Usuarios encontrados ({len(self.coincidencias)} de {len(self.usuarios)}):"
+        self.titulo.configure(text=texto)
+        self.mostrar(0)
+    
+    def mostrar(self, primera: int):
+        """Pintar en los botones las filas visibles a partir de 'primera'"""
+        total = len(self.coincidencias)
+        self.primera = max(0, min(primera, total - self.FILAS_VISIBLES))
+        for fila, boton in enumerate(self.botones):
+            posicion = self.primera + fila
+            if posicion < total:
+                usuario = self.coincidencias[posicion]
+                color = self.COLOR_SELECCION if usuario == self.seleccionado else self.COLOR_NORMAL
+                boton.configure(text=usuario, state="normal", fg_color=color)
+            else:
+                boton.configure(text="", state="disabled", fg_color="transparent")
+        if total:
+            self.barra.set(self.primera / total,
+                           min(1.0, (self.primera + self.FILAS_VISIBLES) / total))
+        else:
+            self.barra.set(0.0, 1.0)
+    
+    def desplazar(self, accion, cantidad, unidad=None):
+        """Comando de la barra de desplazamiento ('moveto' o 'scroll')"""
+        if accion == "moveto":
+            self.mostrar(int(float(cantidad) * len(self.coincidencias)))
+        elif accion == "scroll":
+            paso = self.FILAS_VISIBLES if unidad == "pages" else 1
+            self.mostrar(self.primera + int(cantidad) * paso)
+    
+    def rueda(self, event):
+        """Desplazar unas filas con la rueda del mouse"""
+        if getattr(event, "num", None) == 4 or getattr(event, "delta", 0) > 0:
+            direccion = -1
+        else:
+            direccion = 1
+        self.mostrar(self.primera + direccion * self.FILAS_POR_RUEDA)
+        return "break"
+    
+    def seleccionar(self, fila: int):
+        """Marcar como seleccionado el usuario de una fila visible"""
+        posicion = self.primera + fila
+        if posicion < len(self.coincidencias):
+            self.seleccionado = self.coincidencias[posicion]
+            self.mostrar(self.primera)
+    
+    def confirmar(self):
+        """Usar el usuario seleccionado y cerrar la ventana"""
+        if self.seleccionado:
+            self.al_confirmar(self.seleccionado)
+            self.ventana.destroy()
+    
+    def confirmar_desde_busqueda(self, event=None):
+        """Con Enter se usa el seleccionado o, si no hay, la primera coincidencia"""
+        if not self.seleccionado and self.coincidencias:
+            self.seleccionado = self.coincidencias[0]
+        self.confirmar()
+
 
 class ModernSiigoApp:
     """Aplicación principal con interfaz moderna"""
     
-    def __init__(self):
+    def __init__(self, perfilar: bool = False):
         self.setup_logging()
         self.setup_variables()
+        # Con --perfilar (o SIIGO_PERFILAR=1) solo se perfila la primera ejecución
+        self.perfilar = perfilar
         self.setup_window()
         self.create_widgets()
         self.center_window()  # Mover aquí después de crear widgets
+        # Las librerías de datos se importan cuando la ventana ya está pintada
+        self.root.after(200, self.precargar_librerias)
         
     def setup_logging(self):
         """Configurar logging"""
-        os.chdir(os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__))
-        log_path = os.path.join(os.getcwd(), "siigo_log.txt")
-        logging.basicConfig(
-            filename=log_path,
-            level=logging.INFO,
-            format="%(asctime)s - %(levelname)s - %(message)s"
-        )
+        os.chdir(directorio_aplicacion())
+        configurar_logging()
         
     def setup_variables(self):
         """Configurar variables globales"""
         self.archivo1 = ""
         self.archivo2 = ""
+        
+        # Reportes de la sesión: tipo -> (firma del archivo, Future con el DataFrame, si está compactado).
+        # El lock solo protege el diccionario; el parseo corre fuera de él
+        self.reportes_sesion = {}
+        self.lock_reportes = threading.Lock()
+        
+        # Proceso en ejecución en el hilo de trabajo
+        self.proceso = None
+        
+        # Conteo en vivo de coincidencias del filtro de usuario
+        self.conteo_pendiente = None
+        self.cargando_usuarios = False
+        self.error_usuarios = None
         self.plantilla = FileManager.obtener_ruta_recurso("plantilla_siigo.xlsx")
         
         # Variables de configuración
         self.var_filtro_exacto = None
         self.var_case_sensitive = None
         self.var_fecha_vencimiento = None
+        self.var_omitir_exportados = None
+        self.var_usar_sqlite = None
+        self.var_motor_xlsxwriter = None
+        self.var_memoria_compacta = None
         
         # Colores del tema
         self.colors = {
@@ -307,6 +2934,11 @@ class ModernSiigoApp:
         except:
             pass
 
+    def precargar_librerias(self):
+        """Registrar el tiempo de arranque y precargar pandas/openpyxl en segundo plano"""
+        logging.info("Ventana lista en %.2f s", time.perf_counter() - INICIO_APLICACION)
+        threading.Thread(target=precargar_modulos, daemon=True).start()
+
     def center_window(self):
         """Centrar la ventana en la pantalla después de crear los widgets"""
         self.root.update_idletasks()  # Forzar actualización del tamaño
@@ -437,14 +3069,21 @@ class ModernSiigoApp:
                                          placeholder_text="Ingresa el nombre de usuario",
                                          width=200)
         self.usuario_entry.pack(side="left")
+        self.usuario_entry.bind("<KeyRelease>", self.programar_conteo_usuarios)
         
-        btn_usuarios = ctk.CTkButton(entry_frame,
+        self.btn_usuarios = ctk.CTkButton(entry_frame,
                                    text="Ver Usuarios",
                                    width=100,
                                    fg_color="#1B7B3A",  # Color verde personalizado
                                    hover_color="green",
                                    command=self.mostrar_usuarios_disponibles)
-        btn_usuarios.pack(side="left", padx=(10, 0))
+        self.btn_usuarios.pack(side="left", padx=(10, 0))
+        
+        # Coincidencias del filtro mientras se escribe (varios usuarios separados por comas)
+        self.lbl_coincidencias = ctk.CTkLabel(user_frame,
+                                             text="",
+                                             font=ctk.CTkFont(size=10))
+        self.lbl_coincidencias.pack(anchor="w")
         
         # Opciones de filtro
         options_frame = ctk.CTkFrame(user_frame, fg_color="transparent")
@@ -453,13 +3092,15 @@ class ModernSiigoApp:
         self.var_filtro_exacto = ctk.BooleanVar()
         filtro_exacto_check = ctk.CTkCheckBox(options_frame,
                                              text="Coincidencia exacta",
-                                             variable=self.var_filtro_exacto)
+                                             variable=self.var_filtro_exacto,
+                                             command=self.programar_conteo_usuarios)
         filtro_exacto_check.pack(side="left")
         
         self.var_case_sensitive = ctk.BooleanVar()
         case_sensitive_check = ctk.CTkCheckBox(options_frame,
                                               text="Sensible a mayúsculas",
-                                              variable=self.var_case_sensitive)
+                                              variable=self.var_case_sensitive,
+                                              command=self.programar_conteo_usuarios)
         case_sensitive_check.pack(side="left", padx=(20, 0))
         
         # Label para feedback del filtro
@@ -472,7 +3113,36 @@ class ModernSiigoApp:
         fecha_check = ctk.CTkCheckBox(config_frame,
                                      text="📅 Copiar Fecha de elaboración a Fecha Vencimiento",
                                      variable=self.var_fecha_vencimiento)
-        fecha_check.pack(padx=20, pady=(10, 15))
+        fecha_check.pack(padx=20, pady=(10, 5))
+        
+        # Checkbox facturas ya exportadas (ver RegistroExportados)
+        self.var_omitir_exportados = ctk.BooleanVar()
+        exportados_check = ctk.CTkCheckBox(config_frame,
+                                          text="🗂️ Omitir facturas ya exportadas",
+                                          variable=self.var_omitir_exportados)
+        exportados_check.pack(padx=20, pady=5)
+        
+        # Checkbox motor SQLite para reportes que no caben en memoria (ver MotorSQLite)
+        self.var_usar_sqlite = ctk.BooleanVar()
+        sqlite_check = ctk.CTkCheckBox(config_frame,
+                                      text="🗄️ Procesar en disco con SQLite (reportes muy grandes)",
+                                      variable=self.var_usar_sqlite)
+        sqlite_check.pack(padx=20, pady=5)
+        
+        # Checkbox motor de exportación xlsxwriter (ver ExcelExporter.MOTORES); solo si está instalado
+        self.var_motor_xlsxwriter = ctk.BooleanVar()
+        xlsxwriter_check = ctk.CTkCheckBox(config_frame,
+                                          text="⚡ Exportar con xlsxwriter (más rápido)",
+                                          variable=self.var_motor_xlsxwriter,
+                                          state="normal" if xlsxwriter is not None else "disabled")
+        xlsxwriter_check.pack(padx=20, pady=5)
+        
+        # Checkbox memoria compacta (ver MemoriaCompacta); se lee al iniciar cada proceso
+        self.var_memoria_compacta = ctk.BooleanVar()
+        self.compacta_check = ctk.CTkCheckBox(config_frame,
+                                             text="🧮 Modo de memoria compacta",
+                                             variable=self.var_memoria_compacta)
+        self.compacta_check.pack(padx=20, pady=(5, 15))
 
     def create_execute_section(self, parent):
         """Crear la sección del botón ejecutar"""
@@ -494,6 +3164,17 @@ class ModernSiigoApp:
         self.status_label = ctk.CTkLabel(execute_frame,
                                         text="",
                                         font=ctk.CTkFont(size=12))
+        
+        # Barra de avance y botón cancelar (visibles solo durante el proceso)
+        self.progress_bar = ctk.CTkProgressBar(execute_frame, width=300)
+        self.progress_bar.set(0)
+        
+        self.btn_cancelar = ctk.CTkButton(execute_frame,
+                                         text="Cancelar",
+                                         width=120,
+                                         fg_color=self.colors['danger'],
+                                         hover_color="#C0392B",
+                                         command=self.cancelar_proceso)
 
     def create_footer(self, parent):
         """Crear el footer"""
@@ -523,12 +3204,14 @@ class ModernSiigoApp:
 
     def seleccionar_archivo(self, tipo: str):
         """Seleccionar archivos con feedback visual"""
-        tipos_archivo = [("Excel files", "*.xlsx"), ("Excel files", "*.xls")]
+        tipos_archivo = [("Reportes", "*.xlsx *.xls *.csv *.parquet"), ("Excel files", "*.xlsx"),
+                         ("Excel files", "*.xls"), ("CSV", "*.csv"), ("Parquet", "*.parquet")]
         titulo = f"Seleccionar {'Reporte de Productos' if tipo == 'r1' else 'Reporte de Facturas'}"
         ruta = filedialog.askopenfilename(title=titulo, filetypes=tipos_archivo)
         
         if ruta:
             nombre_archivo = os.path.basename(ruta)
+            self.reportes_sesion.pop(tipo, None)
             
             if tipo == "r1":
                 self.archivo1 = ruta
@@ -537,8 +3220,174 @@ class ModernSiigoApp:
                 
             elif tipo == "r2":
                 self.archivo2 = ruta
+                self.error_usuarios = None
                 self.lbl_r2_status.configure(text=f"✅ {nombre_archivo}")
                 logging.info("Reporte 2 cargado: %s", self.archivo2)
+                self.programar_conteo_usuarios()
+
+    def obtener_reporte(self, tipo: str) -> pd.DataFrame:
+        """Devuelve el reporte de la sesión, parseándolo solo la primera vez
+
+        El Reporte 1 se guarda ya procesado. Del Reporte 2 se guardan las
+        columnas requeridas más 'usuario'; los filtros de usuario trabajan
+        sobre esta copia en lugar de volver a leer el archivo.
+        """
+        archivo = self.archivo1 if tipo == "r1" else self.archivo2
+        return self.obtener_reporte_archivo(tipo, archivo)
+
+    def obtener_reporte_archivo(self, tipo: str, archivo: str, compacto: bool = False) -> pd.DataFrame:
+        """Igual que obtener_reporte, para una ruta dada (pensada para hilos de trabajo)
+
+        El primer hilo que pide un reporte lo parsea; los demás esperan su
+        resultado sin tomar el lock, así el hilo de Tk nunca queda bloqueado
+        por una lectura en curso. Si se pide compacto y el reporte guardado
+        no lo está, se compacta y reemplaza al guardado, sin volver a leerlo.
+        """
+        info = os.stat(archivo)
+        firma = (archivo, info.st_size, info.st_mtime_ns)
+        
+        with self.lock_reportes:
+            guardado = self.reportes_sesion.get(tipo)
+            propio = guardado is None or guardado[0] != firma
+            if propio:
+                guardado = (firma, Future(), compacto)
+                self.reportes_sesion[tipo] = guardado
+        futuro = guardado[1]
+        if not propio:
+            df = futuro.result()
+            if compacto and not guardado[2]:
+                df = MemoriaCompacta.compactar(df)
+                compactado = Future()
+                compactado.set_result(df)
+                with self.lock_reportes:
+                    if self.reportes_sesion.get(tipo) is guardado:
+                        self.reportes_sesion[tipo] = (firma, compactado, True)
+            return df
+        
+        try:
+            df = ProcesoSiigo.leer_reporte(tipo, archivo, compacto)
+        except BaseException as e:
+            # Sin entrada, el próximo pedido vuelve a intentar la lectura
+            with self.lock_reportes:
+                if self.reportes_sesion.get(tipo) is guardado:
+                    del self.reportes_sesion[tipo]
+            futuro.set_exception(e)
+            raise
+        futuro.set_result(df)
+        return df
+
+    def reiniciar_codificador(self):
+        """Vacía las tablas de CodificadorConsecutivos conservando el Reporte 1 de la sesión
+
+        ProcesoSiigo lo llama al empezar cada ejecución; el Reporte 1 guardado
+        está codificado y se recodifica con las tablas nuevas en lugar de
+        volver a leerse.
+        """
+        with self.lock_reportes:
+            guardado = self.reportes_sesion.get("r1")
+            if guardado is None or not guardado[1].done() or guardado[1].exception() is not None:
+                self.reportes_sesion.pop("r1", None)
+                CodificadorConsecutivos.reiniciar()
+                return
+            df = guardado[1].result()
+            recodificado = Future()
+            recodificado.set_result(df.assign(Consecutivo=CodificadorConsecutivos.reiniciar(df["Consecutivo"])))
+            self.reportes_sesion["r1"] = (guardado[0], recodificado, guardado[2])
+
+    def reporte_en_sesion(self, tipo: str) -> Optional[pd.DataFrame]:
+        """Reporte ya parseado en la sesión para el archivo actual, sin leerlo si no lo está"""
+        archivo = self.archivo1 if tipo == "r1" else self.archivo2
+        try:
+            info = os.stat(archivo)
+        except OSError:
+            return None
+        # Lectura sin lock: se llama desde el hilo de Tk (conteo en vivo) y no
+        # debe esperar a otro hilo; un get del diccionario es atómico
+        guardado = self.reportes_sesion.get(tipo)
+        if guardado is not None and guardado[0] == (archivo, info.st_size, info.st_mtime_ns):
+            futuro = guardado[1]
+            if futuro.done() and futuro.exception() is None:
+                return futuro.result()
+        return None
+
+    def en_segundo_plano(self, funcion: Callable, al_terminar: Callable[[Future], None]):
+        """Ejecutar ``funcion`` en un hilo de trabajo y llamar ``al_terminar`` en el hilo de Tk"""
+        futuro = Future()
+        
+        def trabajar():
+            try:
+                futuro.set_result(funcion())
+            except Exception as e:
+                futuro.set_exception(e)
+        
+        def esperar():
+            if futuro.done():
+                al_terminar(futuro)
+            else:
+                self.root.after(100, esperar)
+        
+        threading.Thread(target=trabajar, daemon=True).start()
+        self.root.after(100, esperar)
+
+    def programar_conteo_usuarios(self, _evento=None):
+        """Recalcular las coincidencias del filtro 300 ms después del último cambio"""
+        if self.conteo_pendiente is not None:
+            self.root.after_cancel(self.conteo_pendiente)
+        self.conteo_pendiente = self.root.after(300, self.actualizar_conteo_usuarios)
+
+    def actualizar_conteo_usuarios(self):
+        """Mostrar cuántos usuarios y facturas coinciden con el filtro escrito"""
+        self.conteo_pendiente = None
+        terminos = IndiceUsuarios.terminos(self.usuario_entry.get())
+        if not terminos or not self.archivo2:
+            self.lbl_coincidencias.configure(text="")
+            return
+        if self.error_usuarios == self.archivo2:
+            self.lbl_coincidencias.configure(text="⚠️ No se pudieron leer los usuarios del Reporte 2",
+                                             text_color="orange")
+            return
+        
+        df = self.reporte_en_sesion("r2")
+        if df is None:
+            # El Reporte 2 se lee una sola vez, en segundo plano
+            self.lbl_coincidencias.configure(text="⏳ Leyendo usuarios del Reporte 2...", text_color="gray")
+            if not self.cargando_usuarios:
+                self.cargar_usuarios()
+            return
+        if "usuario" not in df.columns:
+            self.lbl_coincidencias.configure(text="ℹ️ El Reporte 2 no tiene columna 'usuario'", text_color="gray")
+            return
+        
+        indice = IndiceUsuarios.de_reporte(df)
+        usuarios, filas = indice.contar(indice.seleccionar(
+            terminos, self.var_filtro_exacto.get(), self.var_case_sensitive.get()))
+        self.lbl_coincidencias.configure(text=f"👥 {usuarios:,} usuarios · {filas:,} facturas",
+                                         text_color="green" if filas else "orange")
+
+    def cargar_usuarios(self):
+        """Leer el Reporte 2 y construir su índice de usuarios en un hilo de trabajo"""
+        self.cargando_usuarios = True
+        archivo = self.archivo2
+        
+        def cargar():
+            try:
+                df = self.obtener_reporte_archivo("r2", archivo)
+                if "usuario" in df.columns:
+                    IndiceUsuarios.de_reporte(df)
+            except Exception:
+                logging.exception("No se pudieron leer los usuarios de %s", archivo)
+                self.error_usuarios = archivo
+            finally:
+                self.cargando_usuarios = False
+        
+        def esperar():
+            if self.cargando_usuarios:
+                self.root.after(200, esperar)
+            else:
+                self.actualizar_conteo_usuarios()
+        
+        threading.Thread(target=cargar, daemon=True).start()
+        self.root.after(200, esperar)
 
     def mostrar_usuarios_disponibles(self):
         """Mostrar usuarios disponibles en el Reporte 2"""
@@ -546,15 +3395,33 @@ class ModernSiigoApp:
             messagebox.showwarning("Advertencia", "Primero carga el Reporte 2 (Facturas)")
             return
         
-        try:
-            df = FileManager.cargar_hoja_con_columnas(self.archivo2, ["usuario"])
+        df = self.reporte_en_sesion("r2")
+        if df is None:
+            # El Reporte 2 se parsea en un hilo de trabajo; la ventana se abre al terminar
+            self.btn_usuarios.configure(state="disabled", text="Leyendo...")
+            archivo = self.archivo2
             
+            def al_terminar(futuro: Future):
+                self.btn_usuarios.configure(state="normal" if self.proceso is None else "disabled",
+                                            text="Ver Usuarios")
+                if futuro.exception() is not None:
+                    messagebox.showerror("Error", f"Error al cargar usuarios: {futuro.exception()}")
+                elif archivo == self.archivo2:
+                    self.abrir_selector_usuarios(futuro.result())
+            
+            self.en_segundo_plano(lambda: self.obtener_reporte_archivo("r2", archivo), al_terminar)
+            return
+        self.abrir_selector_usuarios(df)
+
+    def abrir_selector_usuarios(self, df: pd.DataFrame):
+        """Abrir el selector con los usuarios del Reporte 2 ya parseado"""
+        try:
             if "usuario" not in df.columns:
                 messagebox.showinfo("Información", "No se encontró la columna 'usuario' en el Reporte 2")
                 return
             
-            usuarios = df["usuario"].dropna().unique()
-            usuarios = sorted([str(u).strip() for u in usuarios if str(u).strip()])
+            usuarios = IndiceUsuarios.de_reporte(df).usuarios
+            usuarios = sorted([u.strip() for u in usuarios if u.strip()])
             
             if not usuarios:
                 messagebox.showinfo("Información", "No se encontraron usuarios en el Reporte 2")
@@ -568,66 +3435,27 @@ class ModernSiigoApp:
 
     def crear_ventana_usuarios(self, usuarios: list):
         """Crear ventana para seleccionar usuarios"""
-        ventana = ctk.CTkToplevel(self.root)
-        ventana.title("Usuarios Disponibles")
-        ventana.geometry("400x500")
-        
-        # Título
-        titulo = ctk.CTkLabel(ventana,
-                             text=f"Usuarios encontrados ({len(usuarios)}):",
-                             font=ctk.CTkFont(size=14, weight="bold"))
-        titulo.pack(pady=(20, 10))
-        
-        # Scrollable frame para usuarios
-        scrollable_frame = ctk.CTkScrollableFrame(ventana, width=350, height=350)
-        scrollable_frame.pack(pady=10)
-        
-        self.usuario_seleccionado = None
-        
-        def seleccionar_usuario(usuario):
-            self.usuario_seleccionado = usuario
-            for widget in scrollable_frame.winfo_children():
-                if isinstance(widget, ctk.CTkButton):
-                    widget.configure(fg_color=("gray75", "gray25"))
-            # Resaltar el seleccionado
-            for widget in scrollable_frame.winfo_children():
-                if isinstance(widget, ctk.CTkButton) and widget.cget("text") == usuario:
-                    widget.configure(fg_color="green")
-        
-        # Crear botones para cada usuario
-        for usuario in usuarios:
-            btn = ctk.CTkButton(scrollable_frame,
-                               text=usuario,
-                               command=lambda u=usuario: seleccionar_usuario(u),
-                               width=300)
-            btn.pack(pady=2)
-        
-        # Botón confirmar
-        def confirmar_seleccion():
-            if hasattr(self, 'usuario_seleccionado') and self.usuario_seleccionado:
-                self.usuario_entry.delete(0, 'end')
-                self.usuario_entry.insert(0, self.usuario_seleccionado)
-                ventana.destroy()
-        
-        btn_confirmar = ctk.CTkButton(ventana,
-                                     text="Usar Usuario Seleccionado",
-                                     command=confirmar_seleccion,
-                                     fg_color="green")
-        btn_confirmar.pack(pady=10)
+        def usar_usuario(usuario):
+            self.usuario_entry.delete(0, 'end')
+            self.usuario_entry.insert(0, usuario)
+            self.programar_conteo_usuarios()
+        
+        SelectorUsuarios(self.root, usuarios, usar_usuario)
 
     def show_status(self, message: str):
         """Mostrar mensaje de estado"""
         self.status_label.configure(text=message)
         self.status_label.pack(pady=(10, 0))
-        self.root.update()
 
     def hide_status(self):
         """Ocultar mensaje de estado"""
         self.status_label.pack_forget()
-        self.root.update()
 
     def ejecutar(self):
-        """Ejecutar el proceso principal"""
+        """Ejecutar el proceso principal en un hilo de trabajo"""
+        if self.proceso is not None:
+            return
+        
         try:
             # Limpiar info previa
             if hasattr(self, 'lbl_filtro_info'):
@@ -643,117 +3471,115 @@ class ModernSiigoApp:
                 raise FileNotFoundError(f"El archivo Reporte 1 no fue encontrado: {self.archivo1}")
             if not os.path.exists(self.archivo2):
                 raise FileNotFoundError(f"El archivo Reporte 2 no fue encontrado: {self.archivo2}")
+        except Exception as e:
+            logging.exception("Error durante la ejecución")
+            messagebox.showerror("Error", f"Ocurrió un error durante el procesamiento:\n\n{str(e)}")
+            return
 
-            # Procesar datos
-            self.show_status("🔄 Iniciando procesamiento...") 
+        # Las opciones se leen aquí: las variables de Tk solo se usan en el hilo principal
+        self.proceso = ProcesoSiigo(
+            self.archivo1, self.archivo2, self.plantilla,
+            usuario_filtro=self.usuario_entry.get(),
+            filtro_exacto=self.var_filtro_exacto.get(),
+            case_sensitive=self.var_case_sensitive.get(),
+            copiar_fecha_vencimiento=self.var_fecha_vencimiento.get(),
+            omitir_exportados=self.var_omitir_exportados.get(),
+            usar_sqlite=self.var_usar_sqlite.get(),
+            motor_excel="xlsxwriter" if self.var_motor_xlsxwriter.get() else "openpyxl",
+            compacto=self.var_memoria_compacta.get(),
+            cargar_reporte=self.obtener_reporte_archivo,
+            reiniciar_codificador=self.reiniciar_codificador,
+            interactivo=True,
+            perfilar=self.perfilar)
+        self.perfilar = False
+        
+        self.set_controles_activos(False)
+        self.show_status("🔄 Iniciando procesamiento...")
+        self.progress_bar.set(0)
+        self.progress_bar.pack(pady=(10, 0))
+        self.btn_cancelar.configure(state="normal", text="Cancelar")
+        self.btn_cancelar.pack(pady=(10, 0))
+        
+        threading.Thread(target=self.proceso.ejecutar, daemon=True).start()
+        self.root.after(100, self.atender_eventos)
+
+    def cancelar_proceso(self):
+        """Pedir la cancelación del proceso; se aplica al terminar la etapa en curso"""
+        if self.proceso is not None:
+            self.proceso.cancelar.set()
+            self.btn_cancelar.configure(state="disabled", text="Cancelando...")
+            self.show_status("⏹️ Cancelando al terminar la etapa actual...")
+
+    def set_controles_activos(self, activos: bool):
+        """Habilitar o deshabilitar los controles que no deben usarse durante el proceso"""
+        estado = "normal" if activos else "disabled"
+        for control in (self.btn_execute, self.btn_r1, self.btn_r2, self.btn_usuarios, self.usuario_entry,
+                        self.compacta_check):
+            control.configure(state=estado)
+
+    def atender_eventos(self):
+        """Procesar los eventos publicados por el hilo de trabajo"""
+        proceso = self.proceso
+        terminado = False
+        while not terminado:
+            try:
+                evento, datos = proceso.eventos.get_nowait()
+            except queue.Empty:
+                break
             
-            # Cargar Reporte 1
-            self.show_status("📊 Cargando Reporte 1...")
-            columnas_r1 = ["factura", "codigo", "referencia", "cantidad", "valor_total"]
-            r1 = FileManager.cargar_hoja_con_columnas(self.archivo1, columnas_r1)
-            r1 = DataProcessor.procesar_reporte1(r1)
-            logging.info("Reporte 1 procesado con %d registros.", len(r1))
-
-            # Cargar Reporte 2
-            self.show_status("📋 Cargando Reporte 2...")
-            columnas_r2 = ["NitEmpresa", "f_fact", "numero", "total"]
-            r2 = FileManager.cargar_hoja_con_columnas(self.archivo2, columnas_r2)
-
-            # Aplicar filtro de usuario
-            usuario_filtro = self.usuario_entry.get().strip()
-            if usuario_filtro:
-                self.show_status(f"👤 Aplicando filtro de usuario: {usuario_filtro}")
-                r2, filtro_mensaje, filtro_tipo = DataProcessor.aplicar_filtro_usuario(
-                    r2, usuario_filtro,
-                    self.var_filtro_exacto.get(),
-                    self.var_case_sensitive.get()
-                )
-                
-                # Mostrar resultado del filtro
+            if evento == "etapa":
+                self.show_status(datos["mensaje"])
+                self.progress_bar.set(datos["avance"])
+            elif evento == "filas":
+                self.show_status(f"{datos['mensaje']} {datos['filas']:,} registros")
+            elif evento == "filtro":
                 color_mensaje = {
                     "success": "green",
                     "warning": "orange",
                     "error": "red",
                     "info": "blue"
-                }.get(filtro_tipo, "gray")
-                
-                self.lbl_filtro_info.configure(text=filtro_mensaje, text_color=color_mensaje)
+                }.get(datos["tipo"], "gray")
+                self.lbl_filtro_info.configure(text=datos["mensaje"], text_color=color_mensaje)
                 self.lbl_filtro_info.pack(pady=(10, 0))
-                
-                logging.info("Filtro de usuario aplicado: %s", filtro_mensaje)
-                
-                # Si no hay registros después del filtro, mostrar advertencia
-                if len(r2) == 0:
-                    self.hide_status()
-                    respuesta = messagebox.askyesno(
-                        "Sin Resultados", 
-                        f"El filtro de usuario '{usuario_filtro}' eliminó todos los registros.\n\n"
-                        "¿Deseas continuar sin filtro de usuario?")
-                    if respuesta:
-                        # Recargar sin filtro
-                        self.show_status("🔄 Recargando sin filtro...") 
-                        r2 = FileManager.cargar_hoja_con_columnas(self.archivo2, columnas_r2)
-                        self.lbl_filtro_info.configure(text="ℹ️ Procesando sin filtro de usuario", 
-                                                     text_color="blue")
-                    else:
-                        return
-
-            # Procesar Reporte 2
-            self.show_status("🔧 Procesando Reporte 2...")
-            r2 = DataProcessor.procesar_reporte2(r2)
-            logging.info("Reporte 2 procesado con %d registros.", len(r2))
-
-            # Combinar reportes
-            self.show_status("🔗 Combinando reportes...") 
-            df = DataProcessor.combinar_reportes(r1, r2)
-            logging.info("Registros después del merge: %d", len(df))
-
-            # Verificar registros sin coincidencia
-            registros_sin_coincidencia = df[df["Identificación tercero"].isna()]
-            if len(registros_sin_coincidencia) > 0:
-                logging.warning("Se encontraron %d registros sin coincidencia en R2", 
-                              len(registros_sin_coincidencia))
-
-            # Limpiar datos
-            self.show_status("🧹 Limpiando datos...") 
-            df = DataProcessor.limpiar_datos(df)
+            elif evento == "aviso":
+                messagebox.showwarning("Aviso", datos["mensaje"])
+            elif evento == "pregunta":
+                proceso.respuestas.put(messagebox.askyesno(datos["titulo"], datos["mensaje"]))
+            else:
+                terminado = True
+                self.finalizar_proceso(evento, datos)
+        
+        if not terminado:
+            self.root.after(100, self.atender_eventos)
 
-            if len(df) == 0:
-                self.hide_status()
-                mensaje_error = "No quedaron registros después de aplicar los filtros.\n\n"
-                mensaje_error += "Posibles causas:\n"
-                mensaje_error += "• El filtro de usuario es muy restrictivo\n"
-                mensaje_error += "• No hay consecutivos que empiecen con 'E'\n"
-                mensaje_error += "• No hay coincidencias entre ambos reportes"
-                raise ValueError(mensaje_error)
-
-            # Preparar estructura final
-            self.show_status("📝 Preparando estructura final...") 
-            df = DataProcessor.preparar_estructura_final(df, self.var_fecha_vencimiento.get())
-
-            # Generar archivo
-            self.show_status("💾 Generando archivo Excel...") 
-            archivo_salida = ExcelExporter.generar_archivo(df, self.plantilla)
-            
-            # Ocultar estado y mostrar resultado
-            self.hide_status()
-            logging.info("Archivo generado correctamente: %s", archivo_salida)
+    def finalizar_proceso(self, evento: str, datos: dict):
+        """Restaurar la interfaz y mostrar el resultado del proceso"""
+        self.proceso = None
+        self.hide_status()
+        self.progress_bar.pack_forget()
+        self.btn_cancelar.pack_forget()
+        self.set_controles_activos(True)
+        
+        if evento == "fin":
+            archivo_salida = datos["archivo"]
+            omitidas = ""
+            if datos.get("omitidas"):
+                omitidas = f"\n🗂️ Facturas ya exportadas omitidas: {datos['omitidas']:,}"
             
             # Mensaje de éxito
             mensaje_exito = f"""¡Proceso completado exitosamente!
 
-📊 Registros procesados: {len(df):,}
+📊 Registros procesados: {datos["registros"]:,}{omitidas}
 📁 Archivo generado: {os.path.basename(archivo_salida)}
 📂 Ubicación: {os.path.dirname(archivo_salida)}
 
 El archivo está listo para importar en SIIGO."""
             
             messagebox.showinfo("¡Éxito!", mensaje_exito)
-
-        except Exception as e:
-            self.hide_status()
-            logging.exception("Error durante la ejecución")
-            messagebox.showerror("Error", f"Ocurrió un error durante el procesamiento:\n\n{str(e)}")
+        elif evento == "cancelado":
+            messagebox.showinfo("Cancelado", "El proceso fue cancelado. No se generó ningún archivo.")
+        elif evento == "error":
+            messagebox.showerror("Error", f"Ocurrió un error durante el procesamiento:\n\n{datos['mensaje']}")
 
     def run(self):
         """Ejecutar la aplicación"""
@@ -762,8 +3588,25 @@ El archivo está listo para importar en SIIGO."""
 
 def main():
     """Función principal"""
+    parser = argparse.ArgumentParser(description="Herramienta de Importación SIIGO - v2")
+    parser.add_argument("--lote", metavar="MANIFIESTO",
+                        help="Procesa sin interfaz los trabajos del manifiesto JSON indicado")
+    parser.add_argument("--salida", help="Carpeta de salida del lote (por defecto 'Exportados SIIGO')")
+    parser.add_argument("--plantilla", help="Plantilla SIIGO a usar en el lote")
+    parser.add_argument("--procesos", type=int, help="Procesos en paralelo (por defecto, núcleos disponibles)")
+    parser.add_argument("--perfilar", action="store_true",
+                        help="Perfila con cProfile la próxima ejecución (en lote, cada trabajo)")
+    args = parser.parse_args()
+    perfilar = args.perfilar or os.environ.get("SIIGO_PERFILAR") == "1"
+    
+    if args.lote:
+        configurar_logging()
+        resumenes = ProcesadorLotes.ejecutar(args.lote, args.plantilla, args.salida, args.procesos,
+                                             perfilar)
+        sys.exit(0 if all(r["estado"] == "ok" for r in resumenes) else 1)
+    
     try:
-        app = ModernSiigoApp()
+        app = ModernSiigoApp(perfilar)
         app.run()
     except Exception as e:
         logging.exception("Error crítico en la aplicación")
@@ -771,4 +3614,5 @@ def main():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
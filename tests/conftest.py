@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import importador_siigo  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def directorio_temporal(tmp_path, monkeypatch):
+    """El log, la caché, las métricas y los registros de cada prueba quedan en una carpeta temporal"""
+    monkeypatch.setattr(importador_siigo, "directorio_aplicacion", lambda: str(tmp_path))
+    monkeypatch.setattr(importador_siigo.CacheReportes, "carpeta", None)
+    return tmp_path
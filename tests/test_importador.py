@@ -0,0 +1,866 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from functools import partial
+from types import SimpleNamespace
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from importador_siigo import (COLUMNAS_REPORTE1, COLUMNAS_REPORTE2, COLUMNAS_SIIGO, CacheReportes, CodificadorConsecutivos,
+                              DataProcessor, ExcelExporter, FileManager, IndiceUsuarios, MemoriaCompacta,
+                              MetricasEjecucion, ModernSiigoApp, PlantillaSiigo, ProcesadorLotes,
+                              ProcesoSiigo, RegistroExportados)
+
+PLANTILLA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plantilla_siigo.xlsx")
+
+
+# --- Reportes de prueba -----------------------------------------------------
+
+def datos_reportes() -> tuple:
+    """Par de reportes pequeños, con facturas que no empiezan con 'E', líneas en cero y usuarios vacíos"""
+    facturas = [f"E{1000 + i}" if i % 10 else f"P{1000 + i}" for i in range(60)]
+    r1 = pd.DataFrame({
+        "factura": [facturas[(i * 7) % len(facturas)] for i in range(200)],
+        "codigo": [f"C{i % 13}" for i in range(200)],
+        "referencia": [f"Examen {i % 13}" for i in range(200)],
+        "cantidad": [1 + i % 3 for i in range(200)],
+        "valor_total": [[0, 10000, 25000.5, 3000][i % 4] for i in range(200)],
+    })
+    r2 = pd.DataFrame({
+        "numero": facturas,
+        "NitEmpresa": [f"{900000000 + i}-{i % 10}" if i % 17 else None for i in range(len(facturas))],
+        "f_fact": [f"2025-01-{1 + i % 28:02d}" for i in range(len(facturas))],
+        "total": [float(1000 * (1 + i % 50)) for i in range(len(facturas))],
+        "usuario": [["ana", "Pedro", "MARIA", "luis gomez", None][i % 5] for i in range(len(facturas))],
+    })
+    return r1, r2
+
+
+@pytest.fixture
+def reportes_csv(tmp_path):
+    """Los reportes de datos_reportes guardados como CSV"""
+    r1, r2 = datos_reportes()
+    ruta_r1, ruta_r2 = str(tmp_path / "r1.csv"), str(tmp_path / "r2.csv")
+    r1.to_csv(ruta_r1, index=False)
+    r2.to_csv(ruta_r2, index=False)
+    return ruta_r1, ruta_r2
+
+
+def reporte_limpio() -> pd.DataFrame:
+    """datos_reportes procesados, combinados y limpios, como llegan a preparar_estructura_final"""
+    r1, r2 = datos_reportes()
+    r2["f_fact"] = pd.to_datetime(r2["f_fact"])
+    r1 = DataProcessor.procesar_reporte1(r1)
+    r2 = DataProcessor.procesar_reporte2(r2)
+    r1, r2, _ = DataProcessor.filtrar_para_combinar(r1, r2)
+    return DataProcessor.limpiar_datos(DataProcessor.combinar_reportes(r1, r2))
+
+
+def ejecutar_proceso(r1: str, r2: str, carpeta, **opciones) -> tuple:
+    """Corre el pipeline sin interfaz; devuelve los eventos y las filas del archivo generado"""
+    proceso = ProcesoSiigo(r1, r2, PLANTILLA, carpeta_salida=str(carpeta), **opciones)
+    proceso.ejecutar()
+    eventos = []
+    while not proceso.eventos.empty():
+        eventos.append(proceso.eventos.get())
+    filas = None
+    if proceso.resultado.get("archivo"):
+        hoja = openpyxl.load_workbook(proceso.resultado["archivo"]).active
+        filas = [[None if valor == "" else valor for valor in fila] for fila in hoja.iter_rows(values_only=True)]
+    return eventos, filas
+
+
+# --- CodificadorConsecutivos -------------------------------------------------
+
+@pytest.fixture
+def tablas_nuevas(monkeypatch):
+    """Tablas de prefijos vacías, para que cada prueba controle los ids que se asignan"""
+    monkeypatch.setattr(CodificadorConsecutivos, "_prefijos", {"": 0})
+    monkeypatch.setattr(CodificadorConsecutivos, "_lista_prefijos", [""])
+    monkeypatch.setattr(CodificadorConsecutivos, "_otros", {})
+    monkeypatch.setattr(CodificadorConsecutivos, "_lista_otros", [])
+
+
+def test_codificador_ida_y_vuelta(tablas_nuevas):
+    consecutivos = pd.Series(["E0001", "E12", "EE007", "FV-000123", "ABC", "", "123", 456,
+                              "E" + "9" * 15, "1234567890123456", "e5"])
+    codigos = CodificadorConsecutivos.codificar(consecutivos)
+
+    assert codigos.dtype == np.int64
+    assert CodificadorConsecutivos.decodificar(codigos).tolist() == consecutivos.astype(str).tolist()
+    # Los ceros a la izquierda distinguen consecutivos con el mismo número
+    assert len(set(CodificadorConsecutivos.codificar(pd.Series(["E1", "E01", "E001"])))) == 3
+
+
+def test_codificador_empaqueta_prefijo_digitos_y_numero(tablas_nuevas):
+    codigo = int(CodificadorConsecutivos.codificar(pd.Series(["E" + "9" * 15]))[0])
+    id_prefijo = CodificadorConsecutivos._prefijos["E"]
+
+    assert codigo == (id_prefijo << 55) | (15 << 50) | (10 ** 15 - 1)
+    assert codigo & ((1 << 50) - 1) == 10 ** 15 - 1
+    # Con 16 dígitos el número son los últimos 15 y el primero queda en el prefijo
+    codigo = int(CodificadorConsecutivos.codificar(pd.Series(["1234567890123456"]))[0])
+    assert CodificadorConsecutivos._lista_prefijos[codigo >> 55] == "1"
+    assert codigo & ((1 << 50) - 1) == 234567890123456
+
+
+def test_codificador_ultimo_prefijo_no_desborda(tablas_nuevas):
+    maximo = CodificadorConsecutivos.MAX_PREFIJOS
+    prefijos = [f"P{i}-" for i in range(maximo - 1)]
+    CodificadorConsecutivos.codificar(pd.Series([f"{prefijo}1" for prefijo in prefijos]))
+    assert len(CodificadorConsecutivos._lista_prefijos) == maximo
+
+    # El id más alto con 15 dígitos todavía es un int64 positivo
+    ultimo = pd.Series([f"{prefijos[-1]}{'9' * 15}"])
+    codigo = int(CodificadorConsecutivos.codificar(ultimo)[0])
+    assert codigo == ((maximo - 1) << 55) | (15 << 50) | (10 ** 15 - 1)
+    assert 0 < codigo <= np.iinfo(np.int64).max
+    assert CodificadorConsecutivos.decodificar(pd.Series([codigo])).tolist() == ultimo.tolist()
+
+    # Con la tabla llena, un prefijo nuevo pasa a la tabla de textos (código negativo)
+    nuevo = pd.Series(["Q-1", "Q-2"])
+    codigos = CodificadorConsecutivos.codificar(nuevo)
+    assert (codigos < 0).all()
+    assert CodificadorConsecutivos.decodificar(codigos).tolist() == nuevo.tolist()
+
+
+def test_codificador_quitar_prefijo_e(tablas_nuevas):
+    consecutivos = pd.Series(["E0012", "EE5", "e7", "FV-3", "Eabc", "X"])
+    sin_e = CodificadorConsecutivos.quitar_prefijo_e(CodificadorConsecutivos.codificar(consecutivos))
+
+    assert sin_e.isna().tolist() == [False, False, False, True, False, True]
+    textos = CodificadorConsecutivos.decodificar(sin_e[sin_e.notna()].astype(np.int64))
+    assert textos.tolist() == ["0012", "5", "7", "abc"]
+
+
+def test_codificador_reiniciar_vacia_las_tablas(tablas_nuevas):
+    consecutivos = pd.Series(["E1", "FV-2", "ABC", "sin número", "E1"])
+    codigos = CodificadorConsecutivos.codificar(consecutivos)
+    CodificadorConsecutivos.codificar(pd.Series(["de otra ejecución", "NC-7"]))
+
+    recodificados = CodificadorConsecutivos.reiniciar(codigos)
+
+    assert CodificadorConsecutivos.decodificar(recodificados).tolist() == consecutivos.tolist()
+    assert CodificadorConsecutivos._lista_otros == ["ABC", "sin número"]
+    assert "NC-" not in CodificadorConsecutivos._prefijos
+    assert CodificadorConsecutivos.reiniciar() is None
+    assert CodificadorConsecutivos._lista_prefijos == [""] and CodificadorConsecutivos._otros == {}
+
+
+def test_proceso_reinicia_el_codificador(reportes_csv, tmp_path, tablas_nuevas):
+    CodificadorConsecutivos.codificar(pd.Series(["de otra ejecución"]))
+
+    _, filas = ejecutar_proceso(*reportes_csv, tmp_path)
+
+    assert filas is not None
+    assert "de otra ejecución" not in CodificadorConsecutivos._otros
+
+
+# --- DataProcessor.combinar_reportes -----------------------------------------
+
+def reportes_para_combinar(codificados: bool = False, ordenados: bool = True):
+    r1 = pd.DataFrame({"Consecutivo": ["E1", "E2", "E2", "E3", "E9"],
+                       "Código producto": ["A", "B", "C", "D", "E"]})
+    r2 = pd.DataFrame({"Consecutivo": ["E1", "E2", "E2", "E3"],
+                       "Identificación tercero": ["900", "901", "902", "903"]})
+    if not ordenados:
+        r1, r2 = r1.iloc[::-1].reset_index(drop=True), r2.iloc[::-1].reset_index(drop=True)
+    if codificados:
+        r1["Consecutivo"] = CodificadorConsecutivos.codificar(r1["Consecutivo"])
+        r2["Consecutivo"] = CodificadorConsecutivos.codificar(r2["Consecutivo"])
+    return r1, r2
+
+
+@pytest.mark.parametrize("codificados", [False, True])
+@pytest.mark.parametrize("ordenados", [False, True])
+def test_combinar_sin_repetidos_igual_a_merge(codificados, ordenados):
+    r1, r2 = reportes_para_combinar(codificados, ordenados)
+    r2 = r2.drop_duplicates("Consecutivo", keep="first").reset_index(drop=True)
+    avisos = []
+
+    resultado = DataProcessor.combinar_reportes(r1, r2, avisar=avisos.append)
+
+    pd.testing.assert_frame_equal(resultado, pd.merge(r1, r2, on="Consecutivo", how="left"))
+    assert avisos == []
+
+
+@pytest.mark.parametrize("codificados", [False, True])
+def test_combinar_repetidos_primero(codificados):
+    r1, r2 = reportes_para_combinar(codificados)
+    avisos = []
+
+    resultado = DataProcessor.combinar_reportes(r1, r2, "primero", avisos.append)
+
+    assert len(resultado) == len(r1)
+    assert resultado["Identificación tercero"].iloc[:4].tolist() == ["900", "901", "901", "903"]
+    assert resultado["Identificación tercero"].iloc[4:].isna().all()
+    assert len(avisos) == 1 and "E2" in avisos[0] and "se descartan" in avisos[0]
+
+
+@pytest.mark.parametrize("codificados", [False, True])
+def test_combinar_repetidos_error(codificados):
+    r1, r2 = reportes_para_combinar(codificados)
+
+    with pytest.raises(ValueError, match="E2"):
+        DataProcessor.combinar_reportes(r1, r2, "error")
+
+
+def test_combinar_repetidos_expandir():
+    r1, r2 = reportes_para_combinar()
+    avisos = []
+
+    resultado = DataProcessor.combinar_reportes(r1, r2, "expandir", avisos.append)
+
+    pd.testing.assert_frame_equal(resultado, pd.merge(r1, r2, on="Consecutivo", how="left"))
+    assert len(resultado) == len(r1) + 2
+    assert len(avisos) == 1 and "E2" in avisos[0]
+
+
+def test_aviso_de_repetidos_lista_los_consecutivos():
+    r2 = pd.DataFrame({"Consecutivo": [f"E{i}" for i in range(30)] * 2, "Identificación tercero": "900"})
+    avisos = []
+
+    DataProcessor.combinar_reportes(r2[["Consecutivo"]].head(1), r2, avisar=avisos.append)
+
+    listados = [f"E{i}" for i in range(DataProcessor.MAX_CONSECUTIVOS_AVISO)]
+    assert "30 consecutivos: " + ", ".join(listados) + " y 10 más" in avisos[0]
+
+
+# --- DataProcessor.limpiar_datos y estructura final --------------------------
+
+def limpiar_con_str(df: pd.DataFrame) -> pd.DataFrame:
+    """limpiar_datos como se hacía antes, con las funciones .str de pandas"""
+    df = df.dropna(subset=["Identificación tercero", "Fecha de elaboración", "Valor Forma de Pago"])
+    df = df[df["Consecutivo"].astype(str).str.startswith(("E", "e"))]
+    df["Consecutivo"] = df["Consecutivo"].astype(str).str.lstrip("Ee")
+    df["Identificación tercero"] = df["Identificación tercero"].astype(str).str.split("-").str[0]
+    df["Fecha de elaboración"] = pd.to_datetime(df["Fecha de elaboración"]).dt.date
+    return df
+
+
+def reporte_combinado() -> pd.DataFrame:
+    consecutivos = ["E0012", "EE5", "e7", "eE9", "FV-3", "Eabc", "X", "E", "E12", "E0012", "P44", "E8"]
+    return pd.DataFrame({
+        "Consecutivo": consecutivos,
+        "Código producto": [f"C{i}" for i in range(len(consecutivos))],
+        "Identificación tercero": ["900123-4", "800", 900555, "abc-def-1", "901-2", "-5", "902-1",
+                                   "903", "904-0-1", None, "905-5", "906-6"],
+        "Fecha de elaboración": ["2025-01-02", "2025-01-03", None, "2025-01-04", "2025-01-05", "2025-01-06",
+                                 "2025-01-07", "2025-01-08", "2025-01-09", "2025-01-10", "2025-01-11",
+                                 "2025-01-12"],
+        "Valor Forma de Pago": [100.0, 200.0, 300.0, 400.0, 500.0, 600.0, 700.0, 800.0, 900.0, 1000.0,
+                                1100.0, np.nan],
+    })
+
+
+@pytest.mark.parametrize("modo", ["texto", "codificado", "compacto"])
+def test_limpiar_datos_igual_que_con_str(modo):
+    df = reporte_combinado()
+    if modo != "texto":
+        df["Consecutivo"] = CodificadorConsecutivos.codificar(df["Consecutivo"])
+    if modo == "compacto":
+        df = MemoriaCompacta.compactar(df)
+
+    resultado = DataProcessor.limpiar_datos(df)
+    if modo != "texto":
+        resultado["Consecutivo"] = CodificadorConsecutivos.decodificar(resultado["Consecutivo"])
+    resultado = resultado.astype(object)
+
+    esperado = limpiar_con_str(reporte_combinado()).astype(object)
+    assert resultado["Consecutivo"].tolist() == ["0012", "5", "9", "abc", "", "12"]
+    pd.testing.assert_frame_equal(resultado, esperado)
+
+
+def estructura_con_columnas_vacias(df: pd.DataFrame, copiar_fecha_vencimiento: bool) -> pd.DataFrame:
+    """preparar_estructura_final como se hacía antes, con las columnas fijas y vacías materializadas"""
+    for col in COLUMNAS_SIIGO:
+        if col not in df.columns:
+            df[col] = ""
+    df["Tipo de comprobante"] = 1
+    df["Identificación vendedor"] = 807001777
+    if copiar_fecha_vencimiento:
+        df["Fecha Vencimiento"] = df["Fecha de elaboración"]
+    df = df[COLUMNAS_SIIGO]
+    df["Valor Forma de Pago"] = df.groupby("Consecutivo")["Valor Forma de Pago"].transform("first").astype(object)
+    df.loc[df.duplicated("Consecutivo"), "Valor Forma de Pago"] = ""
+    df["Consecutivo"] = CodificadorConsecutivos.decodificar(df["Consecutivo"])
+    return df
+
+
+@pytest.mark.parametrize("copiar_fecha_vencimiento", [False, True])
+def test_columnas_virtuales_igual_que_materializadas(copiar_fecha_vencimiento):
+    preparado = DataProcessor.preparar_estructura_final(reporte_limpio(), copiar_fecha_vencimiento)
+
+    assert "Tipo de comprobante" not in preparado.columns and "Sucursal" not in preparado.columns
+    esperado = estructura_con_columnas_vacias(reporte_limpio(), copiar_fecha_vencimiento)
+    pd.testing.assert_frame_equal(DataProcessor.materializar(preparado).astype(object), esperado.astype(object))
+
+
+def consolidar_con_groupby(consecutivos: pd.Series, valores: pd.Series) -> pd.Series:
+    """Primer valor no nulo de cada consecutivo en su primera línea, con groupby y duplicated"""
+    primero = valores.groupby(consecutivos, sort=False).transform("first")
+    return primero.where(~consecutivos.duplicated()).astype(float)
+
+
+@pytest.mark.parametrize("ordenados", [False, True])
+@pytest.mark.parametrize("codificados", [False, True])
+@pytest.mark.parametrize("tipo", ["float", "int"])
+def test_consolidar_igual_que_groupby(ordenados, codificados, tipo):
+    consecutivos = pd.Series(["E1", "E1", "E2", "E3", "E3", "E3", "E4", "E5", "E5"] * 3)
+    valores = pd.Series(np.arange(len(consecutivos)) * 100 + 1, dtype=tipo)
+    if tipo == "float":
+        # Un grupo sin ningún valor y otro cuya primera línea no lo tiene
+        valores[consecutivos == "E2"] = np.nan
+        valores[3] = np.nan
+    orden = (np.argsort(consecutivos.to_numpy(), kind="stable") if ordenados
+             else np.random.default_rng(7).permutation(len(consecutivos)))
+    consecutivos, valores = consecutivos[orden].reset_index(drop=True), valores[orden].reset_index(drop=True)
+    if codificados:
+        consecutivos = CodificadorConsecutivos.codificar(consecutivos)
+    assert consecutivos.is_monotonic_increasing == ordenados
+
+    resultado = DataProcessor.consolidar_por_consecutivo(consecutivos, valores)
+
+    assert resultado.dtype == ("Float64" if tipo == "float" else "Int64")
+    pd.testing.assert_series_equal(resultado.astype(float), consolidar_con_groupby(consecutivos, valores))
+
+
+@pytest.mark.parametrize("compacto", [False, True])
+def test_filtrar_antes_del_merge_igual_que_despues(compacto):
+    r1, r2 = datos_reportes()
+    # Líneas de una factura que no está en el Reporte 2
+    r1 = pd.concat([r1, r1.tail(3).assign(factura="E9999")], ignore_index=True)
+    r1 = DataProcessor.procesar_reporte1(r1, compacto)
+    r2 = DataProcessor.procesar_reporte2(MemoriaCompacta.compactar(r2) if compacto else r2)
+
+    combinado = pd.merge(r1, r2, on="Consecutivo", how="left")
+    esperado = DataProcessor.limpiar_datos(combinado).reset_index(drop=True)
+
+    r1_filtrado, r2_filtrado, sin_coincidencia = DataProcessor.filtrar_para_combinar(r1, r2)
+    assert len(r1_filtrado) < len(r1) and len(r2_filtrado) < len(r2)
+    assert sin_coincidencia == combinado["Identificación tercero"].isna().sum() > 3
+    resultado = DataProcessor.limpiar_datos(DataProcessor.combinar_reportes(r1_filtrado, r2_filtrado))
+    pd.testing.assert_frame_equal(resultado.reset_index(drop=True).astype(object), esperado.astype(object))
+
+
+# --- IndiceUsuarios ----------------------------------------------------------
+
+def filtro_con_str(df: pd.DataFrame, usuario: str, filtro_exacto: bool, case_sensitive: bool) -> pd.DataFrame:
+    """Filtro de usuario como se hacía antes del índice, con las funciones .str de pandas"""
+    usuarios = df["usuario"].fillna("").astype(str)
+    if filtro_exacto:
+        mascara = usuarios == usuario if case_sensitive else usuarios.str.lower() == usuario.lower()
+    else:
+        mascara = usuarios.str.contains(usuario, case=case_sensitive, na=False, regex=False)
+    return df[mascara]
+
+
+@pytest.fixture
+def reporte_usuarios():
+    usuarios = ["ana", "Ana María", "ANA", "luis gomez", "Luis Gómez", None, "", "pedro.ana",
+                "Straße", "STRASSE", "İnci", 123, "a+b (x)"]
+    return pd.DataFrame({"usuario": usuarios * 3, "numero": range(len(usuarios) * 3)})
+
+
+@pytest.mark.parametrize("usuario", ["ana", "ANA", "Ana María", "gomez", "Gómez", "strasse", "ß",
+                                     "inci", "123", "+b (", "zzz"])
+@pytest.mark.parametrize("filtro_exacto", [False, True])
+@pytest.mark.parametrize("case_sensitive", [False, True])
+def test_filtro_con_indice_igual_a_str(reporte_usuarios, usuario, filtro_exacto, case_sensitive):
+    esperado = filtro_con_str(reporte_usuarios, usuario, filtro_exacto, case_sensitive)
+
+    resultado, _, tipo = DataProcessor.aplicar_filtro_usuario(reporte_usuarios, usuario, filtro_exacto,
+                                                              case_sensitive)
+
+    assert tipo != "error"
+    assert resultado.index.tolist() == esperado.index.tolist()
+    indice = IndiceUsuarios.de_reporte(reporte_usuarios)
+    seleccion = indice.seleccionar([usuario], filtro_exacto, case_sensitive)
+    assert indice.contar(seleccion)[1] == len(esperado)
+
+
+def test_filtro_con_varios_usuarios(reporte_usuarios):
+    esperado = filtro_con_str(reporte_usuarios, "gomez", False, False).index.union(
+        filtro_con_str(reporte_usuarios, "pedro", False, False).index)
+
+    resultado, _, _ = DataProcessor.aplicar_filtro_usuario(reporte_usuarios, "gomez, pedro")
+
+    assert resultado.index.tolist() == esperado.tolist()
+
+
+def test_indice_usuarios_se_construye_una_vez(reporte_usuarios):
+    assert IndiceUsuarios.de_reporte(reporte_usuarios) is IndiceUsuarios.de_reporte(reporte_usuarios)
+    assert IndiceUsuarios.de_reporte(reporte_usuarios.copy()) is not IndiceUsuarios.de_reporte(reporte_usuarios)
+
+
+# --- RegistroExportados ------------------------------------------------------
+
+def test_registro_omite_consecutivos_ya_exportados(tmp_path):
+    registro = RegistroExportados(str(tmp_path / "exportados.db"))
+
+    assert registro.registrar(pd.Series(["1001", "1002"]), "SIIGO_1.xlsx") == 2
+    assert registro.registrar(["1002", "1003"], "SIIGO_2.xlsx") == 1
+
+    df = pd.DataFrame({"Consecutivo": ["1001", "1004", "1002", "1004", "1005"], "fila": range(5)})
+    resultado, omitidas = registro.excluir_exportados(df)
+    assert omitidas == 2
+    assert resultado["Consecutivo"].tolist() == ["1004", "1004", "1005"]
+
+    # Con la columna codificada se omiten los mismos consecutivos
+    df["Consecutivo"] = CodificadorConsecutivos.codificar(df["Consecutivo"])
+    resultado, omitidas = registro.excluir_exportados(df)
+    assert omitidas == 2
+    assert CodificadorConsecutivos.decodificar(resultado["Consecutivo"]).tolist() == ["1004", "1004", "1005"]
+
+
+@pytest.mark.parametrize("usar_sqlite", [False, True])
+def test_proceso_omite_facturas_exportadas_antes(reportes_csv, tmp_path, usar_sqlite):
+    registro = RegistroExportados(str(tmp_path / "exportados.db"))
+    opciones = {"registro": registro, "omitir_exportados": True, "usar_sqlite": usar_sqlite}
+
+    eventos, filas = ejecutar_proceso(*reportes_csv, tmp_path / "primera", **opciones)
+    assert [evento for evento, _ in eventos][-1] == "fin"
+    assert len(filas) > 1
+
+    eventos, filas = ejecutar_proceso(*reportes_csv, tmp_path / "segunda", **opciones)
+    evento, datos = eventos[-1]
+    assert evento == "error" and "No hay facturas nuevas" in datos["mensaje"]
+    assert filas is None
+
+
+# --- MotorSQLite -------------------------------------------------------------
+
+@pytest.mark.parametrize("opciones", [
+    {},
+    {"usuario_filtro": "ana"},
+    {"usuario_filtro": "PEDRO, maria", "filtro_exacto": True},
+    {"copiar_fecha_vencimiento": True},
+    {"duplicados": "expandir"},
+])
+def test_motor_sqlite_igual_que_en_memoria(reportes_csv, tmp_path, opciones):
+    registro = RegistroExportados(str(tmp_path / "exportados.db"))
+    eventos_memoria, en_memoria = ejecutar_proceso(*reportes_csv, tmp_path / "memoria", registro=registro,
+                                                   **opciones)
+    eventos_sqlite, en_sqlite = ejecutar_proceso(*reportes_csv, tmp_path / "sqlite", registro=registro,
+                                                 usar_sqlite=True, **opciones)
+
+    assert eventos_memoria[-1][0] == eventos_sqlite[-1][0] == "fin"
+    assert len(en_memoria) > 1
+    assert en_sqlite == en_memoria
+
+
+def test_motor_sqlite_repetidos(reportes_csv, tmp_path):
+    r1, r2 = reportes_csv
+    facturas = pd.read_csv(r2)
+    pd.concat([facturas, facturas.head(5)]).to_csv(r2, index=False)
+
+    for duplicados in ("primero", "error"):
+        eventos_memoria, en_memoria = ejecutar_proceso(r1, r2, tmp_path / "memoria", duplicados=duplicados)
+        eventos_sqlite, en_sqlite = ejecutar_proceso(r1, r2, tmp_path / "sqlite", duplicados=duplicados,
+                                                     usar_sqlite=True)
+        assert en_sqlite == en_memoria
+        finales = [(evento, datos.get("mensaje")) for evento, datos in eventos_memoria
+                   if evento in ("aviso", "error")]
+        assert finales == [(evento, datos.get("mensaje")) for evento, datos in eventos_sqlite
+                           if evento in ("aviso", "error")]
+        assert finales and "E1001" in finales[0][1]
+
+
+# --- ProcesadorLotes ---------------------------------------------------------
+
+@pytest.mark.parametrize("contenido", [[], {"trabajos": []}, {}])
+def test_manifiesto_sin_trabajos_es_un_error(tmp_path, contenido):
+    manifiesto = tmp_path / "manifiesto.json"
+    manifiesto.write_text(json.dumps(contenido), encoding="utf-8")
+    salida = tmp_path / "salida"
+
+    with pytest.raises(ValueError, match="no tiene trabajos"):
+        ProcesadorLotes.ejecutar(str(manifiesto), PLANTILLA, str(salida))
+    assert not salida.exists()
+
+
+# --- Lectura de Excel -------------------------------------------------------
+
+def guardar_xlsx(ruta: str, hojas: dict) -> str:
+    """Escribe un .xlsx con una hoja por DataFrame; los nulos quedan como celdas vacías"""
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for nombre, df in hojas.items():
+        ws = wb.create_sheet(nombre)
+        ws.append(list(df.columns))
+        for fila in df.astype(object).itertuples(index=False):
+            ws.append([None if pd.isna(valor) else valor for valor in fila])
+    wb.save(ruta)
+    return ruta
+
+
+@pytest.fixture
+def reporte1_xlsx(tmp_path):
+    """Reporte 1 en la segunda hoja, con una columna de más, celdas vacías y cantidades decimales"""
+    r1, _ = datos_reportes()
+    r1["referencia"] = r1["referencia"].where(r1.index % 11 != 0, None)
+    r1["cantidad"] = [2.0 if i % 9 == 0 else 1.5 if i % 23 == 0 else c for i, c in enumerate(r1["cantidad"])]
+    r1["bodega"] = "B1"
+    resumen = pd.DataFrame({"Total": [len(r1)], "Generado": ["2025-01-31"]})
+    return guardar_xlsx(str(tmp_path / "r1.xlsx"), {"Resumen": resumen, "Productos": r1})
+
+
+def test_lotes_de_columnas_iguales_a_read_excel(reporte1_xlsx):
+    lotes = list(FileManager.iterar_lotes_columnas(reporte1_xlsx, COLUMNAS_REPORTE1, tamano_lote=37))
+    esperado = pd.read_excel(reporte1_xlsx, sheet_name="Productos", engine="openpyxl")[COLUMNAS_REPORTE1]
+
+    assert len(lotes) == 6
+    pd.testing.assert_frame_equal(pd.concat(lotes, ignore_index=True), esperado)
+    pd.testing.assert_frame_equal(DataProcessor.procesar_reporte1(iter(lotes)),
+                                  DataProcessor.procesar_reporte1(esperado).reset_index(drop=True))
+
+
+def test_detectar_hoja_por_encabezados(reporte1_xlsx, monkeypatch):
+    assert FileManager.detectar_hoja(reporte1_xlsx, COLUMNAS_REPORTE1) == "Productos"
+    assert FileManager.detectar_hoja(reporte1_xlsx, ["Total"]) == "Resumen"
+    with pytest.raises(ValueError, match="No se encontró una hoja"):
+        FileManager.detectar_hoja(reporte1_xlsx, COLUMNAS_REPORTE2)
+
+    # La hoja encontrada se recuerda sin volver a abrir el libro
+    def sin_abrir(archivo):
+        raise AssertionError("el libro no debía abrirse de nuevo")
+
+    with monkeypatch.context() as parche:
+        parche.setattr(FileManager, "_encabezados_xlsx", sin_abrir)
+        assert FileManager.detectar_hoja(reporte1_xlsx, COLUMNAS_REPORTE1) == "Productos"
+
+    # Si el archivo cambia, la búsqueda se repite
+    r1, _ = datos_reportes()
+    guardar_xlsx(reporte1_xlsx, {"Productos nuevos": r1})
+    os.utime(reporte1_xlsx, ns=(0, 10 ** 18))
+    assert FileManager.detectar_hoja(reporte1_xlsx, COLUMNAS_REPORTE1) == "Productos nuevos"
+
+
+def sin_leer_excel(*args, **kwargs):
+    raise AssertionError("el reporte debía salir de la caché")
+
+
+def test_cache_de_reportes(reporte1_xlsx, tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    leido = pd.concat(FileManager.iterar_lotes_columnas(reporte1_xlsx, COLUMNAS_REPORTE1), ignore_index=True)
+    entradas = os.listdir(CacheReportes.obtener_carpeta())
+    assert len(entradas) == 1 and entradas[0].endswith(".parquet")
+
+    # Una copia con otro nombre tiene el mismo contenido: sale de la caché
+    copia = str(tmp_path / "copia.xlsx")
+    with open(reporte1_xlsx, "rb") as origen, open(copia, "wb") as destino:
+        destino.write(origen.read())
+    with monkeypatch.context() as parche:
+        parche.setattr(FileManager, "_lotes_xlsx", sin_leer_excel)
+        cacheado = pd.concat(FileManager.iterar_lotes_columnas(copia, COLUMNAS_REPORTE1), ignore_index=True)
+    pd.testing.assert_frame_equal(cacheado, leido)
+
+    # Otras columnas son otra entrada, que solo se publica si la lectura termina
+    lotes = FileManager.iterar_lotes_columnas(reporte1_xlsx, ["factura", "valor_total"], tamano_lote=50)
+    assert next(lotes).columns.tolist() == ["factura", "valor_total"]
+    lotes.close()
+    assert len(os.listdir(CacheReportes.obtener_carpeta())) == 1
+    list(FileManager.iterar_lotes_columnas(reporte1_xlsx, ["factura", "valor_total"], tamano_lote=50))
+    assert len(os.listdir(CacheReportes.obtener_carpeta())) == 2
+
+    # Si el contenido cambia, la entrada anterior ya no aplica
+    r1, _ = datos_reportes()
+    guardar_xlsx(reporte1_xlsx, {"Productos": r1.head(10)})
+    os.utime(reporte1_xlsx, ns=(0, 10 ** 18))
+    nuevo = pd.concat(FileManager.iterar_lotes_columnas(reporte1_xlsx, COLUMNAS_REPORTE1), ignore_index=True)
+    pd.testing.assert_frame_equal(nuevo, r1.head(10))
+
+
+def test_cache_de_hoja_completa(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    _, r2 = datos_reportes()
+    ruta = guardar_xlsx(str(tmp_path / "r2.xlsx"), {"Facturas": r2})
+    leido = FileManager.cargar_hoja_con_columnas(ruta, COLUMNAS_REPORTE2)
+
+    with monkeypatch.context() as parche:
+        parche.setattr(FileManager, "detectar_hoja", sin_leer_excel)
+        pd.testing.assert_frame_equal(FileManager.cargar_hoja_con_columnas(ruta, COLUMNAS_REPORTE2), leido)
+
+    # Deshabilitada, la caché no se consulta
+    with monkeypatch.context() as parche:
+        parche.setattr(CacheReportes, "habilitada", False)
+        parche.setattr(FileManager, "detectar_hoja", sin_leer_excel)
+        with pytest.raises(AssertionError, match="caché"):
+            FileManager.cargar_hoja_con_columnas(ruta, COLUMNAS_REPORTE2)
+
+
+@pytest.fixture
+def reporte1_html(tmp_path):
+    """Reporte 1 como lo exporta Sofia: tablas HTML en un .xls, la de datos después de un resumen"""
+    r1, _ = datos_reportes()
+    filas = []
+    for i, fila in enumerate(r1.itertuples(index=False)):
+        factura, codigo, referencia, cantidad, valor = fila
+        if i % 31 == 0:
+            # Celda combinada: pd.read_html repite el texto en cada columna
+            celdas = f"<td>{factura}</td><td colspan='2'>{codigo}</td>"
+        else:
+            celdas = f"<td>{factura}</td><td>{codigo}</td><td>{'' if i % 11 == 0 else referencia}</td>"
+        filas.append(f"<tr>{celdas}<td>{cantidad}</td><td>{valor:,}</td><td>  nota\n  {i}</td></tr>")
+    encabezado = "".join(f"<th>{col}</th>" for col in COLUMNAS_REPORTE1 + ["observacion"])
+    html = ("<html><body><table><tr><th>Reporte</th><th>Total</th></tr><tr><td>Productos</td><td>200</td></tr>"
+            f"</table><table border='1'><thead><tr>{encabezado}</tr></thead><tbody>{''.join(filas)}</tbody>"
+            "</table></body></html>")
+    ruta = tmp_path / "r1.xls"
+    ruta.write_text(html, encoding="utf-8")
+    return str(ruta)
+
+
+def test_xls_html_igual_que_read_html(reporte1_html):
+    pytest.importorskip("lxml")
+    esperado = pd.read_html(reporte1_html)[1]
+
+    assert FileManager.es_html_disfrazado(reporte1_html)
+    assert FileManager.detectar_hoja(reporte1_html, COLUMNAS_REPORTE1) == 1
+    pd.testing.assert_frame_equal(FileManager._leer_tabla_html(reporte1_html, 1), esperado)
+    pd.testing.assert_frame_equal(FileManager.cargar_hoja_con_columnas(reporte1_html, COLUMNAS_REPORTE1),
+                                  esperado)
+    lotes = list(FileManager.iterar_lotes_columnas(reporte1_html, COLUMNAS_REPORTE1, tamano_lote=64))
+    assert len(lotes) == 4
+    pd.testing.assert_frame_equal(pd.concat(lotes, ignore_index=True), esperado[COLUMNAS_REPORTE1])
+
+
+# --- Reportes CSV y Parquet --------------------------------------------------
+
+def test_csv_con_punto_y_coma_y_coma_decimal(tmp_path):
+    r1, _ = datos_reportes()
+    r1["referencia"] = "Exámen " + r1["referencia"]
+    ruta_xlsx, ruta_csv = str(tmp_path / "r1.xlsx"), str(tmp_path / "r1.csv")
+    r1.to_excel(ruta_xlsx, index=False)
+    # Como lo exporta Excel en es-CO: punto y coma, coma decimal y Windows-1252
+    r1.to_csv(ruta_csv, sep=";", decimal=",", encoding="cp1252", index=False)
+
+    assert FileManager.detectar_formato_csv(ruta_csv) == (";", "cp1252", ",")
+    pd.testing.assert_frame_equal(ProcesoSiigo.leer_reporte("r1", ruta_csv),
+                                  ProcesoSiigo.leer_reporte("r1", ruta_xlsx))
+
+
+def test_csv_con_punto_de_miles(tmp_path):
+    ruta = tmp_path / "r1.csv"
+    ruta.write_bytes("factura;codigo;referencia;cantidad;valor_total\r\n"
+                     "E1;C1;Café;1;43750,5\r\n"
+                     "E2;C2;Té;2;1.234.567,25\r\n"
+                     "E3;C3;Pan;3;12\r\n".encode("cp1252"))
+
+    df = FileManager.leer_plano(str(ruta), COLUMNAS_REPORTE1)
+
+    assert df["valor_total"].tolist() == [43750.5, 1234567.25, 12.0]
+    assert df["referencia"].tolist() == ["Café", "Té", "Pan"]
+
+
+def test_csv_con_acentos_despues_de_la_muestra(tmp_path):
+    ruta = tmp_path / "r2.csv"
+    filas = [f"E{i},900{i}-1,2025-01-01,1000,ana" for i in range(5000)] + ["E9999,9009-1,2025-01-01,1000,José"]
+    ruta.write_bytes(("numero,NitEmpresa,f_fact,total,usuario\n" + "\n".join(filas) + "\n").encode("cp1252"))
+    assert ruta.stat().st_size > 64 * 1024
+
+    df = FileManager.leer_plano(str(ruta), COLUMNAS_REPORTE2, ["usuario"])
+
+    assert df["usuario"].iloc[-1] == "José"
+
+
+@pytest.mark.parametrize("formato", ["csv", "parquet"])
+def test_reporte_plano_igual_que_excel(tmp_path, formato):
+    if formato == "parquet":
+        pytest.importorskip("pyarrow")
+    r1, r2 = datos_reportes()
+    r2["f_fact"] = pd.to_datetime(r2["f_fact"])
+    rutas = {}
+    for extension in ("xlsx", formato):
+        for nombre, df in (("r1", r1), ("r2", r2)):
+            ruta = str(tmp_path / f"{nombre}.{extension}")
+            {"xlsx": lambda: df.to_excel(ruta, index=False), "csv": lambda: df.to_csv(ruta, index=False),
+             "parquet": lambda: df.to_parquet(ruta, index=False)}[extension]()
+            rutas[nombre, extension] = ruta
+
+    _, desde_excel = ejecutar_proceso(rutas["r1", "xlsx"], rutas["r2", "xlsx"], tmp_path / "excel")
+    _, desde_plano = ejecutar_proceso(rutas["r1", formato], rutas["r2", formato], tmp_path / formato)
+
+    assert len(desde_excel) > 1
+    assert desde_plano == desde_excel
+
+
+# --- MemoriaCompacta ---------------------------------------------------------
+
+def test_modo_compacto_no_cambia_el_archivo(reportes_csv, tmp_path):
+    _, normal = ejecutar_proceso(*reportes_csv, tmp_path / "normal", usuario_filtro="ana")
+    _, compacto = ejecutar_proceso(*reportes_csv, tmp_path / "compacto", usuario_filtro="ana", compacto=True)
+
+    assert len(normal) > 1
+    assert compacto == normal
+
+
+def test_reporte_de_sesion_se_lee_una_vez_aunque_cambie_el_modo(reportes_csv, monkeypatch):
+    lecturas = []
+    leer_reporte = ProcesoSiigo.leer_reporte
+
+    def contar_lecturas(tipo, archivo, compacto=False):
+        lecturas.append((tipo, compacto))
+        return leer_reporte(tipo, archivo, compacto)
+
+    monkeypatch.setattr(ProcesoSiigo, "leer_reporte", contar_lecturas)
+    # Solo se usan el diccionario y el lock de la sesión, sin crear la ventana
+    app = SimpleNamespace(reportes_sesion={}, lock_reportes=threading.Lock(), archivo2=reportes_csv[1])
+    obtener = partial(ModernSiigoApp.obtener_reporte_archivo, app)
+
+    para_usuarios = obtener("r2", reportes_csv[1])
+    para_ejecutar = obtener("r2", reportes_csv[1], True)
+
+    assert lecturas == [("r2", False)]
+    assert isinstance(para_ejecutar["usuario"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(para_ejecutar.astype(object).where(para_ejecutar.notna(), None),
+                                  para_usuarios.astype(object).where(para_usuarios.notna(), None))
+    # El guardado pasa a ser el compacto: los pedidos siguientes no lo vuelven a convertir
+    assert obtener("r2", reportes_csv[1], True) is para_ejecutar
+    assert ModernSiigoApp.reporte_en_sesion(app, "r2") is para_ejecutar
+
+
+def test_reporte1_de_sesion_se_recodifica_en_cada_ejecucion(reportes_csv, tmp_path, monkeypatch, tablas_nuevas):
+    lecturas = []
+    leer_reporte = ProcesoSiigo.leer_reporte
+
+    def contar_lecturas(tipo, archivo, compacto=False):
+        lecturas.append(tipo)
+        return leer_reporte(tipo, archivo, compacto)
+
+    monkeypatch.setattr(ProcesoSiigo, "leer_reporte", contar_lecturas)
+    app = SimpleNamespace(reportes_sesion={}, lock_reportes=threading.Lock())
+    opciones = {"cargar_reporte": partial(ModernSiigoApp.obtener_reporte_archivo, app),
+                "reiniciar_codificador": partial(ModernSiigoApp.reiniciar_codificador, app)}
+
+    _, primera = ejecutar_proceso(*reportes_csv, tmp_path, sufijo_salida="1", **opciones)
+    CodificadorConsecutivos.codificar(pd.Series(["de otra ejecución"]))
+    _, segunda = ejecutar_proceso(*reportes_csv, tmp_path, sufijo_salida="2", **opciones)
+
+    assert lecturas == ["r1", "r2"]
+    assert "de otra ejecución" not in CodificadorConsecutivos._otros
+    assert segunda == primera
+
+
+# --- PlantillaSiigo ----------------------------------------------------------
+
+def sin_leer_plantilla(plantilla_path):
+    raise AssertionError("la plantilla debía salir de la caché")
+
+
+def test_descriptor_de_plantilla_ida_y_vuelta():
+    leida = PlantillaSiigo.leer(PLANTILLA)
+    datos = json.loads(json.dumps(leida.a_datos()))
+    copia = PlantillaSiigo(**datos)
+
+    assert copia.a_datos() == leida.a_datos()
+    assert copia.estilos == leida.estilos
+    assert copia.estilos_columnas == leida.estilos_columnas
+    assert sum(comentario is not None for comentario in copia.comentarios) > 0
+
+
+def test_descriptor_de_plantilla_en_memoria_y_en_disco(monkeypatch):
+    monkeypatch.setattr(PlantillaSiigo, "_descriptores", {})
+    descriptor = PlantillaSiigo.obtener(PLANTILLA)
+    guardados = [nombre for nombre in os.listdir(CacheReportes.obtener_carpeta()) if nombre.startswith("plantilla_")]
+    assert len(guardados) == 1
+
+    # En el mismo proceso se reutiliza el objeto; en otro, el descriptor del disco
+    with monkeypatch.context() as parche:
+        parche.setattr(PlantillaSiigo, "leer", sin_leer_plantilla)
+        assert PlantillaSiigo.obtener(PLANTILLA) is descriptor
+        parche.setattr(PlantillaSiigo, "_descriptores", {})
+        desde_disco = PlantillaSiigo.obtener(PLANTILLA)
+    assert desde_disco is not descriptor and desde_disco.a_datos() == descriptor.a_datos()
+
+    # Un descriptor dañado se descarta: la plantilla se vuelve a leer y a guardar
+    ruta = os.path.join(CacheReportes.obtener_carpeta(), guardados[0])
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write("{")
+    monkeypatch.setattr(PlantillaSiigo, "_descriptores", {})
+    assert PlantillaSiigo.obtener(PLANTILLA).a_datos() == descriptor.a_datos()
+    with open(ruta, encoding="utf-8") as f:
+        assert json.load(f) == descriptor.a_datos()
+
+
+# --- ExcelExporter -----------------------------------------------------------
+
+def estructura_final(copiar_fecha_vencimiento: bool = True) -> pd.DataFrame:
+    """DataFrame listo para exportar, preparado con DataProcessor a partir de datos_reportes"""
+    return DataProcessor.preparar_estructura_final(reporte_limpio(), copiar_fecha_vencimiento)
+
+
+def celdas(ruta: str) -> list:
+    """Valor, tipo y formato de número de cada celda (un texto vacío cuenta como celda en blanco)"""
+    hoja = openpyxl.load_workbook(ruta).active
+    return [[(None, type(None), None) if celda.value in (None, "") else
+             (celda.value, type(celda.value), celda.number_format) for celda in fila]
+            for fila in hoja.iter_rows()]
+
+
+def test_xlsxwriter_igual_que_openpyxl(tmp_path):
+    pytest.importorskip("xlsxwriter")
+    df = estructura_final()
+
+    rutas = {motor: ExcelExporter.generar_archivo(df, PLANTILLA, carpeta_exportados=str(tmp_path), sufijo=motor,
+                                                  motor=motor)
+             for motor in ExcelExporter.MOTORES}
+
+    con_openpyxl, con_xlsxwriter = celdas(rutas["openpyxl"]), celdas(rutas["xlsxwriter"])
+    assert len(con_openpyxl) == len(df) + 1
+    assert con_xlsxwriter == con_openpyxl
+
+    # El encabezado conserva los comentarios, los anchos y el zoom de la plantilla
+    a, b = (openpyxl.load_workbook(rutas[motor]).active for motor in ExcelExporter.MOTORES)
+    assert [(c.comment.text, c.comment.author) if c.comment else None for c in b[1]] == \
+        [(c.comment.text, c.comment.author) if c.comment else None for c in a[1]]
+    assert any(c.comment for c in a[1])
+    assert {letra: (d.width, d.number_format) for letra, d in b.column_dimensions.items()} == \
+        {letra: (d.width, d.number_format) for letra, d in a.column_dimensions.items()}
+    assert b.sheet_view.zoomScale == a.sheet_view.zoomScale
+
+
+# --- MetricasEjecucion -------------------------------------------------------
+
+def test_metricas_miden_la_memoria_de_cada_etapa(tmp_path):
+    if MetricasEjecucion.memoria_actual_mb() is None:
+        pytest.skip("la memoria residente no se puede medir en esta plataforma")
+    metricas = MetricasEjecucion()
+
+    with metricas.medir("reservar") as medicion:
+        datos = np.ones(16 * 1024 * 1024)  # 128 MB
+        medicion["filas_salida"] = len(datos)
+    with metricas.medir("liberar"):
+        del datos
+    metricas.guardar(estado="fin")
+
+    with open(tmp_path / MetricasEjecucion.ARCHIVO, encoding="utf-8") as f:
+        registro = json.loads(f.readline())
+    reservar, liberar = registro["etapas"]
+    assert reservar["rss_cambio_mb"] > 100 and liberar["rss_cambio_mb"] < -100
+    assert "rss_pico_mb" not in reservar
+    assert registro["rss_pico_proceso_mb"] >= reservar["rss_mb"]
+
+
+# --- Arranque ----------------------------------------------------------------
+
+def test_importar_el_modulo_no_carga_las_librerias_de_datos():
+    codigo = """
+import sys
+import importador_siigo
+pesadas = ("pandas", "numpy", "openpyxl", "lxml", "pyarrow", "xlrd", "xlsxwriter", "customtkinter")
+print(sorted(m for m in pesadas if m in sys.modules))
+importador_siigo.pd.DataFrame
+print("pandas" in sys.modules, "openpyxl" in sys.modules)
+importador_siigo.precargar_modulos()
+print(all(m._objeto is not None for m in importador_siigo.MODULOS_DATOS))
+"""
+    salida = subprocess.run([sys.executable, "-c", codigo], cwd=os.path.dirname(PLANTILLA),
+                            capture_output=True, text=True, check=True).stdout.splitlines()
+
+    assert salida == ["[]", "True False", "True"]